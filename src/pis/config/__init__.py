@@ -10,7 +10,7 @@ if TYPE_CHECKING:
 
 _config: 'Config | None' = None
 _steps: 'list[str] | None' = None
-_task_definitions: 'list[BaseTaskDefinition] | None' = None
+_task_definitions: 'dict[str, list[BaseTaskDefinition]]' = {}
 _scratchpad: 'Scratchpad | None' = None
 
 
@@ -54,21 +54,24 @@ def steps() -> 'list[str]':
     return _steps or []
 
 
-def task_definitions() -> 'list[BaseTaskDefinition]':
-    """Return the task definitions.
+def task_definitions(step: str | None = None) -> 'list[BaseTaskDefinition]':
+    """Return the task definitions of a step.
 
     If the task definitions have not been loaded, they will be loaded from the
     configuration file. The task definitions are stored for subsequent calls.
 
+    :param step: Optional. The name of the step, defaults to the step setting.
+    :type step: str | None
     :return: The task definitions.
     :rtype: list[BaseTaskDefinition]
     """
-    global _config, _task_definitions  # noqa: PLW0602, PLW0603
+    global _config, _task_definitions  # noqa: PLW0602
     init_config()
     assert _config is not None
-    if _task_definitions is None:
-        _task_definitions = _config.get_task_definitions()
-    return _task_definitions
+    step = step or _config.settings.step
+    if step not in _task_definitions:
+        _task_definitions[step] = _config.get_task_definitions(step)
+    return _task_definitions[step]
 
 
 def scratchpad() -> Scratchpad:
@@ -42,11 +42,24 @@ def parse_cli() -> CliSettings:
         formatter_class=HelpFormatter,
     )
 
-    parser.add_argument(
+    steps = parser.add_mutually_exclusive_group(
+        required=not {to_env('step'), to_env('all_steps')} & set(os.environ),
+    )
+
+    steps.add_argument(
         '-s',
         '--step',
-        required=to_env('step') not in os.environ,
-        help='The step to run',
+        help='The step to run, or several of them separated by commas, which will share '
+        'the workers and the manifest of a single run.',
+    )
+
+    steps.add_argument(
+        '-a',
+        '--all',
+        dest='all_steps',
+        action='store_true',
+        default=None,
+        help='Run all the steps in the configuration file.',
     )
 
     parser.add_argument(
@@ -74,9 +87,25 @@ def parse_cli() -> CliSettings:
         '-p',
         '--pool',
         type=int,
-        help='The number of worker proccesses that will be spawned to run tasks'
-        'in the step in parallel. It should be similar to the number of cores,'
-        'but could be higher because there is a lot of I/O blocking.',
+        help='The number of workers that will run tasks in the step in parallel. With '
+        'the process executor, it should be similar to the number of cores, but with '
+        'threads it can be much higher, as tasks are mostly I/O bound.',
+    )
+
+    parser.add_argument(
+        '-x',
+        '--executor',
+        choices=['process', 'thread'],
+        help='The executor that runs the tasks in the step.',
+    )
+
+    parser.add_argument(
+        '-u',
+        '--skip-unchanged',
+        action='store_true',
+        default=None,
+        help='Skip the tasks whose source has not changed since the last run, reusing '
+        'the resources recorded in the manifest.',
     )
 
     parser.add_argument(
@@ -33,6 +33,22 @@ def test_parse_cli_with_step_argument(monkeypatch):
     assert settings.step == 'validation'
 
 
+def test_parse_cli_with_all_argument(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['cli.py', '--all'])
+
+    settings = parse_cli()
+
+    assert settings.all_steps is True
+    assert not settings.step
+
+
+def test_parse_cli_with_step_and_all_arguments(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['cli.py', '--step', 'validation', '--all'])
+
+    with pytest.raises(SystemExit):
+        parse_cli()
+
+
 def test_parse_cli_with_config_file_argument(monkeypatch):
     monkeypatch.setattr(
         'sys.argv',
@@ -7,7 +7,7 @@ from pydantic import ValidationError
 
 from pis.config.cli import parse_cli
 from pis.config.env import parse_env
-from pis.config.models import BaseTaskDefinition, Settings
+from pis.config.models import BaseTaskDefinition, CliSettings, EnvSettings, Settings
 from pis.config.yaml import get_yaml_settings, parse_yaml
 from pis.util.misc import list_str
 
@@ -41,35 +41,62 @@ class Config:
         settings.merge_model(cli_settings)
 
         self.settings = settings
+        self._pick_steps(cli_settings, env_settings)
         self._validate_step()
         logger.info(f'loaded settings: {list_str(self.settings.model_dump(), dict_values=True)}')
         if not self.settings.remote_uri:
             logger.info('no remote URI provided, run will be local')
 
+    def _pick_steps(self, *sources: CliSettings | EnvSettings):
+        """Pick the steps to run from the first source that sets them.
+
+        The steps can be given as a list or as all of them, and both settings are
+        merged on their own. So the source with the highest precedence that sets any
+        of them decides, and a lower one cannot override it with the other setting.
+
+        :param sources: The sources of the settings, in order of precedence.
+        :type sources: CliSettings | EnvSettings
+        """
+        for source in sources:
+            if source.step and source.all_steps:
+                logger.critical('a step and all steps cannot be requested at the same time')
+                raise SystemExit(1)
+            if source.step or source.all_steps:
+                self.settings.step = source.step or ''
+                self.settings.all_steps = bool(source.all_steps)
+                return
+
     def _validate_step(self):
         """Validate the step.
 
-        Makes sure the step specified in the CLI arguments is defined in the
-        configuration file.
+        Makes sure the steps specified in the CLI arguments are defined in the
+        configuration file. If all steps are requested, the step setting is filled
+        with all of them, in the order of the configuration file.
         """
-        if not self.settings.step:
+        if self.settings.all_steps:
+            self.settings.step = ','.join(self.yaml_dict['steps'])
+
+        if not self.settings.step_names:
             logger.critical('empty step argument, please provide a step')
             raise SystemExit(1)
 
-        if self.settings.step not in self.yaml_dict['steps']:
-            logger.critical(f'invalid step: {self.settings.step}')
-            raise SystemExit(1)
+        for step in self.settings.step_names:
+            if step not in self.yaml_dict['steps']:
+                logger.critical(f'invalid step: {step}')
+                raise SystemExit(1)
 
-    def get_task_definitions(self) -> list[BaseTaskDefinition]:
+    def get_task_definitions(self, step: str | None = None) -> list[BaseTaskDefinition]:
         """Validate the task definitions.
 
         Makes sure the task definitions specified in the configuration file for
-        the step the application is going to run are valid.
+        a step the application is going to run are valid.
 
+        :param step: Optional. The name of the step, defaults to the step setting.
+        :type step: str | None
         :return: The list of task definitions.
         :rtype: list[BaseTaskDefinition]
         """
-        step = self.settings.step
+        step = step or self.settings.step
         ts = self.yaml_dict['steps'].get(step)
 
         if not ts:
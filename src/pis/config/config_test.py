@@ -4,7 +4,7 @@ import pytest
 
 from pis.config import settings
 from pis.config.config import Config
-from pis.config.models import BaseTaskDefinition, CliSettings, EnvSettings, Settings, YamlSettings
+from pis.config.models import BaseTaskDefinition, CliSettings, EnvSettings, Settings, TaskDefinition, YamlSettings
 
 
 @pytest.fixture
@@ -26,11 +26,25 @@ def test_config_initialization(c):
     assert isinstance(settings(), Settings)
     assert settings().model_dump(exclude_none=True) == {
         'step': 'step_1',
+        'all_steps': False,
         'config_file': Path('test_cli.yaml'),
         'work_dir': Path('./somewhere'),
         'remote_uri': 'gs://bucket/path/to/file',
         'pool': 5,
+        'executor': 'thread',
         'log_level': 'INFO',
+        'download_cache': False,
+        'download_cache_size': 50,
+        'skip_unchanged': False,
+        'stream_upload': False,
+        'keep_local': True,
+        'remote_copy': False,
+        'composite_upload_threshold': 256,
+        'composite_upload_parts': 16,
+        'http_pool_size': 64,
+        'http_backend': 'requests',
+        'host_concurrency': 8,
+        'host_tasks': 4,
     }
 
 
@@ -58,6 +72,60 @@ def test_validate_step_invalid(c):
     assert e.value.code == 1
 
 
+def test_validate_step_several(c):
+    c.yaml_dict = {'steps': {'step_1': [], 'step_2': []}}
+    c.settings.step = 'step_1, step_2'
+
+    c._validate_step()
+
+    assert c.settings.step_names == ['step_1', 'step_2']
+
+
+def test_validate_step_several_invalid(c):
+    c.settings.step = 'step_1,invalid_step'
+
+    with pytest.raises(SystemExit):
+        c._validate_step()
+
+
+def test_validate_step_all(c):
+    c.yaml_dict = {'steps': {'step_1': [], 'step_2': []}}
+    c.settings.step = ''
+    c.settings.all_steps = True
+
+    c._validate_step()
+
+    assert c.settings.step_names == ['step_1', 'step_2']
+
+
+@pytest.mark.parametrize(
+    ('cli', 'env', 'step', 'all_steps'),
+    [
+        (CliSettings(step='step_1'), EnvSettings(all_steps=True), 'step_1', False),
+        (CliSettings(all_steps=True), EnvSettings(step='step_1'), 'step_1,step_2', True),
+        (CliSettings(), EnvSettings(all_steps=True), 'step_1,step_2', True),
+        (CliSettings(), EnvSettings(step='step_2'), 'step_2', False),
+    ],
+)
+def test_pick_steps_precedence(mocker, cli, env, step, all_steps):
+    mocker.patch('pis.config.config.parse_cli', return_value=cli)
+    mocker.patch('pis.config.config.parse_env', return_value=env)
+    mocker.patch('pis.config.config.parse_yaml', return_value={'steps': {'step_1': [], 'step_2': []}})
+    mocker.patch('pis.config.config.get_yaml_settings', return_value=YamlSettings())
+
+    config = Config()
+
+    assert config.settings.step == step
+    assert config.settings.all_steps is all_steps
+
+
+def test_pick_steps_step_and_all_steps(c):
+    with pytest.raises(SystemExit) as e:
+        c._pick_steps(EnvSettings(step='step_1', all_steps=True))
+
+    assert e.value.code == 1
+
+
 def test_settings_is_single_instance():
     s1 = settings()
     s2 = settings()
@@ -71,6 +139,22 @@ def test_get_task_definitions(c):
     assert c.get_task_definitions() == [BaseTaskDefinition(name='task_1')]
 
 
+@pytest.mark.parametrize(
+    ('depends_on', 'result'),
+    [
+        (None, []),
+        ('task_1', ['task_1']),
+        (['task_1', 'out/file.txt'], ['task_1', 'out/file.txt']),
+    ],
+)
+def test_task_definition_depends_on(depends_on, result):
+    fields = {'name': 'task_2', 'destination': 'out/other.txt'}
+    if depends_on is not None:
+        fields['depends_on'] = depends_on
+
+    assert TaskDefinition.model_validate(fields).depends_on == result
+
+
 def test_get_task_definitions_validation_error(c):
     c.yaml_dict = {'steps': {'step_1': [{'name': True}]}}
 
@@ -3,11 +3,28 @@
 from pathlib import Path
 from typing import Annotated, Literal
 
-from pydantic import AfterValidator, BaseModel
+from pydantic import AfterValidator, BaseModel, BeforeValidator
 
 LOG_LEVELS = Literal['TRACE', 'DEBUG', 'INFO', 'SUCCESS', 'WARNING', 'ERROR', 'CRITICAL']
 """The log levels."""
 
+EXECUTORS = Literal['process', 'thread']
+"""The executors that can run the tasks, see :mod:`pis.step.executor`."""
+
+HTTP_BACKENDS = Literal['requests', 'httpx']
+"""The libraries that HTTP downloads can be made with, see :mod:`pis.helpers.download`."""
+
+
+def as_list(value: str | list[str]) -> list[str]:
+    """Wrap a single string in a list, so fields can be given as one item or many.
+
+    :param value: The string or list of strings.
+    :type value: str | list[str]
+    :return: The list of strings.
+    :rtype: list[str]
+    """
+    return [value] if isinstance(value, str) else value
+
 
 def remote_uri_is_valid(uri: str) -> str:
     """Validate a remote URI.
@@ -39,12 +56,26 @@ class TaskDefinition(BaseTaskDefinition, BaseModel, extra='allow'):
     This model is used to define the tasks to be run by the application. It includes
     the destination as a required field, as the tasks are expected to create a resource.
 
-    .. note:: PIS is not intended to be used by chaining tasks, as there is no way to
-        generate a dependency graph, all tasks will be sent to the worker pool at the same
-        time.
+    Tasks can be chained with `depends_on`, which lists the tasks that must be done
+    before this one starts, each one given by the name of the task or by the
+    destination of the resource it produces. The tasks of a step form a dependency
+    graph, and each task is sent to the worker pool as soon as its dependencies are
+    done, see :mod:`pis.step.scheduler`.
+
+    .. code-block:: yaml
+
+        steps:
+            - download release to get the release number:
+                source: https://example.com/release.json
+                destination: example/release.json
+            - download data once the release is known:
+                depends_on: example/release.json
+                source: https://example.com/data.tsv
+                destination: example/data.tsv
     """
 
     destination: Path
+    depends_on: Annotated[list[str], BeforeValidator(as_list)] = []
 
 
 class PretaskDefinition(BaseTaskDefinition, BaseModel, extra='allow'):
@@ -55,22 +86,39 @@ class EnvSettings(BaseModel):
     """Environment settings model."""
 
     step: str | None = None
+    all_steps: bool | None = None
     config_file: Path | None = None
     work_dir: Path | None = None
     remote_uri: Annotated[str, AfterValidator(remote_uri_is_valid)] | None = None
     pool: int | None = None
+    executor: EXECUTORS | None = None
     log_level: LOG_LEVELS | None = None
+    download_cache: bool | None = None
+    download_cache_size: int | None = None
+    skip_unchanged: bool | None = None
+    stream_upload: bool | None = None
+    keep_local: bool | None = None
+    remote_copy: bool | None = None
+    composite_upload_threshold: int | None = None
+    composite_upload_parts: int | None = None
+    http_pool_size: int | None = None
+    http_backend: HTTP_BACKENDS | None = None
+    host_concurrency: int | None = None
+    host_tasks: int | None = None
 
 
 class CliSettings(BaseModel):
     """CLI settings model."""
 
     step: str = ''
+    all_steps: bool | None = None
     config_file: Path | None = None
     work_dir: Path | None = None
     remote_uri: Annotated[str, AfterValidator(remote_uri_is_valid)] | None = None
     pool: int | None = None
+    executor: EXECUTORS | None = None
     log_level: LOG_LEVELS | None = None
+    skip_unchanged: bool | None = None
 
 
 class YamlSettings(BaseModel):
@@ -79,7 +127,20 @@ class YamlSettings(BaseModel):
     work_dir: Path | None = None
     remote_uri: Annotated[str, AfterValidator(remote_uri_is_valid)] | None = None
     pool: int | None = None
+    executor: EXECUTORS | None = None
     log_level: LOG_LEVELS | None = None
+    download_cache: bool | None = None
+    download_cache_size: int | None = None
+    skip_unchanged: bool | None = None
+    stream_upload: bool | None = None
+    keep_local: bool | None = None
+    remote_copy: bool | None = None
+    composite_upload_threshold: int | None = None
+    composite_upload_parts: int | None = None
+    http_pool_size: int | None = None
+    http_backend: HTTP_BACKENDS | None = None
+    host_concurrency: int | None = None
+    host_tasks: int | None = None
 
 
 class Settings(BaseModel):
@@ -99,8 +160,12 @@ class Settings(BaseModel):
     """
 
     step: str = ''
-    """The step to run. This is a required field, and its validation is handled by
-    :func:`pis.config.config.Config._validate_step`."""
+    """The step to run, or several of them separated by commas. This is a required
+    field, and its validation is handled by :func:`pis.config.config.Config._validate_step`.
+    See :attr:`step_names`."""
+
+    all_steps: bool = False
+    """Run all the steps in the configuration file, instead of the ones in :attr:`step`."""
 
     config_file: Path = Path('config.yaml')
 
@@ -115,9 +180,80 @@ class Settings(BaseModel):
     pool: int = 5
     """The number of workers in the pool where tasks will run."""
 
+    executor: EXECUTORS = 'thread'
+    """The executor that runs the tasks. Threads are best suited for the network-bound
+    tasks most steps are made of, while processes are best for CPU-bound tasks. See
+    :data:`EXECUTORS`."""
+
     log_level: LOG_LEVELS = 'INFO'
     """See :data:`LOG_LEVELS`."""
 
+    download_cache: bool = False
+    """Whether to keep downloaded files in a cache inside the work directory. The
+    cache is shared across steps and runs, so unchanged sources are not fetched
+    again. See :class:`pis.helpers.download.DownloadCache`."""
+
+    download_cache_size: int = 50
+    """The maximum size of the download cache, in GiB. When it is exceeded, the
+    least recently used files are evicted."""
+
+    skip_unchanged: bool = False
+    """Whether to skip tasks whose source has not changed since the last run. The
+    source metadata recorded in the manifest is checked with a conditional request,
+    and if the source is unchanged, the resource of the last run is reused."""
+
+    stream_upload: bool = False
+    """Whether to upload resources to the remote URI while they are downloaded,
+    instead of after validation. Only tasks that support it will stream their
+    resources, the rest will upload them as usual."""
+
+    keep_local: bool = True
+    """Whether to keep a local copy of the resources uploaded while downloading. See
+    :attr:`stream_upload`."""
+
+    remote_copy: bool = False
+    """Whether to copy resources whose source is in the same remote storage as the
+    remote URI directly in the storage, instead of downloading and uploading them.
+    Only tasks that support it will copy their resources."""
+
+    composite_upload_threshold: int = 256
+    """The size, in MiB, from which files are uploaded in parts that are sent in
+    parallel and then composed into the final object."""
+
+    composite_upload_parts: int = 16
+    """The number of parts a composite upload is split into, up to 32. See
+    :attr:`composite_upload_threshold`."""
+
+    http_pool_size: int = 64
+    """The maximum number of connections kept open to Google Cloud Storage, and to
+    each host downloads are made from, by each process. The clients and their pools
+    are shared by all the tasks in a process."""
+
+    http_backend: HTTP_BACKENDS = 'requests'
+    """The library HTTP downloads are made with. `httpx` needs the optional `httpx`
+    extra, and uses HTTP/2 where the server supports it, so concurrent downloads from
+    a host share a single connection. See :data:`HTTP_BACKENDS`."""
+
+    host_concurrency: int = 8
+    """The maximum number of concurrent transfers from a single host, counting each
+    segment of a ranged download, so upstream servers are not overwhelmed. Set it to
+    0 to disable the limit."""
+
+    host_tasks: int = 4
+    """The maximum number of tasks of a step fetching from the same host at once. The
+    limit is lowered while a host is throttling us, and the pool is filled with tasks
+    for other hosts instead. Set it to 0 to disable the limit. See
+    :mod:`pis.step.scheduler`."""
+
+    @property
+    def step_names(self) -> list[str]:
+        """The names of the steps to run, taken from :attr:`step`.
+
+        :return: The step names, in the order they were given.
+        :rtype: list[str]
+        """
+        return [s.strip() for s in self.step.split(',') if s.strip()]
+
     def merge_model(self, incoming: BaseModel):
         """Merge the fields of another model into this model.
 
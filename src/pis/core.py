@@ -8,7 +8,7 @@ from loguru import logger
 
 from pis.config import init_config, settings
 from pis.manifest.manifest import Manifest
-from pis.step import Step
+from pis.step import Step, execute_steps
 from pis.task import init_task_registry
 from pis.util.fs import check_dir
 from pis.util.logger import init_logger
@@ -23,10 +23,11 @@ def main():
     2. Make some checks on the working directory.
     3. Initialize the logger.
     4. Initialize the task registry, loading all tasks in the tasks module.
-    5. Create a step object based on the configuration.
-    6. Execute the step.
-    7. Create a manifest object and update it with the step information.
-    8. Complete the manifest, saving it both locally and remotely (if configured).
+    5. Create a manifest object, loading the previous manifest if there is one.
+    6. Create a step object for each step in the configuration.
+    7. Execute the steps, sharing a single executor.
+    8. Update the manifest with the steps information.
+    9. Complete the manifest, saving it both locally and remotely (if configured).
     """
     logger.info(f'starting PIS v{version('pis')}')
 
@@ -37,17 +38,19 @@ def main():
     init_task_registry()
 
     logger.debug(f'using {ssl.OPENSSL_VERSION}')
-    logger.debug(f'running with {settings().pool} worker processes')
-
-    step = Step(settings().step)
-    step.execute()
+    logger.debug(f'running with {settings().pool} workers in a {settings().executor} executor')
 
     manifest = Manifest()
-    manifest.update_step(step)
+
+    steps = [Step(name, previous=manifest.get_step(name)) for name in settings().step_names]
+    execute_steps(steps)
+
+    for step in steps:
+        manifest.update_step(step)
     manifest.complete()
 
     if not manifest.run_ok():
-        logger.error('step did not complete successfully')
+        logger.error('step did not complete successfully' if len(steps) == 1 else 'steps did not complete successfully')
         sys.exit(1)
 
     if not manifest.is_completed():
@@ -1,3 +1,3 @@
 """Helper classes used throughout the application."""
 
-from pis.helpers.remote_storage import RemoteStorage, get_remote_storage
+from pis.helpers.remote_storage import RemoteFile, RemoteStorage, compile_pattern, get_remote_storage
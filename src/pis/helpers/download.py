@@ -1,22 +1,503 @@
 """Helper that downloads files from various sources."""
 
+import fcntl
 import functools
+import hashlib
+import os
 import shutil
+import time
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from threading import Event
+from threading import BoundedSemaphore, Event, Lock
+from typing import IO
+from urllib.parse import urlsplit
 
 import requests
+from filelock import FileLock
 from loguru import logger
+from pydantic import BaseModel, ValidationError
 from requests.adapters import HTTPAdapter
 from urllib3 import Retry
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
 
+from pis.config import settings
+from pis.helpers.remote_storage import get_remote_storage
 from pis.storage.google import GoogleStorage
-from pis.util.errors import HelperError, TaskAbortedError
+from pis.util.errors import DownloadError, HelperError, StorageError, TaskAbortedError, ThrottledError
 from pis.util.fs import absolute_path, check_fs
 
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
 # we are going to download big files, better to use a big chunk size
 CHUNK_SIZE = 1024 * 1024 * 10
 REQUEST_TIMEOUT = 10
+# files bigger than this are downloaded in segments over several connections
+RANGED_DOWNLOAD_THRESHOLD = 1024 * 1024 * 256
+RANGED_DOWNLOAD_SEGMENTS = 8
+# number of times an interrupted download is resumed before giving up
+DOWNLOAD_RETRIES = 5
+# directory inside the work dir where the download cache lives
+CACHE_DIR = '.cache'
+# ioctl request to clone a file on copy-on-write filesystems (linux FICLONE)
+FICLONE = 0x40049409
+
+# errors raised when a connection drops in the middle of a transfer
+HTTP_TRANSFER_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    Urllib3HTTPError,
+)
+
+
+# status codes with which servers ask us to slow down, the task is retried later by
+# the step instead of failing, see pis.step.scheduler
+THROTTLE_STATUSES = {429, 503}
+
+# metadata fields that identify a version of a source
+VERSION_IDENTIFIERS = ('etag', 'last_modified', 'generation', 'checksum')
+
+# http sessions are shared by all the downloads of a process, so connections to the
+# same host are kept alive and reused, they are keyed by process id so forked workers
+# don't inherit the sockets of their parent
+_sessions: dict[int, requests.Session] = {}
+# semaphores limiting the concurrent transfers from each host
+_host_slots: dict[str, BoundedSemaphore] = {}
+_httpx_clients: dict[int, 'httpx.Client'] = {}
+_sessions_lock = Lock()
+
+
+def host_slot(url: str) -> AbstractContextManager:
+    """Get a context manager that holds one of the transfer slots of the host of a URL.
+
+    Transfers from a host wait for a free slot if there are already
+    :attr:`pis.config.models.Settings.host_concurrency` of them in flight.
+
+    :param url: The URL that is going to be fetched.
+    :type url: str
+    :return: A context manager holding a slot for the host.
+    :rtype: AbstractContextManager
+    """
+    limit = settings().host_concurrency
+    if limit <= 0:
+        return nullcontext()
+    host = urlsplit(url).netloc
+    with _sessions_lock:
+        if host not in _host_slots:
+            _host_slots[host] = BoundedSemaphore(limit)
+        return _host_slots[host]
+
+
+def raise_if_throttled(src: str, status_code: int, headers: Mapping[str, str]):
+    """Raise a :class:`pis.util.errors.ThrottledError` if a response is a throttle.
+
+    The `Retry-After` header is honoured, both in seconds and as a date.
+
+    :param src: The URL that was fetched.
+    :type src: str
+    :param status_code: The status code of the response.
+    :type status_code: int
+    :param headers: The headers of the response.
+    :type headers: Mapping[str, str]
+    :raises ThrottledError: If the status code is one of :data:`THROTTLE_STATUSES`.
+    """
+    if status_code not in THROTTLE_STATUSES:
+        return
+    retry_after: float | None = None
+    value = headers.get('Retry-After', '').strip()
+    if value.isdigit():
+        retry_after = float(value)
+    elif value:
+        try:
+            retry_after = max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            logger.debug(f'ignoring invalid retry-after header: {value}')
+    raise ThrottledError(src, retry_after)
+
+
+class RangeNotSupportedError(HelperError):
+    """Raise when a server does not honour a range request."""
+
+
+class StreamUploadError(HelperError):
+    """Raise when a download cannot be streamed into its remote destination."""
+
+
+class SourceInfo(BaseModel):
+    """Metadata about a download source, as reported by the server."""
+
+    size: int | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    generation: int | None = None
+    checksum: str | None = None
+    accepts_ranges: bool = False
+
+    def matches(self, other: 'SourceInfo') -> bool:
+        """Tell whether two sets of metadata identify the same version of a source.
+
+        Only the fields known in both are compared, and at least one of them must be
+        a version identifier (ETag, Last-Modified, generation or checksum), as the
+        size alone is not enough to tell two versions apart.
+
+        :param other: The metadata to compare with.
+        :type other: SourceInfo
+        :return: Whether both sets of metadata refer to the same version.
+        :rtype: bool
+        """
+        shared = [f for f in ('size', *VERSION_IDENTIFIERS) if None not in (getattr(self, f), getattr(other, f))]
+        if not any(f in VERSION_IDENTIFIERS for f in shared):
+            return False
+        return all(getattr(self, f) == getattr(other, f) for f in shared)
+
+
+class PartialState(BaseModel):
+    """State of a partial download, stored in a sidecar file next to it.
+
+    The validators (size, ETag, Last-Modified and generation) identify the version
+    of the source the partial file belongs to. Single stream downloads record their
+    progress in `offset`, while ranged downloads record the next byte to write for
+    each segment in `segments`, keyed by the first byte of the segment.
+    """
+
+    size: int | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    generation: int | None = None
+    offset: int = 0
+    segments: dict[int, int] = {}
+
+
+VALIDATORS = {'size', 'etag', 'last_modified', 'generation'}
+
+
+class PartialDownload:
+    """A download that can be resumed after a failure.
+
+    Data is written into a `.part` file next to the destination, and its progress
+    is recorded in a `.part.json` sidecar file. If a previous attempt left both
+    files behind, and the source has not changed since, the download continues from
+    where it was left. Otherwise, the partial file is discarded.
+
+    Sources without any validator (ETag, Last-Modified or generation) cannot be
+    resumed, as there is no way to tell whether they have changed.
+
+    Downloads streamed into a remote upload are only resumed within the same run, as
+    the upload session does not outlive it. Unless
+    :attr:`pis.config.models.Settings.keep_local` is set, their data is not written
+    to disk at all.
+
+    If the source does not report a checksum, the sha256 digest of the data is
+    computed as it is written, and recorded in the checksum of the source metadata
+    once the download is complete, so it ends up in the resource.
+
+    :param dst: The final destination of the download.
+    :type dst: Path
+    :param info: The metadata of the source.
+    :type info: SourceInfo
+    :param streamed: Whether the download is streamed into a remote upload.
+    :type streamed: bool
+    """
+
+    def __init__(self, dst: Path, info: SourceInfo, *, streamed: bool = False):
+        self.dst = dst
+        self.path = dst.with_name(f'{dst.name}.part')
+        self.state_path = dst.with_name(f'{dst.name}.part.json')
+        self.resumable = not streamed and any((info.etag, info.last_modified, info.generation))
+        self.keep = not streamed or settings().keep_local
+        self.state = PartialState.model_validate(info.model_dump(include=VALIDATORS))
+        self.info = info
+        self._lock = Lock()
+        self._saved_progress = 0
+        # digest of the data written so far, or None if it is not written in order
+        self._hashing = info.checksum is None
+        self._hash = hashlib.sha256() if self._hashing else None
+
+        previous = self._load()
+        if previous and self._matches(previous):
+            self.state.offset = min(previous.offset, self.path.stat().st_size)
+            self.state.segments = previous.segments
+            if not self.state.segments:
+                # drop anything written after the last recorded offset
+                os.truncate(self.path, self.state.offset)
+                if self._hashing:
+                    with open(self.path, 'rb') as f:
+                        self._hash = hashlib.file_digest(f, 'sha256')
+            else:
+                self._hash = None
+            self._saved_progress = self._progress()
+            logger.info(f'resuming partial download of {dst} with {self._progress()} bytes')
+        else:
+            self.reset()
+
+    @property
+    def offset(self) -> int:
+        """The number of bytes already written in a single stream download."""
+        return self.state.offset
+
+    def open(self) -> IO[bytes]:
+        """Open the partial file to continue a single stream download.
+
+        :return: The partial file, or a null sink if the data is not kept.
+        :rtype: IO[bytes]
+        """
+        # the caller is responsible for closing the file
+        if not self.keep:
+            return open(os.devnull, 'wb')  # noqa: SIM115
+        return open(self.path, 'ab' if self.offset else 'wb')  # noqa: SIM115
+
+    def _load(self) -> PartialState | None:
+        if not self.path.is_file():
+            return None
+        try:
+            return PartialState.model_validate_json(self.state_path.read_text())
+        except (OSError, ValidationError):
+            return None
+
+    def _matches(self, previous: PartialState) -> bool:
+        if not self.resumable:
+            return False
+        if previous.model_dump(include=VALIDATORS) != self.state.model_dump(include=VALIDATORS):
+            logger.info(f'source of {self.dst} changed since the last attempt, discarding partial download')
+            return False
+        return True
+
+    def _progress(self) -> int:
+        return self.state.offset + sum(o - s for s, o in self.state.segments.items())
+
+    def _save(self, force: bool = False):
+        progress = self._progress()
+        if not self.resumable or (not force and progress - self._saved_progress < CHUNK_SIZE):
+            return
+        self.state_path.write_text(self.state.model_dump_json())
+        self._saved_progress = progress
+
+    def reset(self):
+        """Discard any partial data and start over."""
+        self.path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
+        self.state.offset = 0
+        self.state.segments = {}
+        self._saved_progress = 0
+        self._hash = hashlib.sha256() if self._hashing else None
+
+    def segments(self, starts: list[int]) -> dict[int, int]:
+        """Return the next byte to write for each segment of a ranged download.
+
+        If the partial download was not split into the same segments, it is discarded.
+
+        :param starts: The first byte of each segment.
+        :type starts: list[int]
+        :return: A dictionary with the next byte to write, keyed by segment start.
+        :rtype: dict[int, int]
+        """
+        if self.state.offset or set(self.state.segments) != set(starts):
+            self.reset()
+            self.state.segments = {start: start for start in starts}
+        self._hash = None
+        return dict(self.state.segments)
+
+    def advance(self, data: bytes):
+        """Record more data written in a single stream download."""
+        with self._lock:
+            self.state.offset += len(data)
+            if self._hash:
+                self._hash.update(data)
+            self._save()
+
+    def advance_segment(self, start: int, n: int):
+        """Record `n` more bytes written in the segment beginning at `start`."""
+        with self._lock:
+            self.state.segments[start] += n
+            self._save()
+
+    def checkpoint(self):
+        """Save the current progress to the sidecar file."""
+        with self._lock:
+            self._save(force=True)
+
+    def complete(self) -> Path:
+        """Move the partial file into its final destination.
+
+        If the data is not kept, nothing is moved. The digest of the data is recorded
+        in the source metadata if it has no checksum.
+
+        :return: The destination path.
+        :rtype: Path
+        :raises HelperError: If the partial file size does not match the source size.
+        """
+        size = self.path.stat().st_size if self.keep else self.state.offset
+        if self.state.size is not None and size != self.state.size:
+            raise HelperError(f'downloaded {size} bytes for {self.dst}, expected {self.state.size}')
+        if self._hashing:
+            if self._hash is None:
+                # segments are written out of order, so the file is read again
+                with open(self.path, 'rb') as f:
+                    self._hash = hashlib.file_digest(f, 'sha256')
+            self.info.checksum = f'sha256:{self._hash.hexdigest()}'
+        if not self.keep:
+            return self.dst
+        self.path.replace(self.dst)
+        self.state_path.unlink(missing_ok=True)
+        return self.dst
+
+
+class CacheEntry(BaseModel):
+    """An entry in the download cache index."""
+
+    key: str
+    digest: str
+    size: int
+
+
+class DownloadCache:
+    """Content-addressed cache of downloaded files.
+
+    Files are stored under the cache directory by the sha256 digest of their
+    contents, so the same file coming from different sources is stored only once.
+    An index maps each source, along with the validator that identifies its version
+    (GCS generation, ETag or Last-Modified), to a digest.
+
+    Hits are hardlinked into the destination, falling back to a reflink or a plain
+    copy if the filesystem does not allow it. As a hardlink shares the inode, cached
+    files are made read-only, so the cache cannot be altered through a destination.
+
+    The cache is bounded by :attr:`pis.config.models.Settings.download_cache_size`.
+    When exceeded, the least recently used files are evicted.
+
+    :param root: The cache directory, defaults to `.cache` inside the work directory.
+    :type root: Path | None
+    :param max_size: The maximum size of the cache in bytes, defaults to the value in
+        the settings.
+    :type max_size: int | None
+    """
+
+    def __init__(self, root: Path | None = None, max_size: int | None = None):
+        self.root = root or absolute_path(CACHE_DIR)
+        self.max_size = max_size if max_size is not None else settings().download_cache_size * 1024**3
+        self.objects = self.root / 'objects'
+        self.index = self.root / 'index'
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.index.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(src: str, info: SourceInfo) -> str | None:
+        """Return the cache key for a source.
+
+        :param src: The source URL.
+        :type src: str
+        :param info: The metadata of the source.
+        :type info: SourceInfo
+        :return: The cache key, or `None` if the source has no validator.
+        :rtype: str | None
+        """
+        validator = info.generation or info.etag or info.last_modified
+        if validator is None:
+            return None
+        return f'{src} {validator} {info.size}'
+
+    def _entry_path(self, key: str) -> Path:
+        return self.index / f'{hashlib.sha256(key.encode()).hexdigest()}.json'
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest
+
+    @staticmethod
+    def _link(src: Path, dst: Path):
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+        try:
+            with open(src, 'rb') as fs, open(dst, 'wb') as fd:
+                fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+            return
+        except OSError:
+            dst.unlink(missing_ok=True)
+        shutil.copyfile(src, dst)
+
+    def fetch(self, key: str, dst: Path) -> str | None:
+        """Place the cached file for a key in the destination.
+
+        :param key: The cache key.
+        :type key: str
+        :param dst: The destination path.
+        :type dst: Path
+        :return: The sha256 digest of the file, or `None` if the key was not in the
+            cache.
+        :rtype: str | None
+        """
+        entry_path = self._entry_path(key)
+        try:
+            entry = CacheEntry.model_validate_json(entry_path.read_text())
+        except (OSError, ValidationError):
+            return None
+
+        object_path = self._object_path(entry.digest)
+        try:
+            self._link(object_path, dst)
+            os.utime(object_path)
+        except OSError:
+            # the object was evicted after the index was read
+            entry_path.unlink(missing_ok=True)
+            return None
+
+        logger.info(f'cache hit for {entry.key}')
+        return entry.digest
+
+    def store(self, key: str, path: Path, digest: str | None = None):
+        """Add a downloaded file to the cache.
+
+        :param key: The cache key.
+        :type key: str
+        :param path: The path of the downloaded file.
+        :type path: Path
+        :param digest: Optional. The sha256 digest of the file, if already known.
+        :type digest: str | None
+        """
+        if digest is None:
+            with open(path, 'rb') as f:
+                digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        entry = CacheEntry(key=key, digest=digest, size=path.stat().st_size)
+        object_path = self._object_path(digest)
+
+        with FileLock(self.root / '.lock'):
+            if object_path.is_file():
+                os.utime(object_path)
+            else:
+                object_path.parent.mkdir(exist_ok=True)
+                tmp_path = object_path.with_name(f'{digest}.{os.getpid()}.tmp')
+                self._link(path, tmp_path)
+                tmp_path.chmod(0o444)
+                tmp_path.replace(object_path)
+
+            entry_path = self._entry_path(key)
+            tmp_path = entry_path.with_name(f'{entry_path.name}.{os.getpid()}.tmp')
+            tmp_path.write_text(entry.model_dump_json())
+            tmp_path.replace(entry_path)
+            self._evict()
+
+        logger.debug(f'cached {key} as {digest}')
+
+    def _evict(self):
+        objects = [(p, p.stat()) for p in self.objects.glob('*/*') if not p.name.endswith('.tmp')]
+        total = sum(st.st_size for _, st in objects)
+        if total <= self.max_size:
+            return
+
+        for p, st in sorted(objects, key=lambda o: o[1].st_mtime):
+            logger.debug(f'evicting {p.name} from the download cache')
+            p.unlink(missing_ok=True)
+            total -= st.st_size
+            if total <= self.max_size:
+                break
 
 
 class AbortableStreamWrapper:
@@ -43,10 +524,92 @@ class AbortableStreamWrapper:
         return self.stream.read(*args, **kwargs)
 
 
+class PartialWriter:
+    """A wrapper around a file that records its progress in a partial download.
+
+    Optionally, it will raise a :class:`pis.util.errors.TaskAbortedError` on write if
+    the abort event is set, for the downloads where we do not control the reads.
+
+    It can also copy everything written into a second stream, the `tee`, which is
+    used to upload a file while it is downloaded.
+    """
+
+    def __init__(self, f, partial: PartialDownload, *, abort: Event | None = None, tee: IO[bytes] | None = None):
+        self.f = f
+        self.partial = partial
+        self.abort = abort
+        self.tee = tee
+
+    def write(self, data: bytes) -> int:
+        """Write to the file and record the progress.
+
+        :return: The number of bytes written.
+        :rtype: int
+        :raises TaskAbortedError: If the abort event is set.
+        """
+        if self.abort and self.abort.is_set():
+            raise TaskAbortedError
+        n = self.f.write(data)
+        if self.tee:
+            try:
+                self.tee.write(data)
+            except Exception as e:
+                raise StreamUploadError(f'error streaming upload: {e}')
+        self.partial.advance(data)
+        return n
+
+
 class Downloader:
-    """Base class for downloaders."""
+    """Base class for downloaders.
+
+    :cvar streams: Whether the downloader can copy the data into a `tee` stream as it
+        is downloaded.
+    :vartype streams: bool
+    """
 
-    def download(self, src: str, dst: Path, *, abort: Event | None = None) -> Path:
+    streams = False
+
+    def info(self, src: str) -> SourceInfo:
+        """Get the metadata of a source.
+
+        This method returns empty metadata and should be overridden by subclasses
+        that can get it from the source.
+
+        :param src: The source URL.
+        :type src: str
+        :return: The metadata of the source.
+        :rtype: SourceInfo
+        """
+        return SourceInfo()
+
+    def unchanged(self, src: str, previous: SourceInfo) -> tuple[bool, SourceInfo | None]:
+        """Tell whether a source is unchanged since its metadata was last fetched.
+
+        This method compares the current metadata of the source with the previous
+        one, and can be overridden by subclasses that can ask the server instead.
+        The current metadata is returned along with the answer, so a changed source
+        can be downloaded without fetching it again.
+
+        :param src: The source URL.
+        :type src: str
+        :param previous: The metadata of the source when it was last downloaded.
+        :type previous: SourceInfo
+        :return: Whether the source is unchanged, and its current metadata if it was
+            fetched.
+        :rtype: tuple[bool, SourceInfo | None]
+        """
+        info = self.info(src)
+        return info.matches(previous), info
+
+    def download(
+        self,
+        src: str,
+        dst: Path,
+        *,
+        abort: Event | None = None,
+        info: SourceInfo | None = None,
+        tee: IO[bytes] | None = None,
+    ) -> Path:
         """Download a file from a source to a destination.
 
         This method is a no-op and should be overridden by subclasses.
@@ -57,6 +620,11 @@ class Downloader:
         :type dst: Path
         :param abort: An event that can be set to abort the download, defaults to `None`
         :type abort: Event | None, optional
+        :param info: The metadata of the source, if already known, defaults to `None`
+        :type info: SourceInfo | None, optional
+        :param tee: A stream to copy the data into as it is downloaded, only used by
+            downloaders that support it, defaults to `None`
+        :type tee: IO[bytes] | None, optional
         :return: The destination path.
         :rtype: Path
         """
@@ -86,32 +654,439 @@ class Downloader:
 
 
 class HttpDownloader(Downloader):
-    """Downloader for HTTP and HTTPS URLs."""
+    """Downloader for HTTP and HTTPS URLs.
+
+    If the server accepts range requests and the file is bigger than
+    :data:`RANGED_DOWNLOAD_THRESHOLD`, the file is split into
+    :data:`RANGED_DOWNLOAD_SEGMENTS` byte ranges which are fetched concurrently
+    and written into a preallocated file. Otherwise, the file is downloaded in a
+    single stream.
+
+    Downloads go through a :class:`PartialDownload`, so a transfer interrupted by a
+    network error is resumed up to :data:`DOWNLOAD_RETRIES` times, and a transfer
+    left unfinished by a previous run is resumed on the next one.
+
+    Downloads copied into a `tee` stream are always fetched in a single stream, as
+    the data must be written in order.
+
+    All downloads in a process share a session, so connections are kept alive and
+    reused, and each transfer holds one of the slots of its host, see
+    :func:`host_slot`.
+    """
+
+    streams = True
+
+    def info(self, src: str) -> SourceInfo:
+        """Get the metadata of an HTTP or HTTPS URL with a HEAD request."""
+        return self._head(src, self._get_session())
+
+    def unchanged(self, src: str, previous: SourceInfo) -> tuple[bool, SourceInfo | None]:
+        """Tell whether an HTTP or HTTPS URL is unchanged with a conditional request.
+
+        The server answers a HEAD request with `If-None-Match` and `If-Modified-Since`
+        headers with a 304 if the file is unchanged. Otherwise, the answer carries the
+        current metadata, which is compared with the previous one for servers that
+        ignore conditional requests, and returned.
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        if previous.etag:
+            headers['If-None-Match'] = previous.etag
+        if previous.last_modified:
+            headers['If-Modified-Since'] = previous.last_modified
+        if len(headers) == 1:
+            return False, None
+
+        s = self._get_session()
+        try:
+            r = s.head(src, headers=headers, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            logger.warning(f'conditional head request failed: {e}')
+            return False, None
+
+        if r.status_code == 304:
+            return True, None
+        if not r.ok:
+            logger.debug(f'conditional head request returned {r.status_code}')
+            return False, None
+        info = self._source_info(r)
+        return info.matches(previous), info
 
-    def download(self, src: str, dst: Path, *, abort: Event | None = None) -> Path:
+    def download(
+        self,
+        src: str,
+        dst: Path,
+        *,
+        abort: Event | None = None,
+        info: SourceInfo | None = None,
+        tee: IO[bytes] | None = None,
+    ) -> Path:
         """Download a file from an HTTP or HTTPS URL."""
         logger.debug('starting http(s) download')
-        session = self._create_session_with_retries()
-        self._download(src, dst, session, abort=abort)
-        return dst
+        session = self._get_session()
+        if info is None:
+            info = self._head(src, session)
+        partial = PartialDownload(dst, info, streamed=tee is not None)
+        ranged = (
+            tee is None and info.accepts_ranges and info.size is not None and info.size >= RANGED_DOWNLOAD_THRESHOLD
+        )
+        attempt = 0
+
+        while True:
+            try:
+                if ranged:
+                    assert info.size is not None
+                    logger.debug(f'downloading {info.size} bytes in {RANGED_DOWNLOAD_SEGMENTS} segments')
+                    self._download_ranged(src, partial, session, info.size, abort=abort)
+                else:
+                    self._download_stream(src, partial, session, info, abort=abort, tee=tee)
+                break
+            except RangeNotSupportedError as e:
+                logger.warning(f'{e}, falling back to single stream download')
+                partial.reset()
+                ranged = False
+            except ThrottledError:
+                # keep what we have, the task will be retried later
+                partial.checkpoint()
+                raise
+            except HTTP_TRANSFER_ERRORS as e:
+                attempt += 1
+                partial.checkpoint()
+                if attempt > DOWNLOAD_RETRIES:
+                    raise DownloadError(src, e)
+                logger.warning(f'download interrupted ({e}), resuming (attempt {attempt}/{DOWNLOAD_RETRIES})')
+
+        return partial.complete()
+
+    @staticmethod
+    def _head(src: str, s: requests.Session) -> SourceInfo:
+        # this ensures no gzip encoding is used, so sizes and ranges refer to the actual file
+        headers = {'Accept-Encoding': 'identity'}
+
+        try:
+            r = s.head(src, headers=headers, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            logger.warning(f'head request failed: {e}')
+            return SourceInfo()
+
+        if not r.ok:
+            logger.debug(f'head request returned {r.status_code}')
+            return SourceInfo()
+        return HttpDownloader._source_info(r)
+
+    @staticmethod
+    def _source_info(r: requests.Response) -> SourceInfo:
+        content_length = r.headers.get('Content-Length', '')
+        content_encoding = r.headers.get('Content-Encoding', 'identity')
+        return SourceInfo(
+            size=int(content_length) if content_length.isdigit() else None,
+            etag=r.headers.get('ETag'),
+            last_modified=r.headers.get('Last-Modified'),
+            accepts_ranges=r.headers.get('Accept-Ranges') == 'bytes' and content_encoding == 'identity',
+        )
+
+    @staticmethod
+    def _resume_headers(src: str, partial: PartialDownload, info: SourceInfo, tee: IO[bytes] | None) -> dict[str, str]:
+        """Get the headers to continue a single stream download from its offset.
+
+        The range is only requested along with a validator in `If-Range`, which makes
+        the server send the whole file if it changed in the meantime. Without one, the
+        download starts over, or fails if its data was already streamed.
+        """
+        # weak etags are not allowed in if-range
+        validator = info.etag if info.etag and not info.etag.startswith('W/') else info.last_modified
+        if validator:
+            return {'Range': f'bytes={partial.offset}-', 'If-Range': validator}
+        if tee:
+            raise StreamUploadError(f'{src} has no etag or last-modified, a streamed download cannot be resumed')
+        logger.info('source has no validator to resume from, restarting download')
+        partial.reset()
+        return {}
+
+    @staticmethod
+    def _download_stream(
+        src: str,
+        partial: PartialDownload,
+        s: requests.Session,
+        info: SourceInfo,
+        abort: Event | None = None,
+        tee: IO[bytes] | None = None,
+    ):
+        headers = {'Accept-Encoding': 'identity'}
+        if partial.offset:
+            if partial.offset == info.size:
+                return
+            headers.update(HttpDownloader._resume_headers(src, partial, info, tee=tee))
+
+        with host_slot(src):
+            r = s.get(src, headers=headers, stream=True, timeout=(REQUEST_TIMEOUT, None))
+            raise_if_throttled(src, r.status_code, r.headers)
+            r.raise_for_status()
+
+            if partial.offset and r.status_code != 206:
+                if tee:
+                    raise StreamUploadError(f'{src} changed in the middle of a streamed download')
+                logger.info('server sent the whole file, restarting download')
+                partial.reset()
+
+            r.raw.read = functools.partial(r.raw.read, decode_content=True)
+            stream = AbortableStreamWrapper(r.raw, abort=abort) if abort else r.raw
+
+            with partial.open() as f:
+                shutil.copyfileobj(stream, PartialWriter(f, partial, tee=tee))
+
+    def _download_ranged(
+        self,
+        src: str,
+        partial: PartialDownload,
+        s: requests.Session,
+        size: int,
+        abort: Event | None = None,
+    ):
+        segment_size = -(-size // RANGED_DOWNLOAD_SEGMENTS)
+        ends = {start: min(start + segment_size, size) - 1 for start in range(0, size, segment_size)}
+        offsets = partial.segments(list(ends))
+        # set when a segment fails, so the rest of them stop early
+        failed = Event()
+
+        fd = os.open(partial.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                self._preallocate(fd, size)
+            with ThreadPoolExecutor(max_workers=len(ends)) as pool:
+                futures = [
+                    pool.submit(
+                        self._download_range,
+                        src,
+                        fd,
+                        s,
+                        start,
+                        offsets[start],
+                        end,
+                        partial=partial,
+                        abort=abort,
+                        failed=failed,
+                    )
+                    for start, end in ends.items()
+                    if offsets[start] <= end
+                ]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _preallocate(fd: int, size: int):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            # not every platform or filesystem supports it, a sparse file will do
+            os.ftruncate(fd, size)
+
+    @staticmethod
+    def _download_range(
+        src: str,
+        fd: int,
+        s: requests.Session,
+        start: int,
+        offset: int,
+        end: int,
+        *,
+        partial: PartialDownload,
+        abort: Event | None,
+        failed: Event,
+    ):
+        headers = {'Range': f'bytes={offset}-{end}', 'Accept-Encoding': 'identity'}
+
+        try:
+            with host_slot(src):
+                r = s.get(src, headers=headers, stream=True, timeout=(REQUEST_TIMEOUT, None))
+                raise_if_throttled(src, r.status_code, r.headers)
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RangeNotSupportedError(f'server ignored range request for {src}')
+
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    if abort and abort.is_set():
+                        raise TaskAbortedError
+                    if failed.is_set():
+                        return
+                    view = memoryview(chunk)
+                    while view:
+                        written = os.pwrite(fd, view, offset)
+                        offset += written
+                        view = view[written:]
+                        partial.advance_segment(start, written)
+
+            if offset != end + 1:
+                raise HelperError(f'incomplete segment {start}-{end} for {src}, got {offset - start} bytes')
+        except Exception:
+            failed.set()
+            raise
+
+    def _get_session(self) -> requests.Session:
+        pid = os.getpid()
+        with _sessions_lock:
+            if pid not in _sessions:
+                _sessions[pid] = self._create_session_with_retries()
+            return _sessions[pid]
 
     def _create_session_with_retries(self) -> requests.Session:
         session = requests.Session()
         retries = Retry(
             total=5,
             backoff_factor=0.1,  # type: ignore[arg-type]
-            status_forcelist=[500, 502, 503, 504],
-            allowed_methods={'GET'},
+            # 429 and 503 are left to the step scheduler, which backs off the whole host
+            status_forcelist=[500, 502, 504],
+            allowed_methods={'GET', 'HEAD'},
         )
-        session.mount('http://', HTTPAdapter(max_retries=retries))
-        session.mount('https://', HTTPAdapter(max_retries=retries))
+        # a pool is kept for each host, big enough for all the threads of a process
+        pool_size = settings().http_pool_size
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
         return session
 
 
+class HttpxDownloader(HttpDownloader):
+    """Downloader for HTTP and HTTPS URLs that uses httpx.
+
+    A single client is shared by all the downloads in a process, and it speaks HTTP/2
+    with the servers that support it, so concurrent downloads from a host share a
+    single connection instead of paying a handshake each. For the same reason, files
+    are always downloaded in a single stream, as ranged segments would end up in the
+    same connection anyway.
+
+    Interrupted downloads are resumed like in :class:`HttpDownloader`.
+    """
+
+    def __init__(self):
+        if httpx is None:
+            raise HelperError('httpx must be installed to use the httpx backend, install pis with the httpx extra')
+
+    def info(self, src: str) -> SourceInfo:
+        """Get the metadata of an HTTP or HTTPS URL with a HEAD request."""
+        r = self._head_request(src, {})
+        return self._source_info(r) if r is not None and r.is_success else SourceInfo()  # type: ignore[arg-type]
+
+    def unchanged(self, src: str, previous: SourceInfo) -> tuple[bool, SourceInfo | None]:
+        """Tell whether an HTTP or HTTPS URL is unchanged with a conditional request."""
+        headers = {}
+        if previous.etag:
+            headers['If-None-Match'] = previous.etag
+        if previous.last_modified:
+            headers['If-Modified-Since'] = previous.last_modified
+        if not headers:
+            return False, None
+
+        r = self._head_request(src, headers)
+        if r is None or not r.is_success:
+            return r is not None and r.status_code == 304, None
+        info = self._source_info(r)  # type: ignore[arg-type]
+        return info.matches(previous), info
+
+    def download(
+        self,
+        src: str,
+        dst: Path,
+        *,
+        abort: Event | None = None,
+        info: SourceInfo | None = None,
+        tee: IO[bytes] | None = None,
+    ) -> Path:
+        """Download a file from an HTTP or HTTPS URL."""
+        logger.debug('starting http(s) download with httpx')
+        if info is None:
+            info = self.info(src)
+        partial = PartialDownload(dst, info, streamed=tee is not None)
+        attempt = 0
+
+        while True:
+            try:
+                self._download_httpx(src, partial, info, abort=abort, tee=tee)
+                break
+            except ThrottledError:
+                # keep what we have, the task will be retried later
+                partial.checkpoint()
+                raise
+            except httpx.TransportError as e:
+                attempt += 1
+                partial.checkpoint()
+                if attempt > DOWNLOAD_RETRIES:
+                    raise DownloadError(src, e)
+                logger.warning(f'download interrupted ({e}), resuming (attempt {attempt}/{DOWNLOAD_RETRIES})')
+            except httpx.HTTPStatusError as e:
+                raise DownloadError(src, e)
+
+        return partial.complete()
+
+    def _head_request(self, src: str, headers: dict[str, str]) -> 'httpx.Response | None':
+        # this ensures no gzip encoding is used, so sizes and ranges refer to the actual file
+        headers = {'Accept-Encoding': 'identity', **headers}
+        try:
+            return self._get_client().head(src, headers=headers)
+        except httpx.HTTPError as e:
+            logger.warning(f'head request failed: {e}')
+            return None
+
+    def _download_httpx(
+        self,
+        src: str,
+        partial: PartialDownload,
+        info: SourceInfo,
+        *,
+        abort: Event | None,
+        tee: IO[bytes] | None,
+    ):
+        headers = {'Accept-Encoding': 'identity'}
+        if partial.offset:
+            if partial.offset == info.size:
+                return
+            headers.update(HttpDownloader._resume_headers(src, partial, info, tee=tee))
+
+        with host_slot(src), self._get_client().stream('GET', src, headers=headers) as r:
+            raise_if_throttled(src, r.status_code, r.headers)
+            r.raise_for_status()
+
+            if partial.offset and r.status_code != 206:
+                if tee:
+                    raise StreamUploadError(f'{src} changed in the middle of a streamed download')
+                logger.info('server sent the whole file, restarting download')
+                partial.reset()
+
+            with partial.open() as f:
+                writer = PartialWriter(f, partial, abort=abort, tee=tee)
+                for chunk in r.iter_bytes(CHUNK_SIZE):
+                    writer.write(chunk)
+
+    @staticmethod
+    def _get_client() -> 'httpx.Client':
+        pid = os.getpid()
+        with _sessions_lock:
+            if pid not in _httpx_clients:
+                pool_size = settings().http_pool_size
+                # the client ignores its own limits when given a transport, so they go there
+                limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                _httpx_clients[pid] = httpx.Client(
+                    http2=True,
+                    follow_redirects=True,
+                    timeout=httpx.Timeout(REQUEST_TIMEOUT, read=None),
+                    transport=httpx.HTTPTransport(http2=True, retries=DOWNLOAD_RETRIES, limits=limits),
+                )
+            return _httpx_clients[pid]
+
+
 class GoogleSheetsDownloader(Downloader):
     """Downloader for Google Sheets URLs."""
 
-    def download(self, src: str, dst: Path, *, abort: Event | None = None) -> Path:
+    def download(
+        self,
+        src: str,
+        dst: Path,
+        *,
+        abort: Event | None = None,
+        info: SourceInfo | None = None,
+        tee: IO[bytes] | None = None,
+    ) -> Path:
         """Download a Google Sheet."""
         logger.debug('starting Google Sheets download')
         google_storage = GoogleStorage()
@@ -121,36 +1096,148 @@ class GoogleSheetsDownloader(Downloader):
 
 
 class GoogleStorageDownloader(Downloader):
-    """Downloader for Google Storage URLs."""
+    """Downloader for Google Storage URLs.
+
+    Downloads are pinned to the generation of the blob at the time they start and go
+    through a :class:`PartialDownload`, so they can be resumed with ranged reads.
+
+    Blobs bigger than :data:`RANGED_DOWNLOAD_THRESHOLD` are fetched with
+    :meth:`pis.storage.google.GoogleStorage.download_sliced`, unless there is a partial
+    download to resume or the download is copied into a `tee` stream.
+    """
 
-    def download(self, src: str, dst: Path, *, abort: Event | None = None) -> Path:
+    streams = True
+
+    def info(self, src: str) -> SourceInfo:
+        """Get the metadata of a blob in Google Storage."""
+        stat = GoogleStorage().stat(src)
+        return SourceInfo(size=stat['size'], generation=stat['generation'], checksum=stat.get('checksum'))
+
+    def download(
+        self,
+        src: str,
+        dst: Path,
+        *,
+        abort: Event | None = None,
+        info: SourceInfo | None = None,
+        tee: IO[bytes] | None = None,
+    ) -> Path:
         """Download a file from Google Storage."""
         logger.debug('starting google storage download')
         google_storage = GoogleStorage()
-        google_storage.download_to_file(src, dst)
-        return dst
+        if info is None:
+            info = self.info(src)
+        partial = PartialDownload(dst, info, streamed=tee is not None)
+        sliced = tee is None and not partial.offset and (info.size or 0) >= RANGED_DOWNLOAD_THRESHOLD
+        attempt = 0
+
+        while True:
+            try:
+                if sliced:
+                    # slices are fetched again from the start if the download fails
+                    logger.debug(f'downloading {info.size} bytes in slices')
+                    google_storage.download_sliced(src, partial.path, generation=info.generation, abort=abort)
+                else:
+                    with partial.open() as f:
+                        writer = PartialWriter(f, partial, abort=abort, tee=tee)
+                        google_storage.download_to_stream(src, writer, start=partial.offset, generation=info.generation)
+                break
+            except StorageError as e:
+                attempt += 1
+                partial.checkpoint()
+                if attempt > DOWNLOAD_RETRIES:
+                    raise DownloadError(src, e)
+                logger.warning(f'download interrupted ({e}), resuming (attempt {attempt}/{DOWNLOAD_RETRIES})')
+
+        return partial.complete()
 
 
 class DownloadHelper:
-    """Helper that downloads files from various sources."""
+    """Helper that downloads files from various sources.
+
+    If :attr:`pis.config.models.Settings.download_cache` is enabled, the metadata of
+    the source is fetched first, and the file is taken from the
+    :class:`DownloadCache` if an unchanged version of it was downloaded before.
+
+    If a remote URI to upload to is given, the file is streamed into it while it is
+    downloaded, if the downloader supports it, or uploaded right after otherwise.
+    Streamed downloads bypass the cache.
+
+    The helper can also get the metadata of a source, and tell whether a source is
+    unchanged since a previous download, for
+    :attr:`pis.config.models.Settings.skip_unchanged`.
+    """
 
     def __init__(self):
+        http_downloader = HttpxDownloader() if settings().http_backend == 'httpx' else HttpDownloader()
         self.strategies = {
             'google_sheets': GoogleSheetsDownloader(),
-            'http': HttpDownloader(),
-            'https': HttpDownloader(),
+            'http': http_downloader,
+            'https': http_downloader,
             'gs': GoogleStorageDownloader(),
         }
 
-    def download(self, src: str, dst: Path | str, abort: Event | None = None) -> Path:
-        """Download a file."""
+    def info(self, src: str) -> SourceInfo:
+        """Get the metadata of a source."""
+        return self._get_downloader(src).info(src)
+
+    def unchanged(self, src: str, previous: SourceInfo) -> tuple[bool, SourceInfo | None]:
+        """Tell whether a source is unchanged since a previous download."""
+        return self._get_downloader(src).unchanged(src, previous)
+
+    def download(
+        self,
+        src: str,
+        dst: Path | str,
+        abort: Event | None = None,
+        info: SourceInfo | None = None,
+        upload_to: str | None = None,
+    ) -> Path:
+        """Download a file, optionally uploading it to a remote URI."""
         dst = self._prepare_destination(dst)
-        protocol = self._get_protocol(src)
+        downloader = self._get_downloader(src)
 
-        if protocol not in self.strategies:
-            raise HelperError(f'unknown protocol {protocol}')
+        if upload_to:
+            return self._download_and_upload(downloader, src, dst, upload_to, abort=abort, info=info)
 
-        return self.strategies[protocol].download(src, dst, abort=abort)
+        if not settings().download_cache:
+            return downloader.download(src, dst, abort=abort, info=info)
+
+        info = info or downloader.info(src)
+        cache = DownloadCache()
+        key = cache.key(src, info)
+        if key and (digest := cache.fetch(key, dst)):
+            info.checksum = info.checksum or f'sha256:{digest}'
+            return dst
+
+        downloader.download(src, dst, abort=abort, info=info)
+        if key:
+            # the digest computed while downloading saves reading the file again
+            algorithm, _, digest = (info.checksum or '').partition(':')
+            cache.store(key, dst, digest if algorithm == 'sha256' else None)
+        return dst
+
+    def _download_and_upload(
+        self,
+        downloader: Downloader,
+        src: str,
+        dst: Path,
+        upload_to: str,
+        *,
+        abort: Event | None,
+        info: SourceInfo | None,
+    ) -> Path:
+        remote_storage = get_remote_storage(upload_to)
+        if downloader.streams:
+            logger.debug(f'streaming download into {upload_to}')
+            with remote_storage.open_writer(upload_to) as writer:
+                return downloader.download(src, dst, abort=abort, info=info, tee=writer)
+
+        downloader.download(src, dst, abort=abort, info=info)
+        remote_storage.upload(dst, upload_to)
+        if not settings().keep_local:
+            dst.unlink()
+        return dst
 
     def _prepare_destination(self, dst: Path | str) -> Path:
         logger.debug(f'preparing to download to {dst!r}')
@@ -160,12 +1247,35 @@ class DownloadHelper:
         check_fs(dst)
         return dst
 
+    def _get_downloader(self, src: str) -> Downloader:
+        protocol = self._get_protocol(src)
+        if protocol not in self.strategies:
+            raise HelperError(f'unknown protocol {protocol}')
+        return self.strategies[protocol]
+
     def _get_protocol(self, src: str) -> str:
         if src.startswith('https://docs.google.com/spreadsheets/d'):
             return 'google_sheets'
         return src.split(':')[0]
 
 
-def download(src: str, dst: Path | str, *, abort: Event | None = None) -> Path:
+def download(
+    src: str,
+    dst: Path | str,
+    *,
+    abort: Event | None = None,
+    info: SourceInfo | None = None,
+    upload_to: str | None = None,
+) -> Path:
     """Instantiate a DownloadHelper and download a file."""
-    return DownloadHelper().download(src, dst, abort=abort)
+    return DownloadHelper().download(src, dst, abort=abort, info=info, upload_to=upload_to)
+
+
+def source_info(src: str) -> SourceInfo:
+    """Instantiate a DownloadHelper and get the metadata of a source."""
+    return DownloadHelper().info(src)
+
+
+def is_unchanged(src: str, previous: SourceInfo) -> tuple[bool, SourceInfo | None]:
+    """Instantiate a DownloadHelper and tell whether a source is unchanged."""
+    return DownloadHelper().unchanged(src, previous)
@@ -1,19 +1,81 @@
+import hashlib
+import io
+import threading
 from pathlib import Path
 from threading import Event
 from unittest.mock import Mock, patch
 
 import pytest
+from urllib3.exceptions import ProtocolError
 
+from pis.config.models import Settings
 from pis.helpers.download import (
+    DownloadCache,
     DownloadHelper,
     GoogleSheetsDownloader,
     GoogleStorageDownloader,
     HelperError,
     HttpDownloader,
+    HttpxDownloader,
+    PartialDownload,
+    PartialState,
+    SourceInfo,
+    StreamUploadError,
     TaskAbortedError,
+    ThrottledError,
     download,
+    host_slot,
+    raise_if_throttled,
 )
 
+content = bytes(range(256)) * 64
+checksum = f'sha256:{hashlib.sha256(content).hexdigest()}'
+
+
+def ranged_get(src, headers=None, **kwargs):
+    start, end = (int(n) for n in headers['Range'].removeprefix('bytes=').split('-'))
+    chunk = content[start : end + 1]
+    response = Mock(status_code=206)
+    response.iter_content.return_value = [chunk[: len(chunk) // 2], chunk[len(chunk) // 2 :]]
+    return response
+
+
+def fake_stream(src, partial, *args, **kwargs):
+    partial.path.write_bytes(content)
+
+
+class FakeRaw(io.BytesIO):
+    def __init__(self, data, fail_after=None):
+        super().__init__(data)
+        self.fail_after = fail_after
+
+    def read(self, size=-1, decode_content=False):
+        if self.fail_after is not None and self.tell() >= self.fail_after:
+            raise ProtocolError('connection broken')
+        return super().read(1024 if size == -1 else min(size, 1024))
+
+
+def write_partial(dst, data, state):
+    dst.with_name(f'{dst.name}.part').write_bytes(data)
+    dst.with_name(f'{dst.name}.part.json').write_text(state.model_dump_json())
+
+
+@pytest.fixture(autouse=True)
+def mocked_settings():
+    with patch('pis.helpers.download.settings') as mock_settings:
+        mock_settings.return_value = Settings()
+        yield mock_settings
+
+
+@pytest.fixture(autouse=True)
+def reset_sessions():
+    with (
+        patch('pis.helpers.download._sessions', {}),
+        patch('pis.helpers.download._host_slots', {}),
+        patch('pis.helpers.download._httpx_clients', {}),
+    ):
+        yield
+
 
 @pytest.fixture
 def download_helper():
@@ -73,14 +135,15 @@ def test_download_function(mock_download):
     result = download('https://example.com', '/dst')
 
     assert result == Path('/downloaded/file')
-    mock_download.assert_called_once_with('https://example.com', '/dst', abort=None)
+    mock_download.assert_called_once_with('https://example.com', '/dst', abort=None, info=None, upload_to=None)
 
 
 @patch('pis.helpers.download.requests.Session')
 def test_http_downloader(mock_session, tmp_path):
     downloader = HttpDownloader()
-    downloader._download = Mock()
+    downloader._download_stream = Mock(side_effect=fake_stream)
     mock_session_instance = Mock()
+    mock_session_instance.head.return_value.headers = {}
     mock_session.return_value = mock_session_instance
     dst = tmp_path / 'file.txt'
 
@@ -90,12 +153,102 @@ def test_http_downloader(mock_session, tmp_path):
     mock_session_instance.mount.assert_called()
 
 
+@patch('pis.helpers.download.requests.Session')
+def test_http_session_shared(mock_session, mocked_settings):
+    mocked_settings.return_value = Settings(http_pool_size=16)
+
+    downloader = HttpDownloader()
+    first = downloader._get_session()
+    second = HttpDownloader()._get_session()
+
+    assert first is second
+    mock_session.assert_called_once()
+    adapter = mock_session.return_value.mount.call_args.args[1]
+    assert adapter._pool_maxsize == 16
+
+
+def test_host_slot_limit(mocked_settings):
+    mocked_settings.return_value = Settings(host_concurrency=1)
+    acquired = threading.Event()
+
+    def hold():
+        with host_slot('https://example.com/b'):
+            acquired.set()
+
+    with host_slot('https://example.com/a'):
+        thread = threading.Thread(target=hold)
+        thread.start()
+        assert not acquired.wait(0.1)
+        with host_slot('https://other.com/a'):
+            pass
+    thread.join()
+
+    assert acquired.is_set()
+
+
+def test_host_slot_unlimited(mocked_settings):
+    mocked_settings.return_value = Settings(host_concurrency=0)
+
+    with host_slot('https://example.com/a'), host_slot('https://example.com/a'):
+        pass
+
+
+def test_download_helper_httpx_backend(mocked_settings):
+    mocked_settings.return_value = Settings(http_backend='httpx')
+
+    with patch('pis.helpers.download.httpx', None), pytest.raises(HelperError, match='httpx'):
+        DownloadHelper()
+
+    with patch('pis.helpers.download.httpx'):
+        assert isinstance(DownloadHelper().strategies['https'], HttpxDownloader)
+
+
+@patch('pis.helpers.download.httpx')
+def test_httpx_client_pool_size(mock_httpx, mocked_settings):
+    mocked_settings.return_value = Settings(http_pool_size=16)
+
+    HttpxDownloader()._get_client()
+
+    mock_httpx.Limits.assert_called_once_with(max_connections=16, max_keepalive_connections=16)
+    limits = mock_httpx.Limits.return_value
+    assert mock_httpx.HTTPTransport.call_args.kwargs['limits'] is limits
+    assert 'limits' not in mock_httpx.Client.call_args.kwargs
+
+
+@pytest.mark.parametrize(
+    ('headers', 'retry_after'),
+    [
+        ({}, None),
+        ({'Retry-After': '120'}, 120),
+        ({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 0),
+        ({'Retry-After': 'soon'}, None),
+    ],
+)
+def test_raise_if_throttled(headers, retry_after):
+    raise_if_throttled('https://example.com/file', 200, headers)
+
+    with pytest.raises(ThrottledError) as e:
+        raise_if_throttled('https://example.com/file', 429, headers)
+
+    assert e.value.retry_after == retry_after
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_throttled(mock_session, tmp_path):
+    mock_session.return_value.head.return_value.headers = {}
+    mock_session.return_value.get.return_value = Mock(status_code=503, headers={'Retry-After': '30'})
+
+    with pytest.raises(ThrottledError):
+        HttpDownloader().download('https://example.com/file', tmp_path / 'file')
+
+
 @patch('pis.helpers.download.open')
 @patch('pis.helpers.download.shutil.copyfileobj')
 @patch('pis.helpers.download.requests.Session')
 def test_download_with_abort(mock_session, mock_copyfileobj, mock_open):
     downloader = HttpDownloader()
     mock_response = Mock()
+    mock_session.return_value.head.return_value.headers = {}
     mock_session.return_value.get.return_value = mock_response
     mock_response.raise_for_status.return_value = None
 
@@ -110,3 +263,411 @@ def test_download_with_abort(mock_session, mock_copyfileobj, mock_open):
     mock_session.return_value.get.assert_called_once()
     mock_open.assert_called_once()
     mock_copyfileobj.assert_called_once()  # The copy should not complete due to the abort
+
+
+def test_head_info():
+    session = Mock()
+    session.head.return_value.ok = True
+    session.head.return_value.headers = {
+        'Content-Length': '1234',
+        'ETag': '"abc"',
+        'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        'Accept-Ranges': 'bytes',
+    }
+
+    info = HttpDownloader._head('https://example.com', session)
+
+    assert info == SourceInfo(
+        size=1234,
+        etag='"abc"',
+        last_modified='Wed, 21 Oct 2015 07:28:00 GMT',
+        accepts_ranges=True,
+    )
+
+
+def test_head_info_encoded():
+    session = Mock()
+    session.head.return_value.ok = True
+    session.head.return_value.headers = {'Accept-Ranges': 'bytes', 'Content-Encoding': 'gzip'}
+
+    assert not HttpDownloader._head('https://example.com', session).accepts_ranges
+
+
+def test_source_info_matches():
+    previous = SourceInfo(size=1234, etag='"abc"')
+
+    assert SourceInfo(size=1234, etag='"abc"', accepts_ranges=True).matches(previous)
+    assert not SourceInfo(size=1234, etag='"def"').matches(previous)
+    assert not SourceInfo(size=1234).matches(previous)
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_http_unchanged_not_modified(mock_session):
+    mock_session.return_value.head.return_value.status_code = 304
+
+    assert HttpDownloader().unchanged('https://example.com', SourceInfo(etag='"abc"')) == (True, None)
+    headers = mock_session.return_value.head.call_args.kwargs['headers']
+    assert headers['If-None-Match'] == '"abc"'
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_http_unchanged_conditional_ignored(mock_session):
+    head = mock_session.return_value.head.return_value
+    head.status_code = 200
+    head.ok = True
+    head.headers = {'ETag': '"def"'}
+
+    unchanged, info = HttpDownloader().unchanged('https://example.com', SourceInfo(etag='"abc"'))
+
+    assert not unchanged
+    assert info.etag == '"def"'
+
+
+def test_http_unchanged_without_validators():
+    assert HttpDownloader().unchanged('https://example.com', SourceInfo(size=1234)) == (False, None)
+
+
+@patch('pis.helpers.download.GoogleStorage')
+def test_google_storage_unchanged(mock_google_storage):
+    mock_google_storage.return_value.stat.return_value = {'size': 10, 'generation': 2, 'checksum': None}
+    downloader = GoogleStorageDownloader()
+
+    assert downloader.unchanged('gs://bucket/file', SourceInfo(size=10, generation=2))[0]
+    assert downloader.unchanged('gs://bucket/file', SourceInfo(size=10, generation=1)) == (
+        False,
+        SourceInfo(size=10, generation=2),
+    )
+
+
+@patch('pis.helpers.download.RANGED_DOWNLOAD_THRESHOLD', 1024)
+@patch('pis.helpers.download.requests.Session')
+def test_download_ranged(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), accepts_ranges=True))
+    downloader._download_stream = Mock(side_effect=fake_stream)
+    mock_session.return_value.get.side_effect = ranged_get
+    dst = tmp_path / 'file.bin'
+
+    downloader.download('https://example.com', dst)
+
+    assert dst.read_bytes() == content
+    assert mock_session.return_value.get.call_count == 8
+    downloader._download_stream.assert_not_called()
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_ranged_small_file(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), accepts_ranges=True))
+    downloader._download_stream = Mock(side_effect=fake_stream)
+
+    downloader.download('https://example.com', tmp_path / 'file.bin')
+
+    downloader._download_stream.assert_called_once()
+
+
+@patch('pis.helpers.download.RANGED_DOWNLOAD_THRESHOLD', 1024)
+@patch('pis.helpers.download.requests.Session')
+def test_download_ranged_ignored(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), accepts_ranges=True))
+    downloader._download_stream = Mock(side_effect=fake_stream)
+    mock_session.return_value.get.return_value.status_code = 200
+
+    downloader.download('https://example.com', tmp_path / 'file.bin')
+
+    downloader._download_stream.assert_called_once()
+
+
+@patch('pis.helpers.download.RANGED_DOWNLOAD_THRESHOLD', 1024)
+@patch('pis.helpers.download.requests.Session')
+def test_download_ranged_with_abort(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), accepts_ranges=True))
+    mock_session.return_value.get.side_effect = ranged_get
+    abort_event = Event()
+    abort_event.set()
+
+    with pytest.raises(TaskAbortedError):
+        downloader.download('https://example.com', tmp_path / 'file.bin', abort=abort_event)
+
+
+@patch('pis.helpers.download.RANGED_DOWNLOAD_THRESHOLD', 1024)
+@patch('pis.helpers.download.requests.Session')
+def test_download_ranged_records_checksum(mock_session, tmp_path):
+    info = SourceInfo(size=len(content), accepts_ranges=True)
+    mock_session.return_value.get.side_effect = ranged_get
+
+    HttpDownloader().download('https://example.com', tmp_path / 'file.bin', info=info)
+
+    assert info.checksum == checksum
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_resumed_records_checksum(mock_session, tmp_path):
+    info = SourceInfo(size=len(content), etag='"abc"')
+    mock_session.return_value.get.return_value = Mock(status_code=206, raw=FakeRaw(content[1024:]))
+    dst = tmp_path / 'file.bin'
+    write_partial(dst, content[:1024], PartialState(size=len(content), etag='"abc"', offset=1024))
+
+    HttpDownloader().download('https://example.com', dst, info=info)
+
+    assert info.checksum == checksum
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_streamed_records_checksum(mock_session, mocked_settings, tmp_path):
+    mocked_settings.return_value = Settings(keep_local=False)
+    info = SourceInfo(size=len(content), etag='"abc"')
+    mock_session.return_value.get.side_effect = [
+        Mock(status_code=200, raw=FakeRaw(content, fail_after=4096)),
+        Mock(status_code=206, raw=FakeRaw(content[4096:])),
+    ]
+
+    HttpDownloader().download('https://example.com', tmp_path / 'file.bin', info=info, tee=io.BytesIO())
+
+    assert info.checksum == checksum
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_keeps_source_checksum(mock_session, tmp_path):
+    info = SourceInfo(size=len(content), checksum='crc32c:abc')
+    mock_session.return_value.get.return_value = Mock(status_code=200, raw=FakeRaw(content))
+
+    HttpDownloader().download('https://example.com', tmp_path / 'file.bin', info=info)
+
+    assert info.checksum == 'crc32c:abc'
+
+
+def test_partial_download_resume(tmp_path):
+    dst = tmp_path / 'file.bin'
+    info = SourceInfo(size=len(content), etag='"abc"')
+    write_partial(dst, content[:2048], PartialState(size=len(content), etag='"abc"', offset=1024))
+
+    partial = PartialDownload(dst, info)
+
+    assert partial.offset == 1024
+    assert partial.path.read_bytes() == content[:1024]
+
+
+def test_partial_download_source_changed(tmp_path):
+    dst = tmp_path / 'file.bin'
+    info = SourceInfo(size=len(content), etag='"def"')
+    write_partial(dst, content[:1024], PartialState(size=len(content), etag='"abc"', offset=1024))
+
+    partial = PartialDownload(dst, info)
+
+    assert partial.offset == 0
+    assert not partial.path.exists()
+    assert not partial.state_path.exists()
+
+
+def test_partial_download_not_resumable(tmp_path):
+    dst = tmp_path / 'file.bin'
+    write_partial(dst, content[:1024], PartialState(size=len(content), offset=1024))
+
+    partial = PartialDownload(dst, SourceInfo(size=len(content)))
+
+    assert partial.offset == 0
+    assert not partial.path.exists()
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_resumes_previous_run(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), etag='"abc"'))
+    mock_session.return_value.get.return_value = Mock(status_code=206, raw=FakeRaw(content[1024:]))
+    dst = tmp_path / 'file.bin'
+    write_partial(dst, content[:1024], PartialState(size=len(content), etag='"abc"', offset=1024))
+
+    downloader.download('https://example.com', dst)
+
+    assert dst.read_bytes() == content
+    headers = mock_session.return_value.get.call_args.kwargs['headers']
+    assert headers['Range'] == 'bytes=1024-'
+    assert headers['If-Range'] == '"abc"'
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_resumes_after_transfer_error(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), etag='"abc"'))
+    mock_session.return_value.get.side_effect = [
+        Mock(status_code=200, raw=FakeRaw(content, fail_after=4096)),
+        Mock(status_code=206, raw=FakeRaw(content[4096:])),
+    ]
+    dst = tmp_path / 'file.bin'
+
+    downloader.download('https://example.com', dst)
+
+    assert dst.read_bytes() == content
+    assert mock_session.return_value.get.call_args.kwargs['headers']['Range'] == 'bytes=4096-'
+    assert not dst.with_name('file.bin.part.json').exists()
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_streamed_after_transfer_error(mock_session, mocked_settings, tmp_path):
+    mocked_settings.return_value = Settings(keep_local=False)
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), etag='"abc"'))
+    mock_session.return_value.get.side_effect = [
+        Mock(status_code=200, raw=FakeRaw(content, fail_after=4096)),
+        Mock(status_code=206, raw=FakeRaw(content[4096:])),
+    ]
+    dst = tmp_path / 'file.bin'
+    tee = io.BytesIO()
+
+    downloader.download('https://example.com', dst, tee=tee)
+
+    assert tee.getvalue() == content
+    assert not dst.exists()
+    assert not dst.with_name('file.bin.part.json').exists()
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_restarts_after_transfer_error_without_validator(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content)))
+    mock_session.return_value.get.side_effect = [
+        Mock(status_code=200, raw=FakeRaw(content, fail_after=4096)),
+        Mock(status_code=200, raw=FakeRaw(content)),
+    ]
+    dst = tmp_path / 'file.bin'
+
+    downloader.download('https://example.com', dst)
+
+    assert dst.read_bytes() == content
+    assert 'Range' not in mock_session.return_value.get.call_args.kwargs['headers']
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_streamed_fails_after_transfer_error_without_validator(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), etag='W/"abc"'))
+    mock_session.return_value.get.side_effect = [Mock(status_code=200, raw=FakeRaw(content, fail_after=4096))]
+
+    with pytest.raises(StreamUploadError, match='cannot be resumed'):
+        downloader.download('https://example.com', tmp_path / 'file.bin', tee=io.BytesIO())
+
+    assert mock_session.return_value.get.call_count == 1
+
+
+@patch('pis.helpers.download.get_remote_storage')
+def test_download_helper_upload_to(mock_remote_storage, download_helper, tmp_path):
+    download_helper._prepare_destination = Mock(return_value=tmp_path / 'dst.bin')
+    downloader = download_helper.strategies['https']
+    downloader.download = Mock(return_value=tmp_path / 'dst.bin')
+
+    download_helper.download('https://example.com/file.bin', 'dst.bin', upload_to='gs://bucket/dst.bin')
+
+    writer = mock_remote_storage.return_value.open_writer
+    writer.assert_called_once_with('gs://bucket/dst.bin')
+    assert downloader.download.call_args.kwargs['tee'] == writer.return_value.__enter__.return_value
+
+
+@patch('pis.helpers.download.requests.Session')
+def test_download_restarts_when_server_sends_whole_file(mock_session, tmp_path):
+    downloader = HttpDownloader()
+    downloader._head = Mock(return_value=SourceInfo(size=len(content), etag='"abc"'))
+    mock_session.return_value.get.return_value = Mock(status_code=200, raw=FakeRaw(content))
+    dst = tmp_path / 'file.bin'
+    write_partial(dst, b'x' * 1024, PartialState(size=len(content), etag='"abc"', offset=1024))
+
+    downloader.download('https://example.com', dst)
+
+    assert dst.read_bytes() == content
+
+
+@patch('pis.helpers.download.GoogleStorage')
+def test_google_storage_download_resumes(mock_google_storage, tmp_path):
+    storage = mock_google_storage.return_value
+    storage.stat.return_value = {'mtime': 0, 'size': len(content), 'generation': 123}
+    storage.download_to_stream.side_effect = lambda src, f, start, generation: f.write(content[start:])
+    dst = tmp_path / 'file.bin'
+    write_partial(dst, content[:1024], PartialState(size=len(content), generation=123, offset=1024))
+
+    GoogleStorageDownloader().download('gs://bucket/file.bin', dst)
+
+    assert dst.read_bytes() == content
+    assert storage.download_to_stream.call_args.kwargs == {'start': 1024, 'generation': 123}
+
+
+@patch('pis.helpers.download.RANGED_DOWNLOAD_THRESHOLD', 1024)
+@patch('pis.helpers.download.GoogleStorage')
+def test_google_storage_download_sliced(mock_google_storage, tmp_path):
+    storage = mock_google_storage.return_value
+    storage.stat.return_value = {'mtime': 0, 'size': len(content), 'generation': 123}
+    storage.download_sliced.side_effect = lambda src, dst, generation, abort: dst.write_bytes(content)
+    dst = tmp_path / 'file.bin'
+    abort = threading.Event()
+
+    GoogleStorageDownloader().download('gs://bucket/file.bin', dst, abort=abort)
+
+    assert dst.read_bytes() == content
+    assert storage.download_sliced.call_args.kwargs == {'generation': 123, 'abort': abort}
+    storage.download_to_stream.assert_not_called()
+
+
+def test_cache_key():
+    assert DownloadCache.key('gs://b/f', SourceInfo(size=1, generation=123)) == 'gs://b/f 123 1'
+    assert DownloadCache.key('https://e.com/f', SourceInfo(size=1, etag='"abc"')) == 'https://e.com/f "abc" 1'
+    assert DownloadCache.key('https://e.com/f', SourceInfo(size=1)) is None
+
+
+def test_cache_store_and_fetch(tmp_path):
+    cache = DownloadCache(tmp_path / 'cache', max_size=1024 * 1024)
+    downloaded = tmp_path / 'downloaded.bin'
+    downloaded.write_bytes(content)
+    dst = tmp_path / 'dst.bin'
+
+    assert not cache.fetch('key', dst)
+    cache.store('key', downloaded)
+
+    assert cache.fetch('key', dst) == hashlib.sha256(content).hexdigest()
+    assert dst.read_bytes() == content
+    assert len(list(cache.objects.glob('*/*'))) == 1
+
+
+def test_cache_eviction(tmp_path):
+    cache = DownloadCache(tmp_path / 'cache', max_size=len(content) + 1)
+    for i in range(3):
+        downloaded = tmp_path / f'downloaded_{i}.bin'
+        downloaded.write_bytes(content + bytes([i]))
+        cache.store(f'key_{i}', downloaded)
+
+    assert not cache.fetch('key_0', tmp_path / 'dst_0.bin')
+    assert not cache.fetch('key_1', tmp_path / 'dst_1.bin')
+    assert cache.fetch('key_2', tmp_path / 'dst_2.bin')
+
+
+def test_download_cache_hit(download_helper, mocked_settings, tmp_path, mocker):
+    mocked_settings.return_value = Settings(work_dir=tmp_path, download_cache=True)
+    mocker.patch('pis.helpers.download.absolute_path', side_effect=lambda p: tmp_path / p)
+    download_helper._prepare_destination = Mock(return_value=tmp_path / 'dst.bin')
+    downloader = download_helper.strategies['https']
+    downloader.info = Mock(return_value=SourceInfo(size=len(content), etag='"abc"'))
+    downloader.download = Mock(side_effect=lambda src, dst, **kwargs: dst.write_bytes(content))
+
+    download_helper.download('https://example.com/file.bin', 'dst.bin')
+    (tmp_path / 'dst.bin').unlink()
+    download_helper.download('https://example.com/file.bin', 'dst.bin')
+
+    assert (tmp_path / 'dst.bin').read_bytes() == content
+    downloader.download.assert_called_once()
+    assert downloader.info.call_count == 2
+
+
+def test_download_cache_hit_records_checksum(download_helper, mocked_settings, tmp_path, mocker):
+    mocked_settings.return_value = Settings(work_dir=tmp_path, download_cache=True)
+    mocker.patch('pis.helpers.download.absolute_path', side_effect=lambda p: tmp_path / p)
+    download_helper._prepare_destination = Mock(return_value=tmp_path / 'dst.bin')
+    downloader = download_helper.strategies['https']
+    downloader.download = Mock(side_effect=lambda src, dst, **kwargs: dst.write_bytes(content))
+
+    download_helper.download('https://example.com/file.bin', 'dst.bin', info=SourceInfo(etag='"abc"'))
+    (tmp_path / 'dst.bin').unlink()
+    info = SourceInfo(etag='"abc"')
+    download_helper.download('https://example.com/file.bin', 'dst.bin', info=info)
+
+    downloader.download.assert_called_once()
+    assert info.checksum == checksum
@@ -1,11 +1,74 @@
 """Abstract base class for remote storage services."""
 
+import re
 import sys
 from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager
+from fnmatch import fnmatchcase
 from pathlib import Path
-from typing import Any
+from typing import IO, Any
 
 from loguru import logger
+from pydantic import BaseModel
+
+
+class RemoteFile(BaseModel):
+    """A file in a remote storage, with the metadata returned when listing it.
+
+    The metadata fields are the same returned by :meth:`RemoteStorage.stat`, so a
+    listing is enough to compare or pick files without requesting each of them.
+    """
+
+    uri: str
+    mtime: float | None = None
+    size: int | None = None
+    generation: int | None = None
+    checksum: str | None = None
+
+
+def compile_pattern(pattern: str | list[str] | None) -> Callable[[str], bool]:
+    """Compile a pattern into a function that tells whether a file name matches it.
+
+    A pattern is a rule or a list of rules. A rule preceded by an exclamation mark
+    excludes the files it matches, any other rule includes them. A file matches the
+    pattern if it is not excluded and, when there are include rules, it is included
+    by at least one of them. Rules are matched against the file name, without its
+    prefix, and can be:
+        - A regular expression, if it starts with `re:`, e.g. `re:^data_[0-9]+[.]csv$`.
+        - A glob, if it contains any of `*?[`, e.g. `*.csv`.
+        - A plain string otherwise, that must be contained in the file name.
+
+    :param pattern: The pattern to compile.
+    :type pattern: str | list[str] | None
+    :return: A function that returns True if a file name matches the pattern.
+    :rtype: Callable[[str], bool]
+    :raises ValueError: If a regular expression in the pattern is not valid.
+    """
+    rules = [pattern] if isinstance(pattern, str) else pattern or []
+    include: list[Callable[[str], bool]] = []
+    exclude: list[Callable[[str], bool]] = []
+
+    for rule in rules:
+        matchers = exclude if rule.startswith('!') else include
+        rule = rule.removeprefix('!')
+        if rule.startswith('re:'):
+            try:
+                matchers.append(re.compile(rule.removeprefix('re:')).search)  # type: ignore[arg-type]
+            except re.error as e:
+                raise ValueError(f'invalid regular expression in pattern {rule}: {e}')
+        elif any(c in rule for c in '*?['):
+            matchers.append(lambda name, rule=rule: fnmatchcase(name, rule))
+        else:
+            matchers.append(lambda name, rule=rule: rule in name)
+
+    def match(name: str) -> bool:
+        name = name.rsplit('/', 1)[-1]
+        if any(m(name) for m in exclude):
+            return False
+        return not include or any(m(name) for m in include)
+
+    return match
 
 
 class RemoteStorage(ABC):
@@ -29,8 +92,10 @@ class RemoteStorage(ABC):
     def stat(self, uri: str) -> dict:
         """Get metadata for a file.
 
-        Currently, only the modification time is required, as it is used for the
-        download_latest task. This method should be expanded as needed.
+        The dictionary contains the modification time (`mtime`), used for the
+        download_latest task, and the size (`size`), revision (`generation`) and
+        checksum (`checksum`), used to resume partial downloads and to tell whether a
+        file changed between runs. This method should be expanded as needed.
 
         :param uri: The URI to get metadata for.
         :type uri: str
@@ -40,22 +105,43 @@ class RemoteStorage(ABC):
         """
 
     @abstractmethod
-    def list(self, uri: str, pattern: str | None = None) -> list[str]:
+    def iterate(self, uri: str, pattern: str | list[str] | None = None) -> Iterator[RemoteFile]:
+        """Iterate over the files directly in a prefix URI.
+
+        Files are yielded as the listing is fetched, page by page, and only those in
+        the prefix itself are listed, not those in deeper prefixes.
+
+        Optionally, a pattern can be provided to match files against. For example,
+        'foo' will match all files containing 'foo', while '!foo' will exclude all
+        files containing 'foo'. See :func:`compile_pattern` for the full syntax.
+
+        The metadata of each file is taken from the listing itself, so no further
+        requests are needed to get it.
+
+        :param uri: The prefix URI by which to list files.
+        :type uri: str
+        :param pattern: Optional. The pattern to match files against.
+        :type pattern: str | list[str] | None
+        :return: An iterator over the files.
+        :rtype: Iterator[RemoteFile]
+        """
+
+    def list(self, uri: str, pattern: str | list[str] | None = None) -> list[RemoteFile]:
         """List files in prefix URI.
 
-        Optionally, a pattern can be provided to match files against. The pattern
-        should be a simple string match, preceded by an exclamation mark to exclude
-        files. For example, 'foo' will match all files containing 'foo', while '!foo'
-        will exclude all files containing 'foo'.
+        See :meth:`iterate` for the details.
 
         :param uri: The prefix URI by which to list files.
         :type uri: str
         :param pattern: Optional. The pattern to match files against.
-        :type pattern: str | None
-        :return: A list of file URIs.
-        :rtype: list[str]
+        :type pattern: str | list[str] | None
+        :return: A list of files.
+        :rtype: list[RemoteFile]
         """
-        return []
+        files = list(self.iterate(uri, pattern))
+        if not files:
+            logger.warning(f'no files found in {uri}')
+        return files
 
     @abstractmethod
     def download_to_file(self, uri: str, dst: Path) -> int:
@@ -102,6 +188,40 @@ class RemoteStorage(ABC):
         :raises PreconditionFailedError: If the revision number does not match.
         """
 
+    @abstractmethod
+    def copy(self, src: str, uri: str, generation: int | None = None) -> int:
+        """Copy a file to another location in the remote storage.
+
+        The copy is done by the storage itself, so the contents are not transferred
+        through the local machine.
+
+        :param src: The URI of the file to copy.
+        :type src: str
+        :param uri: The URI to copy the file to.
+        :type uri: str
+        :param generation: Optional. The revision number of the file to copy.
+        :type generation: int | None
+        :return: The revision number of the new file.
+        :rtype: int
+        :raises NotFoundError: If the file does not exist.
+        :raises HelperError: If an error occurs during the copy.
+        """
+
+    @abstractmethod
+    def open_writer(self, uri: str) -> AbstractContextManager[IO[bytes]]:
+        """Open a file in the remote storage for writing.
+
+        The returned context manager yields a writable stream. Everything written to
+        it is uploaded as the file contents when the context exits normally. If it
+        exits with an exception, the upload is cancelled and the file is left as is.
+
+        :param uri: The URI of the file to write.
+        :type uri: str
+        :return: A context manager that yields a writable stream.
+        :rtype: AbstractContextManager[IO[bytes]]
+        :raises HelperError: If an error occurs during upload.
+        """
+
     @abstractmethod
     def get_session(self) -> Any:
         """Return a session for making requests.
@@ -35,6 +35,7 @@ class Manifest:
         self._remote_uri = f'{settings().remote_uri}/{MANIFEST_FILENAME}' if settings().remote_uri else None
         self._local_path = absolute_path(MANIFEST_FILENAME)
         self._revision = 0
+        self._relevant_steps: dict[str, Step] = {}
         self._manifest = self._load_remote() or self._load_local() or self._create_empty()
 
     def _load_remote(self) -> RootManifest | None:
@@ -83,8 +84,9 @@ class Manifest:
             raise PISCriticalError(f'error serializing manifest: {e}')
 
     def _refresh_from_remote(self):
-        self._load_remote()
-        self.update_step(self._relevant_step)
+        self._manifest = self._load_remote() or self._manifest
+        for step in self._relevant_steps.values():
+            self.update_step(step)
         self._save_local()
 
     def _save_remote(self):
@@ -115,13 +117,26 @@ class Manifest:
         except (OSError, Timeout) as e:
             raise PISCriticalError(f'error writing local manifest to {self._local_path}: {e}')
 
+    def get_step(self, name: str) -> StepManifest | None:
+        """Get a step from the manifest as it was before this run.
+
+        :param name: The name of the step.
+        :type name: str
+        :return: The step manifest, or `None` if the step is not in the manifest.
+        :rtype: StepManifest | None
+        """
+        return self._manifest.steps.get(name)
+
     def update_step(self, step: 'Step'):
         """Update the manifest with the step.
 
+        Several steps can be updated in the same run, and all of them are taken into
+        account by :meth:`run_ok`.
+
         :param step: The step to update the manifest with.
         :type step: Step
         """
-        self._relevant_step = step
+        self._relevant_steps[step.name] = step
         self._manifest.steps[step.name] = step._manifest
         self._manifest.modified = datetime.now()
         recount(self._manifest)
@@ -136,18 +151,14 @@ class Manifest:
     def run_ok(self) -> bool:
         """Return whether the run was successful.
 
-        Note a successful run is defined as the step being in validated state if the
-        run is local, or in complete state if the run has a remote URI.
+        Note a successful run is defined as all the steps in the run being in validated
+        state if the run is local, or in complete state if the run has a remote URI.
 
         :return: Whether the run was successful.
         :rtype: bool
         """
-        relevant_step_result = self._manifest.steps[self._relevant_step.name].result
-
-        if settings().remote_uri:
-            return relevant_step_result == Result.COMPLETED
-        else:
-            return relevant_step_result == Result.VALIDATED
+        expected = Result.COMPLETED if settings().remote_uri else Result.VALIDATED
+        return all(self._manifest.steps[name].result == expected for name in self._relevant_steps)
 
     def is_completed(self) -> bool:
         """Return whether the manifest is completed.
@@ -126,6 +126,16 @@ def test_load_local_ko(
     mocked_absolute_path.return_value.read_text.assert_called_once()
 
 
+@patch('pis.manifest.manifest.Manifest._load_remote')
+def test_get_step(mock_load_remote):
+    mock_load_remote.return_value = None
+
+    m = Manifest()
+
+    assert m.get_step('step1') == manifest_steps['step1']
+    assert m.get_step('step3') is None
+
+
 @patch('pis.manifest.manifest.Manifest._load_remote')
 @patch('pis.manifest.manifest.Manifest._load_local')
 def test_create_empty_ok(mock_load_remote, mock_load_local):
@@ -30,10 +30,21 @@ class Resource(BaseModel):
 
     A resource is the resulting file or files from a task. All tasks must produce a
     resource, and it will be logged into the manifest for tracking.
+
+    Optionally, a resource can hold the metadata of its source at the time it was
+    fetched. That way, the next run can tell whether the source has changed. See
+    :attr:`pis.config.models.Settings.skip_unchanged`. Tasks that update their previous
+    resource incrementally can also store the point they reached in `watermark`.
     """
 
     source: str
     destination: str
+    size: int | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+    generation: int | None = None
+    checksum: str | None = None
+    watermark: str | None = None
 
     def make_absolute(self) -> 'Resource':
         """Make the destination path absolute."""
@@ -41,7 +52,7 @@ class Resource(BaseModel):
             abs_destination = f'{base_uri}/{self.destination}'
         else:
             abs_destination = Path(self.destination).absolute().as_posix()
-        return Resource(source=self.source, destination=abs_destination)
+        return self.model_copy(update={'destination': abs_destination})
 
 
 class TaskManifest(BaseModel, extra='allow'):
@@ -7,6 +7,7 @@ from typing import TYPE_CHECKING
 
 from loguru import logger
 
+from pis.config import settings
 from pis.manifest.models import Result, StepManifest
 
 if TYPE_CHECKING:
@@ -60,11 +61,11 @@ class StepReporter:
     def upsert_task_manifests(self, tasks: list['Task']):
         """Update the step manifest with new task manifests."""
         for task in tasks:
+            self._manifest.resources.extend(task._resources)
             inserted = False
             for i, t in enumerate(self._manifest.tasks):
                 if t.name == task.name:
                     self._manifest.tasks[i] = task._manifest
-                    self._manifest.resources.extend(task._resources)
                     inserted = True
                     break
             if not inserted:
@@ -77,24 +78,20 @@ def report(func):
     @wraps(func)
     def wrapper(self, *args, **kwargs):
         try:
-            if func.__name__ == '_run':
-                logger.info('step run started')
-            elif func.__name__ == '_validate':
-                logger.info('step validation started')
-            elif func.__name__ == '_upload':
-                logger.info('step upload started')
-
             result = func(self, *args, **kwargs)
 
             # update task manifest
             self.upsert_task_manifests(result)
 
+            # tasks go through all phases on their own, so the step reaches the phases
+            # reached by all of its tasks
             if func.__name__ == '_run':
+                results = {t._manifest.result for t in result}
                 self.staged(f'ran {len(result)} tasks')
-            elif func.__name__ == '_validate':
-                self.validated(f'checked {len(result)} tasks')
-            elif func.__name__ == '_upload':
-                self.completed(f'uploaded {len(result)} tasks')
+                if results <= {Result.VALIDATED, Result.COMPLETED}:
+                    self.validated(f'checked {len(result)} tasks')
+                if settings().remote_uri and results <= {Result.COMPLETED}:
+                    self.completed(f'uploaded {len(result)} tasks')
             return result
         except Exception as e:
             kwargs['abort'].set()
@@ -9,11 +9,14 @@ from loguru import logger
 
 from pis.config import settings
 from pis.manifest.models import Resource, Result, TaskManifest
-from pis.util.errors import TaskAbortedError
+from pis.util.errors import TaskAbortedError, ThrottledError
 
 if TYPE_CHECKING:
     from pis.task import Task
 
+# times a task can be throttled by its source before it is failed
+THROTTLE_RETRIES = 10
+
 
 class TaskReporter:
     """Class for logging and updating tasks in the manifest."""
@@ -22,6 +25,9 @@ class TaskReporter:
         self.name = name
         self._manifest: TaskManifest
         self._resources: list[Resource] = []
+        self.throttled = False
+        self.throttles = 0
+        self.retry_after: float | None = None
 
     def staged(self, log: str):
         """Set the task result to STAGED."""
@@ -49,6 +55,14 @@ class TaskReporter:
         self._manifest.result = Result.FAILED
         logger.opt(exception=sys.exc_info()).error(f'task failed {where}: {error}')
 
+    def requeued(self, error: ThrottledError):
+        """Set the task result back to PENDING, so the step runs it again later."""
+        self._manifest.result = Result.PENDING
+        self.throttled = True
+        self.throttles += 1
+        self.retry_after = error.retry_after
+        logger.warning(f'task throttled ({self.throttles}/{THROTTLE_RETRIES}): {error}, it will be retried later')
+
     def aborted(self):
         """Set the task result to ABORTED."""
         self._manifest.result = Result.ABORTED
@@ -70,7 +84,11 @@ def report(func):
             elif func.__name__ == 'upload':
                 logger.info('task upload started')
 
-            result: Task = func(self, *args, **kwargs)
+            if self.unchanged and func.__name__ in {'validate', 'upload'}:
+                logger.info(f'source unchanged, skipping task {func.__name__}')
+                result: Task = self
+            else:
+                result = func(self, *args, **kwargs)
 
             if func.__name__ == 'run':
                 self.staged(result.name)
@@ -80,6 +98,10 @@ def report(func):
                 self.completed(result.name, result.resource)
             return result
         except Exception as e:
+            # a throttled task does not abort the others, it is queued again
+            if isinstance(e, ThrottledError) and self.throttles < THROTTLE_RETRIES:
+                self.requeued(e)
+                return None
             kwargs['abort'].set()
             if isinstance(e, TaskAbortedError):
                 self.aborted()
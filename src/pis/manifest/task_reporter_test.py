@@ -0,0 +1,45 @@
+from threading import Event
+from types import SimpleNamespace
+
+from pis.manifest.models import Result, TaskManifest
+from pis.manifest.task_reporter import THROTTLE_RETRIES, TaskReporter, report
+from pis.util.errors import ThrottledError
+
+
+class ThrottledTask(TaskReporter):
+    def __init__(self):
+        super().__init__('throttled')
+        self._manifest = TaskManifest(name=self.name)
+        self.definition = SimpleNamespace(name=self.name)
+        self.unchanged = False
+
+    @report
+    def run(self, *, abort: Event):
+        raise ThrottledError('https://example.com', 1.5)
+
+
+def test_throttled_task_requeued():
+    task = ThrottledTask()
+    abort = Event()
+
+    assert task.run(abort=abort) is None
+
+    assert task.throttled
+    assert task.throttles == 1
+    assert task.retry_after == 1.5
+    assert task._manifest.result == Result.PENDING
+    assert not abort.is_set()
+
+
+def test_throttled_task_fails_after_retries():
+    task = ThrottledTask()
+    abort = Event()
+
+    for _ in range(THROTTLE_RETRIES):
+        task.run(abort=abort)
+    assert not abort.is_set()
+
+    task.run(abort=abort)
+
+    assert task._manifest.result == Result.FAILED
+    assert abort.is_set()
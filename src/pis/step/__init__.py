@@ -1,3 +1,3 @@
 """Step class."""
 
-from pis.step.step import Step
+from pis.step.step import Step, execute_steps
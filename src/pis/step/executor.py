@@ -0,0 +1,237 @@
+"""Executors that run the tasks of a step in parallel."""
+
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from multiprocessing import Manager
+from multiprocessing.pool import Pool, ThreadPool
+from threading import Event
+from typing import TYPE_CHECKING, Self
+
+from pis.config import settings
+from pis.config.models import EXECUTORS
+from pis.manifest.models import Result
+from pis.step.scheduler import Scheduler
+from pis.util.logger import task_logging
+
+if TYPE_CHECKING:
+    from pis.task import Task
+
+
+def _executor(task: 'Task', func_names: list[str], abort: Event) -> 'Task':
+    with task_logging(task):
+        for func_name in func_names:
+            if abort.is_set():
+                task.aborted()
+                break
+            func: Callable = getattr(task, func_name)
+            func(abort=abort)
+            if task.throttled or task._manifest.result in {Result.FAILED, Result.ABORTED}:
+                break
+        return task
+
+
+class Executor(ABC):
+    """Base class for executors.
+
+    An executor runs a pipeline of methods on each task of a list with a number of
+    workers. It is used as a context manager, so the workers are started on entry
+    and shut down on exit.
+
+    Tasks are handed to the workers by a :class:`pis.step.scheduler.Scheduler`, which
+    limits the tasks fetching from each host and queues again the throttled ones.
+
+    :param workers: The number of tasks that can run at the same time.
+    :type workers: int
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+
+    def __enter__(self) -> Self:
+        """Start the workers."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Shut down the workers."""
+        self.shutdown()
+
+    @abstractmethod
+    def start(self):
+        """Start the workers."""
+
+    @abstractmethod
+    def shutdown(self):
+        """Shut down the workers, waiting for them to finish."""
+
+    def event(self) -> Event:
+        """Create an event that can be shared with the tasks.
+
+        :return: The event.
+        :rtype: Event
+        """
+        return Event()
+
+    @abstractmethod
+    def submit(self, func_names: list[str], task: 'Task', abort: Event) -> Future['Task']:
+        """Send a task to the workers to go through a pipeline of functions.
+
+        :param func_names: The names of the functions to execute on the task.
+        :type func_names: list[str]
+        :param task: The task to execute the functions on.
+        :type task: Task
+        :param abort: The abort event to signal the tasks to stop execution.
+        :type abort: Event
+        :return: A future that resolves to the task once it is done.
+        :rtype: Future[Task]
+        """
+
+    def xmap(self, func_names: list[str], tasks: list['Task'], abort: Event) -> list['Task']:
+        """Execute a pipeline of functions on a list of tasks.
+
+        Each task goes through the functions in order on its own, independently of
+        the other tasks, and stops as soon as one of them fails, aborts or is throttled.
+        The order of the returned tasks is not guaranteed.
+
+        :param func_names: The names of the functions to execute on the tasks.
+        :type func_names: list[str]
+        :param tasks: The list of tasks to execute the function on.
+        :type tasks: list[Task]
+        :param abort: The abort event to signal the tasks to stop execution.
+        :type abort: Event
+
+        :return: The list of tasks after the function has been executed on them.
+        :rtype: list[Task]
+        """
+        return self.run(func_names, Scheduler(tasks, settings().host_tasks), abort)
+
+    def run(self, func_names: list[str], scheduler: Scheduler, abort: Event) -> list['Task']:
+        """Execute a pipeline of functions on the tasks handed out by a scheduler.
+
+        Like :meth:`xmap`, but the tasks can keep coming into the scheduler while it
+        runs, and they are sent to the workers as soon as they are added. It returns
+        once the scheduler is closed and all its tasks are done.
+
+        :param func_names: The names of the functions to execute on the tasks.
+        :type func_names: list[str]
+        :param scheduler: The scheduler to take the tasks from.
+        :type scheduler: Scheduler
+        :param abort: The abort event to signal the tasks to stop execution.
+        :type abort: Event
+
+        :return: The list of tasks after the function has been executed on them.
+        :rtype: list[Task]
+        """
+        running: set[Future] = set()
+        done: list[Task] = []
+        # taken before looking at the scheduler, so a change in between is not missed
+        changed = scheduler.changed()
+
+        while scheduler.pending or running or scheduler.is_open:
+            aborted, submitted = self._dispatch(scheduler, len(running), func_names, abort)
+            done.extend(aborted)
+            running.update(submitted)
+            # wake up when a task finishes, new tasks come in or a backed off host is free
+            finished, pending = wait(running | {changed}, timeout=scheduler.delay(), return_when=FIRST_COMPLETED)
+            running = pending - {changed}
+            done.extend(t for t in (f.result() for f in finished - {changed}) if scheduler.finish(t))
+            if changed.done():
+                changed = scheduler.changed()
+        return done
+
+    def _dispatch(
+        self,
+        scheduler: Scheduler,
+        busy: int,
+        func_names: list[str],
+        abort: Event,
+    ) -> tuple[list['Task'], list[Future['Task']]]:
+        if abort.is_set():
+            # no point in waiting for the hosts, the pending tasks abort right away
+            return [_executor(t, func_names, abort) for t in scheduler.drain()], []
+        submitted: list[Future[Task]] = []
+        while busy + len(submitted) < self.workers and (task := scheduler.next()):
+            submitted.append(self.submit(func_names, task, abort))
+        return [], submitted
+
+
+class ProcessExecutor(Executor):
+    """Executor that runs each task in a pool of worker processes.
+
+    Tasks are pickled to and from the workers, and the abort event lives in a
+    :class:`multiprocessing.Manager` server so all processes can see it. This is
+    the way to go for CPU-bound tasks.
+    """
+
+    def start(self):
+        """Start the manager server and the worker processes."""
+        self._manager = Manager()
+        self._pool = Pool(self.workers)
+
+    def shutdown(self):
+        """Shut down the worker processes and the manager server."""
+        self._pool.close()
+        self._pool.join()
+        self._manager.shutdown()
+
+    def event(self) -> Event:
+        """Create an event shared with the worker processes."""
+        return self._manager.Event()  # type: ignore[return-value]
+
+    def submit(self, func_names: list[str], task: 'Task', abort: Event) -> Future['Task']:
+        """Send a task to the worker processes."""
+        future: Future[Task] = Future()
+        self._pool.apply_async(
+            _executor,
+            (task, func_names, abort),
+            callback=future.set_result,
+            error_callback=future.set_exception,
+        )
+        return future
+
+
+class ThreadExecutor(Executor):
+    """Executor that runs each task in a pool of threads.
+
+    Tasks share the memory of the main process, so there is no pickling or spawning
+    involved. As most tasks spend their time waiting for the network, the pool can
+    be much bigger than the number of cores.
+    """
+
+    def start(self):
+        """Start the thread pool."""
+        self._pool = ThreadPool(self.workers)
+
+    def shutdown(self):
+        """Shut down the thread pool."""
+        self._pool.close()
+        self._pool.join()
+
+    def submit(self, func_names: list[str], task: 'Task', abort: Event) -> Future['Task']:
+        """Send a task to the thread pool."""
+        future: Future[Task] = Future()
+        self._pool.apply_async(
+            _executor,
+            (task, func_names, abort),
+            callback=future.set_result,
+            error_callback=future.set_exception,
+        )
+        return future
+
+
+def get_executor(name: EXECUTORS, workers: int) -> Executor:
+    """Get an executor by name.
+
+    :param name: The name of the executor.
+    :type name: EXECUTORS
+    :param workers: The number of tasks that can run at the same time.
+    :type workers: int
+    :return: The executor.
+    :rtype: Executor
+    """
+    executors: dict[str, type[Executor]] = {
+        'process': ProcessExecutor,
+        'thread': ThreadExecutor,
+    }
+    return executors[name](workers)
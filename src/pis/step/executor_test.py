@@ -0,0 +1,31 @@
+from concurrent.futures import Future
+from threading import Thread
+
+import pytest
+
+from pis.step.executor import ProcessExecutor, ThreadExecutor
+from pis.step.scheduler import Scheduler
+
+
+class ClosingScheduler(Scheduler):
+    """Scheduler whose last feed closes right before the executor takes the future."""
+
+    def changed(self) -> Future[None]:
+        if self.is_open:
+            self.close()
+        return super().changed()
+
+
+@pytest.mark.parametrize('executor_class', [ThreadExecutor, ProcessExecutor])
+def test_run_does_not_miss_the_last_feed_closing(executor_class):
+    scheduler = ClosingScheduler([], 0, feeds=1)
+    result = []
+
+    with executor_class(2) as executor:
+        abort = executor.event()
+        runner = Thread(target=lambda: result.append(executor.run(['run'], scheduler, abort)), daemon=True)
+        runner.start()
+        runner.join(timeout=5)
+
+    assert not runner.is_alive()
+    assert result == [[]]
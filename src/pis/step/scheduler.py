@@ -0,0 +1,349 @@
+"""Scheduler that decides which task of a step runs next, based on its dependencies and host."""
+
+import time
+from collections import Counter, deque
+from collections.abc import Iterable
+from concurrent.futures import Future
+from dataclasses import dataclass
+from graphlib import CycleError, TopologicalSorter
+from threading import Condition, RLock
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+from pis.util.errors import DependencyError
+
+if TYPE_CHECKING:
+    from pis.task import Task
+
+# seconds a host is backed off when it throttles us without a retry-after header, it is
+# doubled on every consecutive throttle up to the maximum
+THROTTLE_BACKOFF = 5.0
+THROTTLE_MAX_BACKOFF = 300.0
+
+
+def references(task: 'Task') -> set[str]:
+    """Get the names a task can be depended on by: its name and its destination.
+
+    :param task: The task.
+    :type task: Task
+    :return: The references to the task.
+    :rtype: set[str]
+    """
+    refs = {task.definition.name}
+    destination = getattr(task.definition, 'destination', None)
+    if destination is not None:
+        refs.add(str(destination))
+    return refs
+
+
+def dependencies(task: 'Task') -> list[str]:
+    """Get the references to the tasks a task depends on.
+
+    :param task: The task.
+    :type task: Task
+    :return: The references in the `depends_on` field of the task definition.
+    :rtype: list[str]
+    """
+    return getattr(task.definition, 'depends_on', [])
+
+
+def check_dependencies(tasks: list['Task'], known: set[str] | None = None):
+    """Check that the dependencies of a list of tasks form a graph that can be run.
+
+    :param tasks: The tasks.
+    :type tasks: list[Task]
+    :param known: Optional. The references to other tasks of the run, which do not
+        depend on anything and so cannot be part of a cycle.
+    :type known: set[str] | None
+    :raises DependencyError: If a task depends on a reference that no task matches, or
+        if there is a cycle in the dependencies.
+    """
+    by_ref: dict[str, set[int]] = {}
+    for i, task in enumerate(tasks):
+        for ref in references(task):
+            by_ref.setdefault(ref, set()).add(i)
+
+    graph: dict[int, set[int]] = {}
+    for i, task in enumerate(tasks):
+        graph[i] = set()
+        for ref in dependencies(task):
+            if ref not in by_ref and ref not in (known or set()):
+                raise DependencyError(f'task {task.name} depends on {ref}, which is not a task of this run')
+            graph[i] |= by_ref.get(ref, set())
+
+    try:
+        TopologicalSorter(graph).prepare()
+    except CycleError as e:
+        cycle = ' -> '.join(tasks[i].name for i in e.args[1])
+        raise DependencyError(f'cycle in task dependencies: {cycle}')
+
+
+@dataclass
+class HostState:
+    """The scheduling state of a host.
+
+    :ivar limit: The number of tasks that can fetch from the host at once, `0` for no limit.
+    :vartype limit: int
+    :ivar running: The number of tasks fetching from the host right now.
+    :vartype running: int
+    :ivar not_before: The monotonic time before which no task is sent to the host.
+    :vartype not_before: float
+    :ivar throttles: The number of consecutive throttles from the host.
+    :vartype throttles: int
+    :ivar throttled_at: The number of tasks fetching from the host the last time it
+        throttled us.
+    :vartype throttled_at: int
+    """
+
+    limit: int
+    running: int = 0
+    not_before: float = 0.0
+    throttles: int = 0
+    throttled_at: int = 0
+
+
+class Scheduler:
+    """Scheduler that hands out the tasks of a step to an executor.
+
+    A task is only handed out once all the tasks it depends on are done (see
+    :class:`pis.config.models.TaskDefinition`), so chains of tasks overlap with the
+    rest of the step instead of waiting for each other in stages. The dependencies are
+    checked with :func:`check_dependencies` once all the tasks are known.
+
+    Tasks can be added while the scheduler is running, from other threads, by a number
+    of `feeds` (like the pretasks of a step) that each call :meth:`close` when they are
+    done adding. Until then, a task that depends on something that is not known yet
+    waits for it, and :meth:`changed` tells the executor when to look again. With
+    `max_pending`, a feed adding a task is held back while that many tasks are waiting
+    to be handed out, so a pretask that generates lots of them does not get far ahead
+    of the workers. The feeds are only let through when none of the pending tasks can
+    run until more tasks come.
+
+    Each task is also keyed by its host (see :meth:`pis.task.Task.host`), and no more than
+    `max_per_host` tasks fetching from the same host are handed out at once. Instead of
+    blocking on a busy host, the scheduler skips ahead to the tasks for other hosts, so
+    the pool of workers stays full.
+
+    The limit of a host adapts to how it responds. When a task comes back throttled
+    (see :class:`pis.util.errors.ThrottledError`), the limit of its host is halved, the
+    host is backed off for the time it asked for in its `Retry-After` header (or an
+    exponential backoff if it did not), and the task is queued again. Every task that
+    finishes without a throttle raises the limit by one, up to `max_per_host`. With no
+    `max_per_host`, the limit is lifted again once it is back to the number of tasks
+    that were running when the host throttled.
+
+    :param tasks: The tasks to schedule.
+    :type tasks: Iterable[Task]
+    :param max_per_host: The maximum number of tasks per host, `0` for no limit.
+    :type max_per_host: int
+    :param feeds: Optional. The number of feeds that will add more tasks, defaults to
+        none, in which case the dependencies are checked right away.
+    :type feeds: int
+    :param max_pending: Optional. The number of pending tasks that holds back the feeds,
+        defaults to `0` for no limit.
+    :type max_pending: int
+    :ivar pending: The tasks waiting to be handed out, in order.
+    :vartype pending: deque[Task]
+    :raises DependencyError: If the dependencies of the tasks cannot be resolved.
+    """
+
+    def __init__(self, tasks: Iterable['Task'], max_per_host: int, *, feeds: int = 0, max_pending: int = 0):
+        self.pending: deque[Task] = deque()
+        self.max_per_host = max_per_host
+        self.max_pending = max_pending
+        self._hosts: dict[str, HostState] = {}
+        self._lock = RLock()
+        self._room = Condition(self._lock)
+        self._feeds = feeds
+        self._running = 0
+        self._changed: Future[None] = Future()
+        # tasks are matched by reference, as executors can return copies of them; only
+        # the references are kept once a task is handed out, so memory does not grow
+        # with the tasks, except for the ones with dependencies, to check them
+        self._unfinished: Counter[str] = Counter()
+        self._known: set[str] = set()
+        self._dependent: list[Task] = []
+        self._checked = False
+        self.add(tasks)
+        self._check()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether some feed can still add tasks."""
+        return self._feeds > 0
+
+    def add(self, tasks: Iterable['Task']):
+        """Add tasks to the end of the queue.
+
+        If `max_pending` tasks are already waiting, it blocks until there is room.
+
+        :param tasks: The tasks to add.
+        :type tasks: Iterable[Task]
+        """
+        with self._lock:
+            for task in tasks:
+                while self._full():
+                    self._notify()
+                    self._room.wait()
+                refs = references(task)
+                self.pending.append(task)
+                self._unfinished.update(refs)
+                self._known |= refs
+                if dependencies(task):
+                    self._dependent.append(task)
+            self._notify()
+
+    def release(self):
+        """Stop holding back the feeds, so they can finish when the tasks will not run."""
+        with self._lock:
+            self.max_pending = 0
+            self._room.notify_all()
+
+    def _full(self) -> bool:
+        if not self.max_pending or len(self.pending) < self.max_pending:
+            return False
+        # holding back the feeds when no pending task can run would wait forever
+        return bool(self._running) or any(self._ready(t) for t in self.pending)
+
+    def close(self):
+        """Signal that one of the feeds is done adding tasks."""
+        with self._lock:
+            self._feeds -= 1
+            self._notify()
+
+    def changed(self) -> Future[None]:
+        """Get a future that resolves the next time tasks are added or a feed closes.
+
+        It must be taken before looking at the pending tasks or at :attr:`is_open`, and
+        taken again only once it is done, so nothing that changes in the meantime is
+        missed.
+
+        :return: The future.
+        :rtype: Future[None]
+        """
+        with self._lock:
+            if self._changed.done():
+                self._changed = Future()
+            return self._changed
+
+    def _notify(self):
+        if not self._changed.done():
+            self._changed.set_result(None)
+
+    def _check(self):
+        if self._checked or self.is_open:
+            return
+        self._checked = True
+        if self._dependent:
+            check_dependencies(self._dependent, self._known)
+
+    def _ready(self, task: 'Task') -> bool:
+        return all(ref in self._known and not self._unfinished[ref] for ref in dependencies(task))
+
+    def _state(self, host: str) -> HostState:
+        if host not in self._hosts:
+            self._hosts[host] = HostState(limit=self.max_per_host)
+        return self._hosts[host]
+
+    def _available(self, host: str | None, now: float) -> bool:
+        if host is None:
+            return True
+        state = self._state(host)
+        if state.not_before > now:
+            return False
+        return not state.limit or state.running < state.limit
+
+    def next(self) -> 'Task | None':
+        """Hand out the first pending task whose host can take it.
+
+        :return: The task, or `None` if no pending task can run right now.
+        :rtype: Task | None
+        """
+        with self._lock:
+            self._check()
+            now = time.monotonic()
+            task = next((t for t in self.pending if self._ready(t) and self._available(t.host(), now)), None)
+            if task is None:
+                return None
+
+            self.pending.remove(task)
+            self._running += 1
+            self._room.notify_all()
+            host = task.host()
+            if host is not None:
+                self._state(host).running += 1
+            task.throttled = False
+            return task
+
+    def finish(self, task: 'Task') -> bool:
+        """Record a task coming back from the executor.
+
+        :param task: The task, as returned by the executor.
+        :type task: Task
+        :return: Whether the task is done, or `False` if it was queued again.
+        :rtype: bool
+        """
+        with self._lock:
+            self._running -= 1
+            self._room.notify_all()
+            host = task.host()
+            state = self._state(host) if host is not None else None
+            if state is not None:
+                state.running -= 1
+
+            if not task.throttled:
+                for ref in references(task):
+                    self._unfinished[ref] -= 1
+                    if not self._unfinished[ref]:
+                        del self._unfinished[ref]
+                if state is not None:
+                    state.throttles = 0
+                    if state.limit and self.max_per_host:
+                        state.limit = min(state.limit + 1, self.max_per_host)
+                    elif state.limit:
+                        # with no ceiling, the limit is lifted once it is back to where the host throttled
+                        state.limit = state.limit + 1 if state.limit < state.throttled_at else 0
+                return True
+
+            if state is not None:
+                state.throttles += 1
+                state.throttled_at = state.running + 1
+                state.limit = max(1, (state.limit or state.running + 1) // 2)
+                delay = task.retry_after
+                if delay is None:
+                    delay = min(THROTTLE_BACKOFF * 2 ** (state.throttles - 1), THROTTLE_MAX_BACKOFF)
+                state.not_before = max(state.not_before, time.monotonic() + delay)
+                logger.warning(
+                    f'{host} is throttling us, backing off for {delay:.1f}s with {state.limit} tasks at once'
+                )
+            self.pending.append(task)
+            return False
+
+    def delay(self) -> float | None:
+        """Get the seconds until a backed off host can take tasks again.
+
+        :return: The seconds to wait, or `None` if no ready task is waiting for a
+            backed off host.
+        :rtype: float | None
+        """
+        with self._lock:
+            now = time.monotonic()
+            waits = [
+                self._hosts[host].not_before - now
+                for host in {t.host() for t in self.pending if self._ready(t)} - {None}
+                if host in self._hosts and self._hosts[host].not_before > now
+            ]
+            return max(0.0, min(waits)) if waits else None
+
+    def drain(self) -> list['Task']:
+        """Take all the pending tasks out of the scheduler, regardless of their hosts.
+
+        :return: The pending tasks.
+        :rtype: list[Task]
+        """
+        with self._lock:
+            tasks = list(self.pending)
+            self.pending.clear()
+            self._room.notify_all()
+            return tasks
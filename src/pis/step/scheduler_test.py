@@ -0,0 +1,224 @@
+import time
+from pathlib import Path
+from threading import Thread
+from types import SimpleNamespace
+
+import pytest
+
+from pis.step.scheduler import THROTTLE_BACKOFF, Scheduler
+from pis.util.errors import DependencyError
+
+
+class FakeTask:
+    def __init__(self, name: str, host: str | None = None, depends_on: list[str] | None = None):
+        self.name = name
+        self.definition = SimpleNamespace(name=name, depends_on=depends_on or [])
+        self._host = host
+        self.throttled = False
+        self.retry_after: float | None = None
+
+    def host(self) -> str | None:
+        return self._host
+
+
+def throttle(task: FakeTask, retry_after: float | None = 0.0) -> FakeTask:
+    task.throttled = True
+    task.retry_after = retry_after
+    return task
+
+
+def take_all(scheduler: Scheduler) -> list[FakeTask]:
+    tasks = []
+    while task := scheduler.next():
+        tasks.append(task)
+    return tasks
+
+
+@pytest.mark.parametrize('max_per_host', [0, 8])
+def test_limit_recovers_after_throttle(max_per_host):
+    scheduler = Scheduler([FakeTask(f't{i}', 'h') for i in range(4)], max_per_host)
+    first, *others = take_all(scheduler)
+
+    assert not scheduler.finish(throttle(first))
+    for task in others:
+        assert scheduler.finish(task)
+
+    scheduler.add([FakeTask(f'n{i}', 'h') for i in range(4)])
+    assert len(take_all(scheduler)) == 5
+
+
+def test_limit_per_host():
+    tasks = [FakeTask('a1', 'a'), FakeTask('a2', 'a'), FakeTask('a3', 'a'), FakeTask('b1', 'b'), FakeTask('n1')]
+    scheduler = Scheduler(tasks, 2)
+
+    assert [t.name for t in take_all(scheduler)] == ['a1', 'a2', 'b1', 'n1']
+
+    scheduler.finish(tasks[0])
+    assert [t.name for t in take_all(scheduler)] == ['a3']
+
+
+def test_throttle_halves_limit():
+    scheduler = Scheduler([FakeTask(f't{i}', 'h') for i in range(5)], 4)
+    first, *running = take_all(scheduler)
+    assert len(running) == 3
+
+    # 3 tasks still running with a limit of 2
+    assert not scheduler.finish(throttle(first))
+    assert scheduler.next() is None
+
+    # 2 tasks running with a limit of 3
+    scheduler.finish(running[0])
+    assert len(take_all(scheduler)) == 1
+
+
+def test_throttle_backs_off():
+    scheduler = Scheduler([FakeTask('t0', 'h'), FakeTask('other', 'o')], 4)
+    task = scheduler.next()
+
+    assert not scheduler.finish(throttle(task, None))
+
+    assert THROTTLE_BACKOFF - 1 < scheduler.delay() <= THROTTLE_BACKOFF
+    assert [t.name for t in take_all(scheduler)] == ['other']
+
+
+def test_throttle_backoff_doubles_while_throttling():
+    scheduler = Scheduler([FakeTask('t0', 'h'), FakeTask('t1', 'h')], 4)
+    first, second = take_all(scheduler)
+
+    scheduler.finish(throttle(first, None))
+    scheduler.finish(throttle(second, None))
+
+    assert 2 * THROTTLE_BACKOFF - 1 < scheduler.delay() <= 2 * THROTTLE_BACKOFF
+
+
+def test_throttled_task_requeued_after_retry_after():
+    scheduler = Scheduler([FakeTask('t0', 'h'), FakeTask('other', 'o')], 4)
+    task, other = take_all(scheduler)
+
+    assert not scheduler.finish(throttle(task, 0.05))
+    assert scheduler.next() is None
+    assert 0 < scheduler.delay() <= 0.05
+
+    time.sleep(0.06)
+    assert scheduler.next() is task
+    assert not task.throttled
+    assert scheduler.finish(task)
+    assert scheduler.finish(other)
+
+
+def test_dependencies_order():
+    a = FakeTask('a')
+    b = FakeTask('b', depends_on=['a'])
+    c = FakeTask('c', depends_on=['b', 'a'])
+    d = FakeTask('d')
+    scheduler = Scheduler([c, b, a, d], 0)
+
+    assert take_all(scheduler) == [a, d]
+    scheduler.finish(a)
+    assert take_all(scheduler) == [b]
+    scheduler.finish(b)
+    assert take_all(scheduler) == [c]
+
+
+def test_dependencies_by_destination():
+    a = FakeTask('a')
+    a.definition.destination = Path('dir/a.json')
+    b = FakeTask('b', depends_on=['dir/a.json'])
+    scheduler = Scheduler([b, a], 0)
+
+    assert take_all(scheduler) == [a]
+    scheduler.finish(a)
+    assert take_all(scheduler) == [b]
+
+
+def test_dependencies_cycle():
+    tasks = [FakeTask('a', depends_on=['c']), FakeTask('b', depends_on=['a']), FakeTask('c', depends_on=['b'])]
+
+    with pytest.raises(DependencyError, match='cycle in task dependencies'):
+        Scheduler(tasks, 0)
+
+
+def test_dependencies_unknown():
+    with pytest.raises(DependencyError, match='task a depends on nope, which is not a task of this run'):
+        Scheduler([FakeTask('a', depends_on=['nope'])], 0)
+
+
+def test_feed_dependency_waits_for_unknown_task():
+    scheduler = Scheduler([FakeTask('b', depends_on=['a'])], 0, feeds=1)
+    assert scheduler.next() is None
+
+    a = FakeTask('a')
+    scheduler.add([a])
+    scheduler.close()
+
+    assert take_all(scheduler) == [a]
+
+
+def test_feed_dependency_unknown_once_closed():
+    scheduler = Scheduler([FakeTask('b', depends_on=['a'])], 0, feeds=1)
+    scheduler.close()
+
+    with pytest.raises(DependencyError):
+        scheduler.next()
+
+
+def test_close_and_changed():
+    scheduler = Scheduler([], 0, feeds=2)
+    changed = scheduler.changed()
+    assert not changed.done()
+    assert scheduler.changed() is changed
+
+    scheduler.add([FakeTask('a')])
+    assert changed.done()
+
+    changed = scheduler.changed()
+    assert not changed.done()
+    scheduler.close()
+    assert changed.done()
+    assert scheduler.is_open
+
+    changed = scheduler.changed()
+    scheduler.close()
+    assert changed.done()
+    assert not scheduler.is_open
+
+
+def add_in_thread(scheduler: Scheduler, tasks: list[FakeTask]) -> Thread:
+    adder = Thread(target=scheduler.add, args=(tasks,), daemon=True)
+    adder.start()
+    adder.join(timeout=0.1)
+    return adder
+
+
+def test_add_blocks_at_max_pending():
+    scheduler = Scheduler([], 0, feeds=1, max_pending=2)
+    scheduler.add([FakeTask('a'), FakeTask('b')])
+
+    adder = add_in_thread(scheduler, [FakeTask('c')])
+    assert adder.is_alive()
+
+    scheduler.next()
+    adder.join(timeout=1)
+    assert not adder.is_alive()
+    assert [t.name for t in scheduler.pending] == ['b', 'c']
+
+
+def test_add_released():
+    scheduler = Scheduler([], 0, feeds=1, max_pending=1)
+    scheduler.add([FakeTask('a')])
+
+    adder = add_in_thread(scheduler, [FakeTask('b'), FakeTask('c')])
+    assert adder.is_alive()
+
+    scheduler.release()
+    adder.join(timeout=1)
+    assert not adder.is_alive()
+    assert len(scheduler.pending) == 3
+
+
+def test_add_does_not_block_when_no_pending_task_can_run():
+    scheduler = Scheduler([], 0, feeds=1, max_pending=1)
+    scheduler.add([FakeTask('b', depends_on=['a'])])
+
+    adder = add_in_thread(scheduler, [FakeTask('a')])
+    assert not adder.is_alive()
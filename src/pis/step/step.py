@@ -1,63 +1,26 @@
 """Step module."""
 
-from collections.abc import Callable
-from multiprocessing import Manager
-from multiprocessing.pool import Pool
+from concurrent.futures import ThreadPoolExecutor
 from threading import Event
 from typing import TYPE_CHECKING
 
 from loguru import logger
 
 from pis.config import settings, task_definitions
+from pis.manifest.models import Resource, Result, StepManifest
 from pis.manifest.step_reporter import StepReporter, report
+from pis.step.executor import _executor, get_executor
+from pis.step.scheduler import Scheduler
 from pis.task import task_registry
 from pis.util.errors import StepFailedError
-from pis.util.logger import task_logging
 
 if TYPE_CHECKING:
+    from pis.config.models import BaseTaskDefinition
     from pis.task import Pretask, Task
 
-
-def _executor(task: 'Task', func_name: str, abort: Event) -> 'Task':
-    with task_logging(task):
-        if not abort.is_set():
-            func: Callable = getattr(task, func_name)
-            func(abort=abort)
-        else:
-            task.aborted()
-        return task
-
-
-def _execute(args):
-    task, func_name, abort = args
-    return _executor(task, func_name, abort)
-
-
-class XPool(Pool):
-    """Extended Pool class.
-
-    This class extends the Pool class to add an xmap method that allows for the execution of
-    a function on a list of tasks, while also providing an abort mechanism.
-    """
-
-    def xmap(self, func_name: str, tasks: list['Task'], abort: Event) -> list['Task']:
-        """Execute a function on a list of tasks.
-
-        This is a wrapper for imap_unordered that allows for the execution of a function
-        on a list of tasks with arbitrary parameters without having to clump them together
-        in a single tuple. It also provides an abort mechanism.
-
-        :param func_name: The name of the function to execute on the tasks.
-        :type func_name: str
-        :param tasks: The list of tasks to execute the function on.
-        :type tasks: list[Task]
-        :param abort: The abort event to signal the tasks to stop execution.
-        :type abort: Event
-
-        :return: The list of tasks after the function has been executed on them.
-        :rtype: list[Task]
-        """
-        return list(self.imap_unordered(_execute, [(t, func_name, abort) for t in tasks]))
+# tasks per worker that can wait to be handed out before the pretasks generating them
+# are held back, so big explodes do not pile up tasks in memory
+PENDING_TASKS_PER_WORKER = 4
 
 
 class Step(StepReporter):
@@ -66,87 +29,176 @@ class Step(StepReporter):
     This class represents a step in the pipeline. A step is a collection of pretasks and
     tasks. The step will:
 
-    1. Initialize the pretasks.
-    2. Run the pretasks.
-    3. Initialize the tasks.
-    4. Send the tasks to the pool for parallel execution.
-    5. Validate the tasks.
-    6. Upload the tasks.
-
+    1. Initialize the tasks and the pretasks.
+    2. Run the pretasks at the same time.
+    3. Send the tasks to the executor for parallel execution, where each task is run,
+       validated and uploaded on its own, so a task is validated and uploaded while
+       others are still running. The tasks generated by the pretasks are sent as soon
+       as they are emitted, without waiting for the pretasks to finish. Each task is
+       handed out as soon as the tasks it depends on are done, and no busy or
+       throttling host holds up the rest, see :mod:`pis.step.scheduler`.
+
+    Each task gets the resource it produced in the previous run of the step, matched by
+    destination, so it can skip its work if its source is unchanged (see
+    :attr:`pis.config.models.Settings.skip_unchanged`) or update it incrementally.
+
+    The executor is chosen with :attr:`pis.config.models.Settings.executor`, see
+    :mod:`pis.step.executor`. Several steps can share a single executor with
+    :func:`execute_steps`.
+
+    :param name: The name of the step.
+    :type name: str
+    :param previous: The manifest of the previous run of the step, defaults to `None`.
+    :type previous: StepManifest | None, optional
     :ivar name: The name of the step.
     :vartype name: str
     """
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, previous: StepManifest | None = None):
         super().__init__(name)
+        self._previous_resources: dict[str, Resource] = {}
+        if previous:
+            self._previous_resources = {r.destination: r for r in previous.resources}
 
     def _instantiate_pretasks(self) -> list['Pretask']:
         logger.debug('instantiating pretasks')
-        return [task_registry().instantiate_p(td) for td in task_definitions() if task_registry().is_pretask(td)]
+        definitions = task_definitions(self.name)
+        return [task_registry().instantiate_p(td) for td in definitions if task_registry().is_pretask(td)]
 
     def _instantiate_tasks(self) -> list['Task']:
         logger.debug('instantiating tasks')
-        return [task_registry().instantiate_t(td) for td in task_definitions() if not task_registry().is_pretask(td)]
+        definitions = [td for td in task_definitions(self.name) if not task_registry().is_pretask(td)]
+        return [self._instantiate_task(td) for td in definitions]
+
+    def _instantiate_task(self, definition: 'BaseTaskDefinition') -> 'Task':
+        task = task_registry().instantiate_t(definition)
+        task.step = self.name
+        self._attach_previous(task)
+        return task
+
+    def _attach_previous(self, task: 'Task'):
+        if not self._previous_resources:
+            return
+        destination = str(getattr(task.definition, 'destination', ''))
+        key = Resource(source='', destination=destination).make_absolute().destination
+        task.previous = self._previous_resources.get(key)
 
     @report
-    def _init(self, pretasks: list['Pretask'], *, abort: Event) -> list['Task']:
+    def _init(self, pretasks: list['Pretask'], *, abort: Event) -> list['Pretask']:
         logger.info(f'running {len(pretasks)} pretasks' if len(pretasks) > 0 else 'no pretasks to run in this step')
-        return [_executor(p, 'run', abort) for p in pretasks]
+        if not pretasks:
+            return []
+        with ThreadPoolExecutor(min(len(pretasks), settings().pool)) as pool:
+            return list(pool.map(lambda p: _executor(p, ['run'], abort), pretasks))
 
-    @report
-    def _run(self, tasks: list['Task'], *, abort: Event) -> list['Task']:
-        logger.info(f'running {len(task_definitions())} main tasks')
-        with XPool(settings().pool) as run_pool:
-            return run_pool.xmap('run', tasks, abort)
+    def _prepare(self, scheduler: Scheduler, *, abort: Event):
+        """Instantiate the tasks of the step and run its pretasks, feeding the scheduler.
 
-    @report
-    def _validate(self, tasks: list['Task'], *, abort: Event) -> list['Task']:
-        logger.info(f'validating {len(task_definitions())} main tasks')
-        with XPool(settings().pool) as validation_pool:
-            return validation_pool.xmap('validate', tasks, abort)
+        The tasks in the configuration file go to the scheduler right away, and the
+        tasks generated by the pretasks as they are emitted. The scheduler is closed
+        once the pretasks are done, whatever the outcome.
+
+        :param scheduler: The scheduler to add the tasks to.
+        :type scheduler: Scheduler
+        :param abort: The abort event.
+        :type abort: Event
+        :raises StepFailedError: If a pretask fails.
+        """
+        try:
+            logger.info(f'step {self.name} started')
+            scheduler.add(self._instantiate_tasks())
+            pretasks = self._instantiate_pretasks()
+            for pretask in pretasks:
+                pretask.on_emit = lambda td: scheduler.add([self._instantiate_task(td)])
+            pretasks = self._init(pretasks, abort=abort)
+            if pretasks is None or any(p._manifest.result in {Result.FAILED, Result.ABORTED} for p in pretasks):
+                raise StepFailedError(self.name, 'initialization')
+        finally:
+            scheduler.close()
 
     @report
-    def _upload(self, tasks: list['Task'], *, abort: Event) -> list['Task']:
-        logger.info(f'uploading {len(task_definitions())} main tasks')
-        with XPool(settings().pool) as upload_pool:
-            return upload_pool.xmap('upload', tasks, abort)
+    def _run(self, tasks: list['Task'], *, abort: Event) -> list['Task']:
+        """Collect the tasks of the step once they are back from the executor."""
+        return tasks
 
-    def execute(self):
+    def execute(self) -> 'Step':
         """Execute the step.
 
-        :raises StepFailedError: If the step execution fails at any point.
         :return: The step instance itself.
         :rtype: Step
         """
-        with Manager() as manager:
-            a = manager.Event()
+        execute_steps([self])
+        return self
 
+
+def execute_steps(steps: list[Step]) -> list[Step]:
+    """Execute several steps in a single run.
+
+    The tasks of all the steps are sent together to a single executor, so they share the
+    workers, the connection pools and the host limits, and a task can depend on a task
+    of another step. Tasks for the hosts of a step are not held back by a slow step
+    before it. The pretasks of all the steps run at the same time in threads, and the
+    tasks they generate are sent to the executor as they come. The pretasks are held
+    back while the workers catch up, so memory does not grow with the number of tasks
+    they generate.
+
+    As in a single step, a failure aborts the whole run. Each step is then failed if any
+    of its own tasks did not make it.
+
+    :param steps: The steps to execute.
+    :type steps: list[Step]
+    :return: The steps.
+    :rtype: list[Step]
+    """
+    func_names = ['run', 'validate']
+    if settings().remote_uri:
+        func_names.append('upload')
+    else:
+        logger.info('no remote URI provided, skipping upload phase')
+
+    with get_executor(settings().executor, settings().pool) as executor:
+        a = executor.event()
+        scheduler = Scheduler(
+            [],
+            settings().host_tasks,
+            feeds=len(steps),
+            max_pending=PENDING_TASKS_PER_WORKER * settings().pool,
+        )
+        initialized: dict[str, bool] = {}
+
+        def prepare(step: Step):
+            try:
+                step._prepare(scheduler, abort=a)
+                initialized[step.name] = True
+            except Exception as e:
+                a.set()
+                initialized[step.name] = False
+                step.failed(f'step execution failed: {e}')
+
+        # the pretasks feed the main tasks to the executor while they run
+        phases = ', '.join(func_names)
+        logger.info(f'running the main tasks of {len(steps)} steps through {phases}')
+        with ThreadPoolExecutor(len(steps)) as preparing:
+            feeds = [preparing.submit(prepare, step) for step in steps]
             try:
-                # pretask process, sequential execution of initialization tasks
-                pretasks = self._instantiate_pretasks()
-
-                pretasks = self._init(pretasks, abort=a)
-                if a.is_set():
-                    raise StepFailedError(self.name, 'initialization')
-
-                # main process, parallel execution of resource generating tasks
-                tasks = self._instantiate_tasks()
-
-                tasks = self._run(tasks, abort=a)
-                if a.is_set():
-                    raise StepFailedError(self.name, 'run')
-
-                tasks = self._validate(tasks, abort=a)
-                if a.is_set():
-                    raise StepFailedError(self.name, 'validation')
-
-                if settings().remote_uri:
-                    tasks = self._upload(tasks, abort=a)
-                    if a.is_set():
-                        raise StepFailedError(self.name, 'upload')
-                else:
-                    logger.info('no remote URI provided, skipping upload phase')
+                tasks = executor.run(func_names, scheduler, a)
             except Exception as e:
                 a.set()
-                self.failed(f'step execution failed: {e}')
-            return self
+                scheduler.release()
+                for step in steps:
+                    step.failed(f'step execution failed: {e}')
+                return steps
+        # pretasks exit the program on configuration errors, do it from the main thread
+        for feed in feeds:
+            feed.result()
+
+        for step in steps:
+            step_tasks = [t for t in tasks if t.step == step.name]
+            if not initialized.get(step.name):
+                step.upsert_task_manifests(step_tasks)
+                continue
+            step_tasks = step._run(step_tasks, abort=a) or []
+            if a.is_set() and any(t._manifest.result in {Result.FAILED, Result.ABORTED} for t in step_tasks):
+                error = StepFailedError(step.name, 'run')
+                step.failed(f'step execution failed: {error}')
+    return steps
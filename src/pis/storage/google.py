@@ -1,25 +1,98 @@
 """Google Cloud Storage helper module."""
 
+import base64
+import os
 import re
 import sys
+import uuid
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from threading import Event, Lock
+from typing import IO
 
+import google_crc32c
 from google import auth
 from google.api_core.exceptions import GoogleAPICallError, PreconditionFailed
 from google.auth import exceptions as auth_exceptions
+from google.auth.credentials import Credentials
 from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
 from google.cloud.exceptions import NotFound
 from loguru import logger
+from requests.adapters import HTTPAdapter
 
-from pis.helpers import RemoteStorage
-from pis.util.errors import NotFoundError, PreconditionFailedError, StorageError
+from pis.config import settings
+from pis.helpers import RemoteFile, RemoteStorage, compile_pattern
+from pis.util.errors import NotFoundError, PreconditionFailedError, StorageError, TaskAbortedError
 
 GOOGLE_SCOPES = [
     'https://www.googleapis.com/auth/cloud-platform',
     'https://www.googleapis.com/auth/spreadsheets',
 ]
+# size of the chunks sent in a streamed upload, must be a multiple of 256 KiB
+STREAM_CHUNK_SIZE = 1024 * 1024 * 16
+# maximum number of objects that can be composed into one in a single request
+COMPOSE_MAX_PARTS = 32
+# sliced downloads fetch byte ranges of this size with this many threads
+SLICED_DOWNLOAD_CHUNK_SIZE = 1024 * 1024 * 32
+SLICED_DOWNLOAD_WORKERS = 8
+# only the fields used to build a RemoteFile are requested when listing
+LIST_FIELDS = 'items(name,updated,size,generation,crc32c),prefixes,nextPageToken'
+
+
+class _Connection:
+    """Credentials, client and bucket handles shared by a process.
+
+    Authenticating and building a client is expensive, and every client comes with
+    its own connection pool, so they are created once per process and reused by all
+    the :class:`GoogleStorage` instances in it.
+    """
+
+    def __init__(self):
+        try:
+            credentials, project_id = auth.default(scopes=GOOGLE_SCOPES)
+            logger.debug(f'gcp authenticated on project {project_id}')
+        except auth_exceptions.DefaultCredentialsError as e:
+            logger.critical(f'error authenticating on gcp: {e}')
+            sys.exit(1)
+
+        # the default pool keeps 10 connections per host, which is not enough for
+        # the threads of the executor, sliced downloads and composite uploads
+        pool_size = settings().http_pool_size
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = AuthorizedSession(credentials)
+        self.session.mount('https://', adapter)
+
+        self.credentials: Credentials = credentials
+        self.client = storage.Client(credentials=credentials, _http=self.session)
+        self.buckets: dict[str, storage.Bucket] = {}
+        self.lock = Lock()
+
+
+# connections are keyed by process id, so forked workers don't inherit the sockets
+# of their parent
+_connections: dict[int, _Connection] = {}
+_connections_lock = Lock()
+
+
+def _get_connection() -> _Connection:
+    pid = os.getpid()
+    with _connections_lock:
+        if pid not in _connections:
+            _connections[pid] = _Connection()
+        return _connections[pid]
+
+
+def _crc32c(path: Path) -> str:
+    """Get the crc32c checksum of a file, base64 encoded like the one of a blob."""
+    checksum = google_crc32c.Checksum()
+    with open(path, 'rb') as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode()
 
 
 class GoogleStorage(RemoteStorage):
@@ -31,18 +104,15 @@ class GoogleStorage(RemoteStorage):
     :vartype credentials: google.auth.credentials.Credentials
     :ivar client: The Google Cloud Storage client.
     :vartype client: google.cloud.storage.client.Client
+
+    .. note:: The credentials, the client and its connection pool are shared by all
+        the instances in a process. See :attr:`pis.config.models.Settings.http_pool_size`.
     """
 
     def __init__(self):
-        try:
-            credentials, project_id = auth.default(scopes=GOOGLE_SCOPES)
-            logger.debug(f'gcp authenticated on project {project_id}')
-        except auth_exceptions.DefaultCredentialsError as e:
-            logger.critical(f'error authenticating on gcp: {e}')
-            sys.exit(1)
-
-        self.credentials = credentials
-        self.client = storage.Client(credentials=credentials)
+        self._connection = _get_connection()
+        self.credentials = self._connection.credentials
+        self.client = self._connection.client
 
     @classmethod
     def _parse_uri(cls, uri: str) -> tuple[str, str | None]:
@@ -56,9 +126,17 @@ class GoogleStorage(RemoteStorage):
         file_path = uri_parts[1] if len(uri_parts) > 1 else None
         return bucket_name, file_path
 
-    def _get_bucket(self, bucket_name: str) -> storage.Bucket:
+    def _get_bucket(self, bucket_name: str, *, reload: bool = False) -> storage.Bucket:
+        # bucket handles are cached and built without a request, existence is only
+        # checked when reloading them, errors will surface on the first request
         try:
-            return self.client.get_bucket(bucket_name)
+            with self._connection.lock:
+                bucket = self._connection.buckets.get(bucket_name)
+                if bucket is None:
+                    bucket = self._connection.buckets[bucket_name] = self.client.bucket(bucket_name)
+            if reload:
+                bucket.reload()
+            return bucket
         except NotFound:
             raise NotFoundError(bucket_name)
         except GoogleAPICallError as e:
@@ -107,7 +185,7 @@ class GoogleStorage(RemoteStorage):
         ]
 
         try:
-            bucket = self._get_bucket(bucket_name)
+            bucket = self._get_bucket(bucket_name, reload=True)
         except NotFoundError:
             logger.warning(f'bucket {bucket_name} not found')
             return False
@@ -141,37 +219,53 @@ class GoogleStorage(RemoteStorage):
             raise NotFoundError(uri)
         except GoogleAPICallError as e:
             raise StorageError(f'error getting metadata for {uri}: {e}')
-        return {'mtime': datetime.timestamp(blob.updated) if blob.updated else None}
+        return self._blob_metadata(blob)
+
+    @staticmethod
+    def _blob_metadata(blob: storage.Blob) -> dict:
+        return {
+            'mtime': datetime.timestamp(blob.updated) if blob.updated else None,
+            'size': blob.size,
+            'generation': blob.generation,
+            'checksum': f'crc32c:{blob.crc32c}' if blob.crc32c else None,
+        }
 
-    def list(self, uri: str, pattern: str | None = None) -> list[str]:
-        """List blobs in a bucket.
+    def iterate(self, uri: str, pattern: str | list[str] | None = None) -> Iterator[RemoteFile]:
+        """Iterate over the blobs directly in a prefix.
+
+        The listing is shallow and done by the server, using `/` as delimiter, and
+        its pages are fetched as the iterator is consumed. The metadata of the blobs
+        comes with the listing, so they are yielded without requesting each of them.
 
         :param uri: The URI prefix to list blobs for.
         :type uri: str
         :param pattern: The pattern to match blobs against.
-        :type pattern: str | None
-        :return: A list of blob URIs.
-        :rtype: list[str]
-        :raises NotFoundError: If the bucket or prefix does not exist.
-        :raises StorageError: If the prefix is invalid.
+        :type pattern: str | list[str] | None
+        :return: An iterator over the blobs.
+        :rtype: Iterator[RemoteFile]
+        :raises NotFoundError: If the bucket does not exist.
+        :raises StorageError: If the prefix or the pattern are invalid.
         """
         bucket_name, prefix = self._parse_uri(uri)
+        try:
+            match = compile_pattern(pattern)
+        except ValueError as e:
+            raise StorageError(str(e))
+        # make sure we list the contents of the given path, not all prefixes
+        if prefix and not prefix.endswith('/'):
+            prefix = f'{prefix}/'
         bucket = self._get_bucket(bucket_name)
-        blob_names: list[str] = [n.name for n in list(bucket.list_blobs(prefix=prefix))]
-
-        # filter out blobs that have longer prefixes
-        blob_name_list = [n for n in blob_names if self._is_blob_shallow(n, prefix)]
-        # filter out blobs using include/exclude
-        if pattern is not None:
-            if pattern.startswith('!'):
-                blob_name_list = [blob_name for blob_name in blob_name_list if pattern[1:] not in blob_name]
-            else:
-                blob_name_list = [blob_name for blob_name in blob_name_list if pattern in blob_name]
-
-        if len(blob_name_list) == 0:
-            logger.warning(f'no files found in {uri}')
 
-        return [f'gs://{bucket_name}/{blob_name}' for blob_name in blob_name_list]
+        try:
+            blobs = bucket.list_blobs(prefix=prefix, delimiter='/', fields=LIST_FIELDS)
+            for blob in blobs:
+                # the prefix itself can show up as an empty placeholder blob
+                if self._is_blob_shallow(blob.name, prefix) and match(blob.name):
+                    yield RemoteFile(uri=f'gs://{bucket_name}/{blob.name}', **self._blob_metadata(blob))
+        except NotFound:
+            raise NotFoundError(bucket_name)
+        except GoogleAPICallError as e:
+            raise StorageError(f'error listing {uri}: {e}')
 
     def download_to_file(self, uri: str, dst: Path) -> int:
         """Download a file from Google Cloud Storage to the local filesystem.
@@ -197,6 +291,125 @@ class GoogleStorage(RemoteStorage):
             raise StorageError(f'error downloading {uri}: {e}')
         return blob.generation or 0
 
+    def download_to_stream(
+        self,
+        uri: str,
+        stream: IO[bytes],
+        *,
+        start: int = 0,
+        generation: int | None = None,
+    ) -> int:
+        """Download a file from Google Cloud Storage into a writable stream.
+
+        A start offset can be provided to resume a partial download, in which case
+        only the remaining bytes are written into the stream. A generation can be
+        provided to make sure the blob has not changed since the download started.
+
+        :param uri: The URI of the file to download.
+        :type uri: str
+        :param stream: The stream to write the file contents to.
+        :type stream: IO[bytes]
+        :param start: The first byte to download, defaults to 0.
+        :type start: int
+        :param generation: The expected generation of the blob, defaults to None.
+        :type generation: int | None
+        :return: The generation number of the file.
+        :rtype: int
+        :raises NotFoundError: If the file is not found.
+        :raises PreconditionFailedError: If the generation does not match.
+        :raises StorageError: If an error occurs while downloading the file.
+        """
+        bucket_name, prefix = self._parse_uri(uri)
+        bucket = self._get_bucket(bucket_name)
+        blob = self._prepare_blob(bucket, prefix)
+
+        try:
+            blob.download_to_file(
+                stream,
+                start=start or None,
+                if_generation_match=generation,
+                # the checksum of a ranged read cannot be checked against the whole blob
+                checksum=None if start else 'auto',
+            )
+        except NotFound:
+            raise NotFoundError(uri)
+        except PreconditionFailed:
+            raise PreconditionFailedError(f'{uri} changed while downloading')
+        except (GoogleAPICallError, OSError) as e:
+            raise StorageError(f'error downloading {uri}: {e}')
+        return blob.generation or 0
+
+    def download_sliced(
+        self,
+        uri: str,
+        dst: Path,
+        *,
+        generation: int | None = None,
+        abort: Event | None = None,
+    ) -> int:
+        """Download a file from Google Cloud Storage in concurrent byte ranges.
+
+        The blob is split in slices of :data:`SLICED_DOWNLOAD_CHUNK_SIZE`, which are
+        fetched by :data:`SLICED_DOWNLOAD_WORKERS` threads and written in place into
+        the destination file. Slices that have not started yet are skipped once the
+        `abort` event is set or another slice fails. The crc32c checksum of the file
+        is then checked against the checksum of the blob.
+
+        :param uri: The URI of the file to download.
+        :type uri: str
+        :param dst: The destination path to download the file to.
+        :type dst: Path
+        :param generation: The generation of the blob to download, defaults to the
+            latest one.
+        :type generation: int | None
+        :param abort: An event that stops the download when set, defaults to None.
+        :type abort: Event | None
+        :return: The generation number of the file.
+        :rtype: int
+        :raises NotFoundError: If the file is not found.
+        :raises StorageError: If an error occurs while downloading the file, or if
+            the checksum does not match.
+        :raises TaskAbortedError: If the `abort` event is set.
+        """
+        bucket_name, prefix = self._parse_uri(uri)
+        bucket = self._get_bucket(bucket_name)
+        if prefix is None:
+            raise StorageError(f'invalid prefix: {prefix}')
+        blob = bucket.blob(prefix, generation=generation)
+        failed = Event()
+
+        def download_slice(start: int, end: int):
+            if failed.is_set() or (abort and abort.is_set()):
+                return
+            try:
+                with open(dst, 'r+b') as f:
+                    f.seek(start)
+                    blob.download_to_file(f, start=start, end=end, checksum=None)
+            except Exception:
+                failed.set()
+                raise
+
+        try:
+            blob.reload()
+            size = blob.size or 0
+            dst.write_bytes(b'')
+            with ThreadPoolExecutor(SLICED_DOWNLOAD_WORKERS) as pool:
+                futures = [
+                    pool.submit(download_slice, start, min(start + SLICED_DOWNLOAD_CHUNK_SIZE, size) - 1)
+                    for start in range(0, size, SLICED_DOWNLOAD_CHUNK_SIZE)
+                ]
+            for future in futures:
+                future.result()
+            if abort and abort.is_set():
+                raise TaskAbortedError
+            if blob.crc32c and _crc32c(dst) != blob.crc32c:
+                raise StorageError(f'checksum mismatch downloading {uri}')
+        except NotFound:
+            raise NotFoundError(uri)
+        except (GoogleAPICallError, OSError) as e:
+            raise StorageError(f'error downloading {uri}: {e}')
+        return blob.generation or 0
+
     def download_to_string(self, uri: str) -> tuple[str, int]:
         """Download a file from Google Cloud Storage and return its contents as a string.
 
@@ -227,6 +440,10 @@ class GoogleStorage(RemoteStorage):
     def upload(self, src: Path, uri: str, revision: int | None = None) -> int:
         """Upload a file to Google Cloud Storage.
 
+        Files bigger than :attr:`pis.config.models.Settings.composite_upload_threshold`
+        are split into parts which are uploaded concurrently, and then composed into
+        the final object. Note composite objects have a crc32c checksum, but no md5.
+
         :param src: The source path of the file to upload.
         :type src: Path
         :param uri: The URI to upload the file to.
@@ -243,7 +460,9 @@ class GoogleStorage(RemoteStorage):
         blob = self._prepare_blob(bucket, prefix)
 
         try:
-            if revision is not None:
+            if self._is_composite_upload(src):
+                self._upload_composite(bucket, blob, src, revision)
+            elif revision is not None:
                 blob.upload_from_filename(src, if_generation_match=revision)
             else:
                 blob.upload_from_filename(src)
@@ -254,10 +473,126 @@ class GoogleStorage(RemoteStorage):
         blob.reload()
         return blob.generation or 0
 
+    def copy(self, src: str, uri: str, generation: int | None = None) -> int:
+        """Copy a blob to another location in Google Cloud Storage.
+
+        The copy is a rewrite done by the server, which may take several requests for
+        big blobs or copies across locations or storage classes. The checksums of the
+        new blob are the same as those of the source.
+
+        :param src: The URI of the blob to copy.
+        :type src: str
+        :param uri: The URI to copy the blob to.
+        :type uri: str
+        :param generation: Optional. The generation of the blob to copy.
+        :type generation: int | None
+        :return: The generation of the new blob.
+        :rtype: int
+        :raises NotFoundError: If the blob does not exist.
+        :raises StorageError: If an error occurs during the copy.
+        """
+        src_bucket_name, src_prefix = self._parse_uri(src)
+        src_blob = self._prepare_blob(self._get_bucket(src_bucket_name), src_prefix)
+        bucket_name, prefix = self._parse_uri(uri)
+        blob = self._prepare_blob(self._get_bucket(bucket_name), prefix)
+
+        token = None
+        try:
+            while True:
+                token, rewritten, total = blob.rewrite(src_blob, token=token, if_source_generation_match=generation)
+                logger.trace(f'copied {rewritten}/{total} bytes from {src} to {uri}')
+                if token is None:
+                    break
+        except NotFound:
+            raise NotFoundError(src)
+        except PreconditionFailed:
+            raise PreconditionFailedError(f'copy of {src} failed due to generation mismatch')
+        except GoogleAPICallError as e:
+            raise StorageError(f'error copying {src} to {uri}: {e}')
+        return blob.generation or 0
+
+    @staticmethod
+    def _is_composite_upload(src: Path) -> bool:
+        threshold = settings().composite_upload_threshold * 1024 * 1024
+        try:
+            return settings().composite_upload_parts > 1 and src.stat().st_size >= threshold
+        except OSError:
+            # the regular upload will report the error
+            return False
+
+    def _upload_composite(self, bucket: storage.Bucket, blob: storage.Blob, src: Path, revision: int | None):
+        size = src.stat().st_size
+        part_count = min(settings().composite_upload_parts, COMPOSE_MAX_PARTS)
+        part_size = -(-size // part_count)
+        # a random token keeps concurrent uploads of the same object apart
+        token = uuid.uuid4().hex[:8]
+        parts = [bucket.blob(f'{blob.name}.{token}.part{i:02d}') for i in range(-(-size // part_size))]
+        logger.debug(f'uploading {src} in {len(parts)} parts of {part_size} bytes')
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+                futures = [
+                    pool.submit(self._upload_part, part, src, i * part_size, min(part_size, size - i * part_size))
+                    for i, part in enumerate(parts)
+                ]
+                for future in futures:
+                    future.result()
+            # the precondition is checked on the final object, as in a regular upload
+            blob.compose(parts, if_generation_match=revision)
+        finally:
+            for part in parts:
+                try:
+                    part.delete()
+                except NotFound:
+                    pass
+                except GoogleAPICallError as e:
+                    logger.warning(f'error deleting temporary part {part.name}: {e}')
+
+    @staticmethod
+    def _upload_part(part: storage.Blob, src: Path, start: int, length: int):
+        with open(src, 'rb') as f:
+            f.seek(start)
+            # generation 0 means the part must not exist yet
+            part.upload_from_file(f, size=length, if_generation_match=0)
+
+    @contextmanager
+    def open_writer(self, uri: str) -> Iterator[IO[bytes]]:
+        """Open a file in Google Cloud Storage for writing.
+
+        The contents are sent in a resumable upload session, in chunks of
+        :data:`STREAM_CHUNK_SIZE`, so only one chunk is held in memory at a time.
+
+        :param uri: The URI of the file to write.
+        :type uri: str
+        :return: A context manager that yields a writable stream.
+        :rtype: Iterator[IO[bytes]]
+        :raises StorageError: If an error occurs during upload.
+        """
+        bucket_name, prefix = self._parse_uri(uri)
+        bucket = self._get_bucket(bucket_name)
+        blob = self._prepare_blob(bucket, prefix)
+
+        try:
+            writer = blob.open('wb', chunk_size=STREAM_CHUNK_SIZE, ignore_flush=True)
+        except (GoogleAPICallError, OSError) as e:
+            raise StorageError(f'error opening {uri} for writing: {e}')
+
+        try:
+            yield writer  # type: ignore[misc]
+        except BaseException:
+            # cancel the upload session, so a failed transfer leaves no partial file
+            writer.terminate()
+            raise
+
+        try:
+            writer.close()
+        except (GoogleAPICallError, OSError) as e:
+            raise StorageError(f'error uploading {uri}: {e}')
+
     def get_session(self) -> AuthorizedSession:
-        """Get the current authenticated session.
+        """Get the authenticated session shared by the process.
 
         :return: An authorized session.
         :rtype: AuthorizedSession
         """
-        return AuthorizedSession(self.credentials)
+        return self._connection.session
@@ -1,15 +1,20 @@
-from datetime import datetime
+import base64
+from datetime import UTC, datetime
 from pathlib import Path
+from threading import Event
 from unittest.mock import MagicMock, patch
 
+import google_crc32c
 import pytest
 from google.api_core.exceptions import GoogleAPICallError, PreconditionFailed
 from google.cloud import storage
 from google.cloud.exceptions import NotFound
 from loguru import logger
 
-from pis.storage.google import GoogleStorage
-from pis.util.errors import NotFoundError, PreconditionFailedError, StorageError
+from pis.config.models import Settings
+from pis.helpers import RemoteFile
+from pis.storage.google import GoogleStorage, _get_connection
+from pis.util.errors import NotFoundError, PreconditionFailedError, StorageError, TaskAbortedError
 
 urls: list[tuple[str, tuple[str, str | None]]] = [
     ('gs://bucket/file.txt', ('bucket', 'file.txt')),
@@ -47,6 +52,13 @@ def mock_init():
         yield mock_init
 
 
+@pytest.fixture(autouse=True)
+def mocked_settings():
+    with patch('pis.storage.google.settings') as mock_settings:
+        mock_settings.return_value = Settings()
+        yield mock_settings
+
+
 @pytest.fixture
 def mock_parse_url():
     with patch.object(GoogleStorage, '_parse_uri', return_value=('bucket', 'file.txt')) as mock_parse_url:
@@ -83,36 +95,70 @@ def test_parse_uri_ko(input):
         GoogleStorage._parse_uri(input)
 
 
-def test_get_bucket_ok(mock_parse_url):
+@pytest.fixture
+def mock_connection():
+    connection = MagicMock()
+    connection.client = MagicMock(storage.Client)
+    connection.buckets = {}
+    return connection
+
+
+def test_get_bucket_ok(mock_parse_url, mock_connection):
     g = GoogleStorage()
-    g.client = MagicMock(storage.Client)
+    g._connection = mock_connection
+    g.client = mock_connection.client
+
+    b = g._get_bucket('bucket')
+
+    g.client.bucket.assert_called_once_with('bucket')
+    b.reload.assert_not_called()
+    assert b == g.client.bucket.return_value
+
 
+def test_get_bucket_cached(mock_parse_url, mock_connection):
+    g = GoogleStorage()
+    g._connection = mock_connection
+    g.client = mock_connection.client
+
+    g._get_bucket('bucket')
     g._get_bucket('bucket')
 
-    g.client.get_bucket.assert_called_once_with('bucket')
+    g.client.bucket.assert_called_once_with('bucket')
 
 
-def test_get_bucket_ko(mock_parse_url):
+def test_get_bucket_reload(mock_parse_url, mock_connection):
     g = GoogleStorage()
-    g.client = MagicMock(storage.Client)
-    g.client.get_bucket.side_effect = GoogleAPICallError('test')
+    g._connection = mock_connection
+    g.client = mock_connection.client
+
+    b = g._get_bucket('bucket', reload=True)
+
+    b.reload.assert_called_once()
+
+
+def test_get_bucket_ko(mock_parse_url, mock_connection):
+    g = GoogleStorage()
+    g._connection = mock_connection
+    g.client = mock_connection.client
+    g.client.bucket.return_value.reload.side_effect = GoogleAPICallError('test')
 
     with pytest.raises(StorageError):
-        g._get_bucket('gs://bucket')
+        g._get_bucket('gs://bucket', reload=True)
 
-    g.client.get_bucket.side_effect = Exception('test')
+    g.client.bucket.side_effect = Exception('test')
 
     with pytest.raises(StorageError):
-        g._get_bucket('gs://bucket')
+        g._get_bucket('gs://other-bucket')
 
 
-def test_get_bucket_non_existing(mock_parse_url):
+def test_get_bucket_non_existing(mock_parse_url, mock_connection):
     g = GoogleStorage()
-    g.client = MagicMock(storage.Client)
-    g.client.get_bucket.side_effect = NotFound('test')
+    g._connection = mock_connection
+    g.client = mock_connection.client
+    g.client.bucket.return_value.reload.side_effect = NotFound('test')
 
     with pytest.raises(NotFoundError):
-        g._get_bucket('gs://bucket')
+        g._get_bucket('gs://bucket', reload=True)
 
 
 def test_prepare_blob_ok(mock_parse_url):
@@ -224,8 +270,16 @@ def test_stat_ok(mock_parse_url):
     g._get_bucket = MagicMock()
     g._prepare_blob = MagicMock()
     g._prepare_blob.return_value.updated = datetime(2021, 1, 1)
-
-    assert g.stat('gs://bucket/file.txt') == ({'mtime': datetime(2021, 1, 1).timestamp()})
+    g._prepare_blob.return_value.size = 1024
+    g._prepare_blob.return_value.generation = 123
+    g._prepare_blob.return_value.crc32c = 'AAAAAA=='
+
+    assert g.stat('gs://bucket/file.txt') == {
+        'mtime': datetime(2021, 1, 1).timestamp(),
+        'size': 1024,
+        'generation': 123,
+        'checksum': 'crc32c:AAAAAA==',
+    }
     assert g._prepare_blob.return_value.reload.called
 
 
@@ -257,6 +311,28 @@ def test_list_blobs_ok(mock_parse_url):
     blob_names = g.list('testpath')
 
     assert len(blob_names) == len(test_list_output)
+    assert blob_names[0] == RemoteFile(uri='gs://bucket/file_1.txt')
+
+
+def test_list_blobs_metadata(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    blob = storage.Blob('file.txt', 't')
+    blob._properties.update({'updated': '2021-01-01T00:00:00.000Z', 'size': '1024', 'generation': '123'})
+    blob._properties['crc32c'] = 'AAAAAA=='
+    g._get_bucket.return_value.list_blobs.return_value = [blob]
+
+    files = g.list('testpath')
+
+    assert files == [
+        RemoteFile(
+            uri='gs://bucket/file.txt',
+            mtime=datetime(2021, 1, 1, tzinfo=UTC).timestamp(),
+            size=1024,
+            generation=123,
+            checksum='crc32c:AAAAAA==',
+        )
+    ]
 
 
 def test_list_ok_empty(mock_parse_url, caplog):
@@ -291,6 +367,88 @@ def test_list_ok_negative_pattern(mock_parse_url):
     assert len(blob_names) == 3
 
 
+@pytest.mark.parametrize(
+    ('pattern', 'result'),
+    [
+        (None, ['file_1.txt', 'file_2.xls', 'file_3.csv', 'file_4.csv']),
+        ('*.csv', ['file_3.csv', 'file_4.csv']),
+        ('file_[12].*', ['file_1.txt', 'file_2.xls']),
+        ('re:_[34]\\.csv$', ['file_3.csv', 'file_4.csv']),
+        (['*.csv', '*.txt', '!4'], ['file_1.txt', 'file_3.csv']),
+        (['!*.csv', '!re:^file_1'], ['file_2.xls']),
+    ],
+)
+def test_list_rich_patterns(mock_parse_url, pattern, result):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._get_bucket.return_value.list_blobs.return_value = [storage.Blob(n, 't') for n in test_list_input]
+
+    files = g.list('testpath', pattern=pattern)
+
+    assert [f.uri for f in files] == [f'gs://bucket/{n}' for n in result]
+
+
+def test_list_invalid_regex(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+
+    with pytest.raises(StorageError):
+        g.list('testpath', pattern='re:[')
+
+
+def test_iterate_server_side_shallow(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._get_bucket.return_value.list_blobs.return_value = iter([storage.Blob('file.txt/a.txt', 't')])
+
+    files = g.iterate('testpath')
+
+    g._get_bucket.return_value.list_blobs.assert_not_called()
+    assert next(files).uri == 'gs://bucket/file.txt/a.txt'
+    kwargs = g._get_bucket.return_value.list_blobs.call_args.kwargs
+    assert kwargs['prefix'] == 'file.txt/'
+    assert kwargs['delimiter'] == '/'
+
+
+def test_copy_ok(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    blob = g._prepare_blob.return_value
+    blob.rewrite.side_effect = [('token', 10, 20), (None, 20, 20)]
+    blob.generation = 123
+
+    assert g.copy('gs://bucket/file.txt', 'gs://other/file.txt', generation=42) == 123
+
+    assert blob.rewrite.call_count == 2
+    assert blob.rewrite.call_args.kwargs == {'token': 'token', 'if_source_generation_match': 42}
+
+
+def test_copy_non_existing(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    g._prepare_blob.return_value.rewrite.side_effect = NotFound('test')
+
+    with pytest.raises(NotFoundError):
+        g.copy('gs://bucket/file.txt', 'gs://other/file.txt')
+
+
+def test_copy_ko(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    g._prepare_blob.return_value.rewrite.side_effect = PreconditionFailed('test')
+
+    with pytest.raises(PreconditionFailedError):
+        g.copy('gs://bucket/file.txt', 'gs://other/file.txt', generation=42)
+
+    g._prepare_blob.return_value.rewrite.side_effect = GoogleAPICallError('test')
+
+    with pytest.raises(StorageError):
+        g.copy('gs://bucket/file.txt', 'gs://other/file.txt')
+
+
 def test_download_to_file_ok(mock_parse_url, tmp_path):
     g = GoogleStorage()
     g._get_bucket = MagicMock()
@@ -324,6 +482,131 @@ def test_download_to_file_ko(mock_parse_url, tmp_path):
         g.download_to_file('gs://bucket/file.txt', destination)
 
 
+def sliced_blob(g: GoogleStorage, content: bytes, crc32c: str) -> MagicMock:
+    g._get_bucket = MagicMock()
+    blob = g._get_bucket.return_value.blob.return_value
+    blob.generation = 123
+    blob.size = len(content)
+    blob.crc32c = crc32c
+
+    def download_to_file(f, start, end, checksum):
+        f.write(content[start : end + 1])
+
+    blob.download_to_file.side_effect = download_to_file
+    return blob
+
+
+@patch('pis.storage.google.SLICED_DOWNLOAD_CHUNK_SIZE', 1000)
+def test_download_sliced_ok(mock_parse_url, tmp_path):
+    content = bytes(range(256)) * 10
+    g = GoogleStorage()
+    blob = sliced_blob(g, content, base64.b64encode(google_crc32c.value(content).to_bytes(4, 'big')).decode())
+    dst = tmp_path / 'file.bin'
+
+    assert g.download_sliced('gs://bucket/file.txt', dst, generation=123) == 123
+    g._get_bucket.return_value.blob.assert_called_once_with('file.txt', generation=123)
+    assert blob.download_to_file.call_count == 3
+    assert dst.read_bytes() == content
+
+
+@patch('pis.storage.google.SLICED_DOWNLOAD_CHUNK_SIZE', 1000)
+def test_download_sliced_checksum_mismatch(mock_parse_url, tmp_path):
+    g = GoogleStorage()
+    sliced_blob(g, b'x' * 2560, 'AAAAAA==')
+
+    with pytest.raises(StorageError, match='checksum mismatch'):
+        g.download_sliced('gs://bucket/file.txt', tmp_path / 'file.bin')
+
+
+@patch('pis.storage.google.SLICED_DOWNLOAD_CHUNK_SIZE', 1000)
+def test_download_sliced_aborted(mock_parse_url, tmp_path):
+    g = GoogleStorage()
+    blob = sliced_blob(g, b'x' * 2560, 'AAAAAA==')
+    abort = Event()
+    abort.set()
+
+    with pytest.raises(TaskAbortedError):
+        g.download_sliced('gs://bucket/file.txt', tmp_path / 'file.bin', abort=abort)
+    blob.download_to_file.assert_not_called()
+
+
+@patch('pis.storage.google.SLICED_DOWNLOAD_CHUNK_SIZE', 1000)
+def test_download_sliced_failed_slice(mock_parse_url, tmp_path):
+    g = GoogleStorage()
+    blob = sliced_blob(g, b'x' * 2560, 'AAAAAA==')
+    blob.download_to_file.side_effect = GoogleAPICallError('test')
+
+    with (
+        patch('pis.storage.google.SLICED_DOWNLOAD_WORKERS', 1),
+        pytest.raises(StorageError, match='error downloading'),
+    ):
+        g.download_sliced('gs://bucket/file.txt', tmp_path / 'file.bin')
+    blob.download_to_file.assert_called_once()
+
+
+def test_download_to_stream_ok(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    g._prepare_blob.return_value.generation = 123
+    stream = MagicMock()
+
+    assert g.download_to_stream('gs://bucket/file.txt', stream, start=10, generation=123) == 123
+    g._prepare_blob.return_value.download_to_file.assert_called_once_with(
+        stream,
+        start=10,
+        if_generation_match=123,
+        checksum=None,
+    )
+
+
+def test_download_to_stream_generation_mismatch(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    g._prepare_blob.return_value.download_to_file.side_effect = PreconditionFailed('test')
+
+    with pytest.raises(PreconditionFailedError):
+        g.download_to_stream('gs://bucket/file.txt', MagicMock(), generation=123)
+
+
+def test_open_writer_ok(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    writer = g._prepare_blob.return_value.open.return_value
+
+    with g.open_writer('gs://bucket/file.txt') as f:
+        f.write(b'test')
+
+    writer.write.assert_called_once_with(b'test')
+    writer.close.assert_called_once()
+    writer.terminate.assert_not_called()
+
+
+def test_open_writer_cancelled(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    writer = g._prepare_blob.return_value.open.return_value
+
+    with pytest.raises(ValueError), g.open_writer('gs://bucket/file.txt'):
+        raise ValueError
+
+    writer.terminate.assert_called_once()
+    writer.close.assert_not_called()
+
+
+def test_open_writer_upload_error(mock_parse_url):
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    g._prepare_blob.return_value.open.return_value.close.side_effect = GoogleAPICallError('test')
+
+    with pytest.raises(StorageError), g.open_writer('gs://bucket/file.txt'):
+        pass
+
+
 def test_download_to_string_ok(mock_parse_url):
     g = GoogleStorage()
     g._get_bucket = MagicMock()
@@ -399,3 +682,50 @@ def test_upload_ko_bad_revision(mock_parse_url):
 
     with pytest.raises(PreconditionFailedError):
         g.upload(src, 'gs://bucket/file.txt', 123)
+
+
+def test_upload_composite(mock_parse_url, mocked_settings, tmp_path):
+    mocked_settings.return_value = Settings(composite_upload_threshold=0, composite_upload_parts=3)
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    g._prepare_blob.return_value.name = 'file.txt'
+    parts = [MagicMock(), MagicMock(), MagicMock()]
+    g._get_bucket.return_value.blob.side_effect = parts
+    src = tmp_path / 'file.txt'
+    src.write_bytes(b'0123456789')
+
+    g.upload(src, 'gs://bucket/file.txt', 123)
+
+    assert [p.upload_from_file.call_args.kwargs['size'] for p in parts] == [4, 4, 2]
+    g._prepare_blob.return_value.compose.assert_called_once_with(parts, if_generation_match=123)
+    assert all(p.delete.called for p in parts)
+    g._prepare_blob.return_value.upload_from_filename.assert_not_called()
+
+
+def test_upload_composite_bad_revision(mock_parse_url, mocked_settings, tmp_path):
+    mocked_settings.return_value = Settings(composite_upload_threshold=0, composite_upload_parts=2)
+    g = GoogleStorage()
+    g._get_bucket = MagicMock()
+    g._prepare_blob = MagicMock()
+    g._prepare_blob.return_value.compose.side_effect = PreconditionFailed('test')
+    part = g._get_bucket.return_value.blob.return_value
+    src = tmp_path / 'file.txt'
+    src.write_bytes(b'0123456789')
+
+    with pytest.raises(PreconditionFailedError):
+        g.upload(src, 'gs://bucket/file.txt', 123)
+    assert part.delete.call_count == 2
+
+
+def test_get_connection_shared_per_process():
+    with (
+        patch('pis.storage.google._connections', {}),
+        patch('pis.storage.google.auth.default', return_value=(MagicMock(), 'project')) as mock_auth,
+        patch('pis.storage.google.AuthorizedSession'),
+        patch('pis.storage.google.storage.Client') as mock_client,
+    ):
+        assert _get_connection() is _get_connection()
+
+        mock_auth.assert_called_once()
+        mock_client.assert_called_once()
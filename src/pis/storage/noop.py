@@ -1,8 +1,12 @@
 """No-op storage helper module."""
 
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
+from typing import IO
 
-from pis.helpers import RemoteStorage
+from pis.helpers import RemoteFile, RemoteStorage
 from pis.util.errors import NotFoundError
 
 
@@ -21,8 +25,8 @@ class NoopStorage(RemoteStorage):
         """Get metadata for a file."""
         raise NotFoundError(uri)
 
-    def list(self, uri: str, pattern: str | None = None) -> list[str]:
-        """List files."""
+    def iterate(self, uri: str, pattern: str | list[str] | None = None) -> Iterator[RemoteFile]:
+        """Iterate over files."""
         raise NotFoundError(uri)
 
     def download_to_file(self, uri: str, dst: Path) -> int:
@@ -37,6 +41,16 @@ class NoopStorage(RemoteStorage):
         """Upload a file."""
         return 0
 
+    def copy(self, src: str, uri: str, generation: int | None = None) -> int:
+        """Copy a file."""
+        raise NotFoundError(src)
+
+    @contextmanager
+    def open_writer(self, uri: str) -> Iterator[IO[bytes]]:
+        """Open a file for writing, discarding everything written to it."""
+        with open(os.devnull, 'wb') as f:
+            yield f
+
     def get_session(self) -> None:
         """Return a session for making requests."""
         return None
@@ -1,13 +1,16 @@
 """Task classes for PIS."""
 
+from collections.abc import Callable
 from pathlib import Path
 from threading import Event
 from typing import TYPE_CHECKING, Self
+from urllib.parse import urlsplit
 
 from loguru import logger
 
 from pis.config import scratchpad, settings
 from pis.config.models import BaseTaskDefinition, TaskDefinition
+from pis.helpers.download import SourceInfo, is_unchanged
 from pis.helpers.remote_storage import get_remote_storage
 from pis.manifest.task_reporter import TaskReporter, report
 from pis.util.fs import absolute_path
@@ -50,20 +53,145 @@ class Task(TaskReporter):
     :vartype definition: BaseTaskDefinition
     :ivar resource: The resource object associated with the task.
     :vartype resource: Resource
+    :ivar previous: The resource produced by the task in the previous run, if any.
+    :vartype previous: Resource | None
+    :ivar unchanged: Whether the source of the task is unchanged since the previous
+        run. Unchanged tasks skip their validation and upload.
+    :vartype unchanged: bool
+    :ivar source_info: The current metadata of the source, if :meth:`skip_if_unchanged`
+        fetched it while checking the source. Tasks can reuse it instead of asking the
+        source again.
+    :vartype source_info: SourceInfo | None
+    :ivar streamed: Whether the resource was uploaded while it was being fetched, see
+        :meth:`stream_destination`. Streamed tasks skip their upload.
+    :vartype streamed: bool
+    :ivar copied: Whether the resource was copied to the remote URI by the storage
+        itself, see :meth:`copy_destination`. Copied tasks skip their upload.
+    :vartype copied: bool
+    :ivar step: The name of the step the task belongs to.
+    :vartype step: str
+    :ivar throttled: Whether the source throttled the task in its last attempt, so the
+        step must run it again later, see :mod:`pis.step.scheduler`.
+    :vartype throttled: bool
     """
 
     def __init__(self, definition: BaseTaskDefinition):
         super().__init__(definition.name)
         self.definition = definition
         self.resource: Resource
+        self.previous: Resource | None = None
+        self.unchanged = False
+        self.source_info: SourceInfo | None = None
+        self.streamed = False
+        self.copied = False
+        self.step = ''
 
         # replace templates in the definition strings
         for key, value in self.definition.model_dump().items():
             if isinstance(value, str | Path):
                 setattr(self.definition, key, scratchpad().replace(value))
+        if isinstance(self.definition, TaskDefinition):
+            self.definition.depends_on = [str(scratchpad().replace(d)) for d in self.definition.depends_on]
 
         logger.debug(f'initialized task {self.name}')
 
+    def host(self) -> str | None:
+        """Get the host the task fetches its resource from.
+
+        The step uses it to limit the tasks hitting the same host at once, and to back
+        off the hosts that throttle us, see :mod:`pis.step.scheduler`. By default, it
+        is the host of the `source` field of the definition, if there is one.
+
+        :return: The host, or `None` if the task does not fetch from a host.
+        :rtype: str | None
+        """
+        source = getattr(self.definition, 'source', None)
+        if not isinstance(source, str):
+            return None
+        return urlsplit(source).netloc or None
+
+    def stream_destination(self) -> str | None:
+        """Get the remote URI to upload the resource to while it is fetched.
+
+        Tasks that can write their resource as a stream can upload it as it is fetched
+        if :attr:`pis.config.models.Settings.stream_upload` is enabled. In that case,
+        they must set :attr:`streamed` once the resource is uploaded.
+
+        :return: The remote URI of the resource, or `None` if it must not be streamed.
+        :rtype: str | None
+        """
+        remote_uri = settings().remote_uri
+        if not settings().stream_upload or not remote_uri:
+            return None
+        assert isinstance(self.definition, TaskDefinition)
+        return f'{remote_uri}/{self.definition.destination!s}'
+
+    def copy_destination(self, source: str) -> str | None:
+        """Get the remote URI to copy the source to without fetching it.
+
+        Tasks that fetch a single source can have the remote storage copy it straight
+        to the remote URI, if :attr:`pis.config.models.Settings.remote_copy` is enabled
+        and the source is in the same kind of storage. In that case, nothing is staged
+        in the work directory, and they must set :attr:`copied` once it is done.
+
+        :param source: The source the task is going to fetch.
+        :type source: str
+        :return: The remote URI of the resource, or `None` if it must be fetched.
+        :rtype: str | None
+        """
+        remote_uri = settings().remote_uri
+        if not settings().remote_copy or not remote_uri:
+            return None
+        if source.split(':')[0] != remote_uri.split(':')[0]:
+            return None
+        assert isinstance(self.definition, TaskDefinition)
+        return f'{remote_uri}/{self.definition.destination!s}'
+
+    def skip_if_unchanged(self, source: str, info: SourceInfo | None = None) -> bool:
+        """Reuse the resource of the previous run if the source is unchanged.
+
+        Tasks that fetch a single source can call this method at the start of `run`,
+        and return early if it returns `True`. It only does something if
+        :attr:`pis.config.models.Settings.skip_unchanged` is enabled. The metadata
+        recorded in the previous resource is used to ask the source whether it changed.
+        In local runs, the file from the previous run must also still be in the work
+        directory. The metadata fetched while asking the source is kept in
+        :attr:`source_info`.
+
+        :param source: The source the task is going to fetch.
+        :type source: str
+        :param info: Optional. The current metadata of the source, if the task already
+            has it. It is compared with the previous one instead of asking the source.
+        :type info: SourceInfo | None
+        :return: Whether the source is unchanged and the task can be skipped.
+        :rtype: bool
+        """
+        self.source_info = None
+        if not settings().skip_unchanged or self.previous is None or self.previous.source != source:
+            return False
+        assert isinstance(self.definition, TaskDefinition)
+
+        if not settings().remote_uri:
+            local_path = absolute_path(self.definition.destination)
+            if not local_path.is_file():
+                return False
+            if self.previous.size is not None and local_path.stat().st_size != self.previous.size:
+                return False
+
+        previous_info = SourceInfo(**self.previous.model_dump(exclude={'source', 'destination'}))
+        if info is not None:
+            if not info.matches(previous_info):
+                return False
+        else:
+            unchanged, self.source_info = is_unchanged(source, previous_info)
+            if not unchanged:
+                return False
+
+        logger.info(f'source {source} is unchanged since the previous run, skipping')
+        self.unchanged = True
+        self.resource = self.previous.model_copy(update={'destination': str(self.definition.destination)})
+        return True
+
     @report
     def run(self, *, abort: Event) -> Self:
         """Run the task.
@@ -116,6 +244,12 @@ class Task(TaskReporter):
         :rtype: Self
         """
         assert isinstance(self.definition, TaskDefinition)
+        if self.streamed:
+            logger.info('resource already uploaded while it was fetched')
+            return self
+        if self.copied:
+            logger.info('resource already copied by the remote storage')
+            return self
 
         source = absolute_path(self.definition.destination)
         remote_uri = settings().remote_uri
@@ -144,4 +278,32 @@ class Pretask(Task):
 
     The name of the class, converted to snake_case, will be the 'real name' of the pretask,
     which is used to identify the pretask in the registry and in the configuration file.
+
+    Pretasks that generate new tasks hand their definitions to :meth:`emit`, and the
+    step runs them along with the tasks in the configuration file. The step runs the
+    pretasks at the same time, and starts each generated task as soon as it is emitted,
+    so pretasks must not depend on each other.
+
+    :ivar definitions: The task definitions generated by the pretask, only kept when
+        nothing consumes them as they are emitted.
+    :vartype definitions: list[BaseTaskDefinition]
+    :ivar on_emit: Called with each generated task definition as it is emitted, set by
+        the step. It can block until the step is ready to take more tasks.
+    :vartype on_emit: Callable[[BaseTaskDefinition], None] | None
     """
+
+    def __init__(self, definition: BaseTaskDefinition):
+        super().__init__(definition)
+        self.definitions: list[BaseTaskDefinition] = []
+        self.on_emit: Callable[[BaseTaskDefinition], None] | None = None
+
+    def emit(self, definition: BaseTaskDefinition):
+        """Add a task definition generated by the pretask.
+
+        :param definition: The task definition.
+        :type definition: BaseTaskDefinition
+        """
+        if self.on_emit is None:
+            self.definitions.append(definition)
+        else:
+            self.on_emit(definition)
@@ -6,9 +6,11 @@ from typing import Self
 
 from loguru import logger
 
-from pis.helpers.download import download
+from pis.helpers import get_remote_storage
+from pis.helpers.download import download, source_info
 from pis.tasks import Resource, Task, TaskDefinition, report, v
 from pis.validators.file import file_exists, file_size
+from pis.validators.storage import remote_file_checksum, remote_file_size
 
 
 @dataclass
@@ -38,14 +40,39 @@ class Download(Task):
     @report
     def run(self, *, abort: Event) -> Self:
         """Download a file from the source URL to the destination path."""
-        download(self.definition.source, self.definition.destination, abort=abort)
-        self.resource = Resource(source=self.definition.source, destination=str(self.definition.destination))
+        if self.skip_if_unchanged(self.definition.source):
+            return self
+
+        info = self.source_info or source_info(self.definition.source)
+        copy_to = self.copy_destination(self.definition.source)
+        if copy_to:
+            get_remote_storage(copy_to).copy(self.definition.source, copy_to, generation=info.generation)
+            self.copied = True
+        else:
+            upload_to = self.stream_destination()
+            download(self.definition.source, self.definition.destination, abort=abort, info=info, upload_to=upload_to)
+            self.streamed = upload_to is not None
+        self.resource = Resource(
+            source=self.definition.source,
+            destination=str(self.definition.destination),
+            **info.model_dump(exclude={'accepts_ranges'}),
+        )
         logger.debug('download successful')
         return self
 
     @report
     def validate(self, *, abort: Event) -> Self:
         """Check that the downloaded file exists and has a valid size."""
+        # copied files are never local, the copy is checked against the source
+        if self.copied:
+            v(remote_file_checksum, self.definition.source, self.copy_destination(self.definition.source))
+            return self
+
+        # streamed downloads may not have a local copy, the uploaded file is checked
+        if self.streamed:
+            v(remote_file_size, self.stream_destination(), self.resource.size)
+            return self
+
         v(file_exists, self.definition.destination)
 
         # skip size validation for google spreadsheet
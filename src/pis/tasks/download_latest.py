@@ -7,8 +7,9 @@ from typing import Self
 from loguru import logger
 
 from pis.helpers import get_remote_storage
-from pis.helpers.download import download
-from pis.tasks import Resource, Task, TaskDefinition, report
+from pis.helpers.download import SourceInfo, download
+from pis.tasks import Resource, Task, TaskDefinition, report, v
+from pis.validators.storage import remote_file_checksum
 
 
 @dataclass
@@ -18,14 +19,16 @@ class DownloadLatestDefinition(TaskDefinition):
     This task has the following custom configuration fields:
         - source str: The prefix from where the file with the latest modification date will
             be downloaded.
-        - pattern str: Optional. The pattern to match files against. The pattern should be
-            a simple string match, preceded by an exclamation mark to exclude files. For
-            example, 'foo' will match all files containing 'foo', while '!foo' will exclude
-            all files containing 'foo'.
+        - pattern str | list[str]: Optional. The pattern, or list of patterns, to match
+            files against. A pattern can be a simple string match, a glob if it contains
+            any of `*?[`, or a regular expression if it starts with `re:`, and excludes
+            files if it is preceded by an exclamation mark. For example, 'foo' will match
+            all files containing 'foo', while ['*.csv', '!foo'] will match all csv files
+            except those containing 'foo'. See :func:`pis.helpers.compile_pattern`.
     """
 
     source: str
-    pattern: str | None = None
+    pattern: str | list[str] | None = None
 
 
 class DownloadLatest(Task):
@@ -44,19 +47,34 @@ class DownloadLatest(Task):
         if not files:
             raise ValueError(f'no files found in {self.definition.source} with pattern {self.definition.pattern}')
 
-        newest_file = files.pop(0)
-
-        if len(files):
-            mtime = remote_storage.stat(newest_file)['mtime']
-
-            for file in files:
-                new_mtime = remote_storage.stat(file).get('mtime', 0)
-                if remote_storage.stat(file).get('mtime', 0) > mtime:
-                    newest_file = file
-                    mtime = new_mtime
+        # the listing carries the metadata, so no further requests are needed
+        newest = max(files, key=lambda f: f.mtime or 0)
+        newest_file = newest.uri
+        info = SourceInfo(size=newest.size, generation=newest.generation, checksum=newest.checksum)
 
         logger.info(f'latest file is {newest_file}')
-        download(newest_file, destination)
-        self.resource = Resource(source=newest_file, destination=str(destination))
+        if self.skip_if_unchanged(newest_file, info):
+            return self
+
+        copy_to = self.copy_destination(newest_file)
+        if copy_to:
+            get_remote_storage(copy_to).copy(newest_file, copy_to, generation=info.generation)
+            self.copied = True
+        else:
+            upload_to = self.stream_destination()
+            download(newest_file, destination, abort=abort, info=info, upload_to=upload_to)
+            self.streamed = upload_to is not None
+        self.resource = Resource(
+            source=newest_file,
+            destination=str(destination),
+            **info.model_dump(exclude={'accepts_ranges'}),
+        )
         logger.info('download successful')
         return self
+
+    @report
+    def validate(self, *, abort: Event) -> Self:
+        """Check that a copied file is identical to its source."""
+        if self.copied:
+            v(remote_file_checksum, self.resource.source, self.copy_destination(self.resource.source))
+        return self
@@ -1,11 +1,18 @@
 """Download select fields from all documents in a series of ElasticSearch indexes."""
 
 import json
+import random
+import shutil
 import sys
+import time
+import zlib
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from threading import Event
-from typing import Any, Self
+from threading import Event, Lock
+from typing import IO, Any, Self
+from urllib.parse import urlsplit
 
 import elasticsearch
 import elasticsearch.helpers
@@ -14,34 +21,93 @@ from elasticsearch.exceptions import ElasticsearchException
 from elasticsearch.helpers import ScanError
 from loguru import logger
 
+from pis.config import settings
+from pis.helpers import get_remote_storage
 from pis.tasks import Resource, Task, TaskDefinition, report, v
-from pis.util.errors import TaskAbortedError
+from pis.util.compression import compression, open_compressed
+from pis.util.errors import PISError, TaskAbortedError
 from pis.util.fs import absolute_path, check_fs
 from pis.util.misc import list_str
-from pis.validators.elasticsearch import counts
+from pis.validators.elasticsearch import counts, sampled_docs
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 BUFFER_SIZE = 20000
+# default connection pool size of the elasticsearch client
+ES_POOL_SIZE = 10
+
+
+def _loads(line: bytes) -> Any:
+    """Parse a line of JSON, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
 
 
 class ElasticsearchError(Exception):
     """Base class for Elasticsearch errors."""
 
 
+def _dumps(doc: dict[str, Any]) -> bytes:
+    """Serialize a document into a line of JSON, with orjson if it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(doc)
+        except TypeError:
+            # orjson refuses some values json accepts, like integers over 64 bits
+            pass
+    return json.dumps(doc, separators=(',', ':')).encode()
+
+
 @dataclass
 class ElasticsearchDefinition(TaskDefinition):
     """Configuration fields for the elasticsearch task.
 
     This task has the following custom configuration fields:
         - url (str): The URL of the ElasticSearch instance.
-        - destination (str): The path to write the documents to.
+        - destination (str): The path to write the documents to, as JSON lines. It is
+            compressed with gzip if it ends in `.gz`, or with zstd if it ends in `.zst`.
         - index (str): The index to scan.
         - fields (list[str]): The fields to include in the documents
+        - slices (int): Optional. The number of slices the scroll is split into. Each
+            slice is scanned concurrently into its own part file, and the parts are
+            concatenated into the destination at the end. Defaults to 1, which scans
+            the index in a single scroll. Incremental exports are never sliced.
+        - scroll_size (int): Optional. The number of documents fetched in each scroll
+            request. Defaults to 5000.
+        - scroll (str): Optional. How long the server keeps the scroll context alive
+            between requests. Defaults to 5m.
+        - request_timeout (int): Optional. The timeout of each request, in seconds.
+            Defaults to 120.
+        - http_compress (bool): Optional. Whether to gzip the requests and responses.
+            Defaults to True, as documents compress well and servers are often remote.
+        - sample_size (int): Optional. The number of documents picked at random while
+            exporting, that are fetched again and compared when validating. Defaults to
+            0, which only compares the document counts.
+        - incremental_field (str): Optional. A field whose value only grows when a
+            document is added or updated, like a timestamp. If set, only documents at
+            least as new as the newest in the previous export are fetched, and merged
+            with it. See :meth:`Elasticsearch._scan_incremental`.
+        - key_field (str): Optional. A field that identifies each document, used to
+            replace updated documents in the previous export. Required if
+            `incremental_field` is set, and must be one of `fields`.
     """
 
     url: str
     destination: Path
     index: str
     fields: list[str]
+    slices: int = 1
+    scroll_size: int = 5000
+    scroll: str = '5m'
+    request_timeout: int = 120
+    http_compress: bool = True
+    sample_size: int = 0
+    incremental_field: str | None = None
+    key_field: str | None = None
 
 
 class Elasticsearch(Task):
@@ -49,6 +115,12 @@ class Elasticsearch(Task):
 
     This task will scan an ElasticSearch index and write the selected fields from each document
     to a file.
+
+    While writing, the task keeps count of the documents and an order-independent
+    checksum of the lines, so the output does not need to be read again to validate
+    it. See :attr:`ElasticsearchDefinition.sample_size` to also check the contents.
+    The checksum is the sum of the crc32 of the lines, modulo 2^32, and is stored in
+    the resource as `crc32sum:<hex>`, so exports can be compared across runs.
     """
 
     def __init__(self, definition: TaskDefinition):
@@ -57,6 +129,48 @@ class Elasticsearch(Task):
         self.es: Es
         self.doc_count: int = 0
         self.doc_written: int = 0
+        self.doc_checksum: int = 0
+        self.samples: list[dict[str, Any]] = []
+        self.watermark: str | None = None
+        self._sample_seen: int = 0
+        # slices of the task add up their written documents and samples
+        self._lock = Lock()
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Leave the lock out when the task is sent to a worker process."""
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict[str, Any]):
+        """Give the task a new lock when it arrives in a worker process."""
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def host(self) -> str | None:
+        """Get the host of the Elasticsearch instance."""
+        return urlsplit(self.definition.url).netloc or None
+
+    def _connect(self):
+        """Connect to Elasticsearch and get the document count of the index."""
+        url, index = self.definition.url, self.definition.index
+        logger.debug(f'connecting to elasticsearch at {url}')
+        try:
+            # each slice keeps a connection busy, so the pool must fit them all
+            self.es = Es(
+                url,
+                maxsize=max(self.definition.slices, ES_POOL_SIZE),
+                timeout=self.definition.request_timeout,
+                http_compress=self.definition.http_compress,
+            )
+        except ElasticsearchException as e:
+            raise ElasticsearchError(f'connection error: {e}')
+
+        try:
+            self.doc_count = self.es.count(index=index)['count']
+        except ElasticsearchException as e:
+            raise ElasticsearchError(f'error getting index count on index {index}: {e}')
+        logger.info(f'index {index} has {self.doc_count} documents')
 
     def _close_es(self):
         """Close the Elasticsearch connection."""
@@ -64,22 +178,242 @@ class Elasticsearch(Task):
             self.es.close()
             del self.es
 
-    def _write_docs(self, docs: list[dict[str, Any]], destination: Path):
-        """Write documents to the destination file."""
+    def _write_docs(self, docs: list[dict[str, Any]], f: IO[bytes], destination: Path) -> int:
+        """Write documents to the destination file, returning the bytes written."""
         try:
-            with open(destination, 'a+') as f:
-                for d in docs:
-                    json.dump(d, f)
-                    f.write('\n')
-            self.doc_written += len(docs)
+            lines = [_dumps(d) + b'\n' for d in docs]
+            data = b''.join(lines)
+            f.write(data)
+            # the sum of the line checksums does not depend on the order slices write in
+            checksum = sum(map(zlib.crc32, lines))
+            with self._lock:
+                self.doc_written += len(docs)
+                self.doc_checksum = (self.doc_checksum + checksum) % 2**32
 
         except OSError as e:
-            self._close_es()
             raise ElasticsearchError(f'error writing to {destination}: {e}')
 
         logger.debug(f'wrote {len(docs)} ({self.doc_written}/{self.doc_count}) documents to {destination}')
         logger.debug(f'the dict was taking up {sys.getsizeof(docs)} bytes of memory')
         docs.clear()
+        return len(data)
+
+    def _sample(self, hit: dict[str, Any]):
+        """Keep a uniform random sample of the documents, with reservoir sampling."""
+        doc = {'_index': hit['_index'], '_id': hit['_id'], '_source': hit['_source']}
+        with self._lock:
+            self._sample_seen += 1
+            if len(self.samples) < self.definition.sample_size:
+                self.samples.append(doc)
+            elif (i := random.randrange(self._sample_seen)) < self.definition.sample_size:
+                self.samples[i] = doc
+
+    def _log_throughput(self, docs: int, size: int, start: float, destination: Path):
+        """Log how fast documents are being fetched and written."""
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        docs_s = docs / elapsed
+        mib_s = size / elapsed / 1024 / 1024
+        logger.debug(f'batch of {docs} documents to {destination} at {docs_s:.0f} docs/s, {mib_s:.2f} MiB/s')
+
+    def _write_hits(self, hits: Iterator[dict[str, Any]], f: IO[bytes], destination: Path, *aborts: Event | None):
+        """Write the documents of a series of hits, in batches of :data:`BUFFER_SIZE`.
+
+        The writing stops when any of the `aborts` events is set.
+        """
+        buffer: list[dict[str, Any]] = []
+        start = time.perf_counter()
+        for hit in hits:
+            buffer.append(hit['_source'])
+            if self.definition.sample_size:
+                self._sample(hit)
+            if len(buffer) >= BUFFER_SIZE:
+                logger.trace('flushing buffer')
+                docs = len(buffer)
+                size = self._write_docs(buffer, f, destination)
+                self._log_throughput(docs, size, start, destination)
+                start = time.perf_counter()
+
+                # we can use this moment to check for abort signals and bail out
+                if any(a and a.is_set() for a in aborts):
+                    raise TaskAbortedError
+
+        self._write_docs(buffer, f, destination)
+
+    def _scan(self, query: dict[str, Any], destination: Path, *aborts: Event | None):
+        """Scan the index with a scroll, writing the documents to the destination.
+
+        The file is kept open for the whole scan, and compressed according to the
+        suffix of the task destination, see :func:`pis.util.compression.compression`.
+        The scan stops when any of the `aborts` events is set.
+        """
+        index = self.definition.index
+        kind = compression(Path(self.definition.destination))
+        try:
+            with open_compressed(destination, 'wb', kind) as f:
+                hits = elasticsearch.helpers.scan(
+                    client=self.es,
+                    index=index,
+                    query={**query, 'query': {'match_all': {}}, '_source': self.definition.fields},
+                    size=self.definition.scroll_size,
+                    scroll=self.definition.scroll,
+                    request_timeout=self.definition.request_timeout,
+                )
+                self._write_hits(hits, f, destination, *aborts)
+        except ScanError as e:
+            logger.warning(f'error scanning index {index}: {e}')
+            raise ElasticsearchError(f'error scanning index {index}: {e}')
+        except (OSError, ValueError) as e:
+            raise ElasticsearchError(f'error writing to {destination}: {e}')
+
+    def _fetch_previous(self, destination: Path) -> Path | None:
+        """Get the previous export next to the destination, if there is one to update."""
+        if self.previous is None or self.previous.watermark is None:
+            logger.info('no previous export, exporting the whole index')
+            return None
+
+        path = destination.with_name(f'{destination.name}.previous')
+        check_fs(path)
+        remote_uri = settings().remote_uri
+        try:
+            if remote_uri:
+                get_remote_storage(remote_uri).download_to_file(f'{remote_uri}/{self.definition.destination!s}', path)
+            else:
+                destination.rename(path)
+        except (PISError, OSError) as e:
+            logger.warning(f'previous export not available, exporting the whole index: {e}')
+            return None
+        return path
+
+    def _restore_previous(self, path: Path, destination: Path):
+        """Put the previous export back after a failed export, so the next run can update it."""
+        try:
+            if settings().remote_uri:
+                path.unlink(missing_ok=True)
+            else:
+                path.replace(destination)
+        except OSError as e:
+            logger.warning(f'could not restore the previous export: {e}')
+
+    def _search_after(self, query: dict[str, Any]) -> Iterator[dict[str, Any]]:
+        """Iterate over the hits of a query, sorted by the incremental and key fields."""
+        body: dict[str, Any] = {
+            'size': self.definition.scroll_size,
+            'query': query,
+            '_source': self.definition.fields,
+            'sort': [{self.definition.incremental_field: 'asc'}, {self.definition.key_field: 'asc'}],
+        }
+        while True:
+            r = self.es.search(index=self.definition.index, body=body, request_timeout=self.definition.request_timeout)
+            hits = r['hits']['hits']
+            if not hits:
+                return
+            yield from hits
+            body['search_after'] = hits[-1]['sort']
+
+    def _merge_previous(self, path: Path, keys: set[Any], f: IO[bytes], destination: Path, abort: Event | None):
+        """Append the documents of the previous export that were not updated.
+
+        The merging stops when the `abort` event is set.
+        """
+        key_field = self.definition.key_field
+        lines: list[bytes] = []
+
+        def flush():
+            f.write(b''.join(lines))
+            checksum = sum(map(zlib.crc32, lines))
+            self.doc_written += len(lines)
+            self.doc_checksum = (self.doc_checksum + checksum) % 2**32
+            lines.clear()
+
+        with open_compressed(path, 'rb', compression(Path(self.definition.destination))) as p:
+            for line in p:
+                # every line is parsed to find its key, unless no document was updated
+                if keys and _loads(line).get(key_field) in keys:
+                    continue
+                lines.append(line if line.endswith(b'\n') else line + b'\n')
+                if len(lines) >= BUFFER_SIZE:
+                    flush()
+                    if abort and abort.is_set():
+                        raise TaskAbortedError
+            flush()
+
+    def _scan_incremental(self, destination: Path, previous: Path | None, abort: Event | None):
+        """Export the documents added or updated since the previous export, and merge them.
+
+        Documents whose incremental field is greater than or equal to the watermark of
+        the previous export are fetched with `search_after`, sorted by the incremental
+        field, so documents sharing the value of the watermark are not missed. Then,
+        the documents of the previous export are appended, except those that were
+        fetched again. The greatest value of the incremental field becomes the new watermark.
+
+        .. note:: Documents deleted from the index are not removed from the export, so
+            the count validation will fail if any were. Removing the previous export
+            from the manifest will make the next run export the whole index again.
+        """
+        field, index = self.definition.incremental_field, self.definition.index
+        assert field is not None
+        watermark = json.loads(self.previous.watermark) if previous and self.previous else None
+        query = {'range': {field: {'gte': watermark}}} if watermark is not None else {'match_all': {}}
+        keys: set[Any] = set()
+
+        def hits() -> Iterator[dict[str, Any]]:
+            nonlocal watermark
+            for hit in self._search_after(query):
+                # keys are only needed to leave out the updated documents of a previous export
+                if previous:
+                    keys.add(hit['_source'].get(self.definition.key_field))
+                watermark = hit['sort'][0]
+                yield hit
+
+        try:
+            with open_compressed(destination, 'wb', compression(Path(self.definition.destination))) as f:
+                self._write_hits(hits(), f, destination, abort)
+                logger.info(f'exported {self.doc_written} documents changed since the previous export')
+                if previous:
+                    self._merge_previous(previous, keys, f, destination, abort)
+        except ElasticsearchException as e:
+            raise ElasticsearchError(f'error searching index {index}: {e}')
+        except (OSError, ValueError) as e:
+            raise ElasticsearchError(f'error writing to {destination}: {e}')
+
+        self.watermark = json.dumps(watermark) if watermark is not None else None
+
+    def _scan_sliced(self, destination: Path, abort: Event | None):
+        """Scan the index in concurrent slices, then concatenate them into the destination."""
+        slices = self.definition.slices
+        parts = [destination.with_name(f'{destination.name}.part{i:03d}') for i in range(slices)]
+        logger.debug(f'scanning index {self.definition.index} in {slices} slices')
+
+        # a failed slice stops the others, as well as an abort from another task
+        failed = Event()
+
+        def scan_slice(i: int):
+            try:
+                self._scan({'slice': {'id': i, 'max': slices}}, parts[i], abort, failed)
+            except Exception:
+                failed.set()
+                raise
+
+        try:
+            with ThreadPoolExecutor(slices) as pool:
+                futures = [pool.submit(scan_slice, i) for i in range(slices)]
+            # raise the error that made the slices stop, rather than their aborts
+            errors = [e for e in (f.exception() for f in futures) if e is not None]
+            errors.sort(key=lambda e: isinstance(e, TaskAbortedError))
+            if errors:
+                raise errors[0]
+
+            # compressed parts can be concatenated as they are, both gzip members and
+            # zstd frames are decompressed one after another
+            with open(destination, 'wb') as f:
+                for part in parts:
+                    with open(part, 'rb') as p:
+                        shutil.copyfileobj(p, f)
+        except OSError as e:
+            raise ElasticsearchError(f'error writing to {destination}: {e}')
+        finally:
+            for part in parts:
+                part.unlink(missing_ok=True)
 
     @report
     def run(self, *, abort: Event) -> Self:
@@ -87,56 +421,50 @@ class Elasticsearch(Task):
         index = self.definition.index
         fields = self.definition.fields
         destination = absolute_path(self.definition.destination)
-        check_fs(destination)
-
-        logger.debug(f'connecting to elasticsearch at {url}')
+        incremental = self.definition.incremental_field is not None
+        if incremental and self.definition.key_field not in fields:
+            raise ElasticsearchError('incremental exports need a key_field that is one of the fields')
+        # the previous export must be set aside before the destination is cleared, and
+        # it is only removed once the merged export has been written
+        previous = self._fetch_previous(destination) if incremental else None
         try:
-            self.es = Es(url)
-        except ElasticsearchException as e:
-            self._close_es()
-            raise ElasticsearchError(f'connection error: {e}')
+            check_fs(destination)
+            self._connect()
+            logger.debug(f'scanning index {index} with fields {list_str(fields)}')
 
-        logger.debug(f'scanning index {index} with fields {list_str(fields)}')
-        try:
-            self.doc_count = self.es.count(index=index)['count']
-        except ElasticsearchException as e:
+            # the connection is shared by the slices, so it is only closed once all are done
+            start = time.perf_counter()
+            if incremental:
+                self._scan_incremental(destination, previous, abort)
+            elif self.definition.slices > 1:
+                self._scan_sliced(destination, abort)
+            else:
+                self._scan({}, destination, abort)
+        except BaseException:
+            if previous:
+                self._restore_previous(previous, destination)
+            raise
+        finally:
             self._close_es()
-            raise ElasticsearchError(f'error getting index count on index {index}: {e}')
-        logger.info(f'index {index} has {self.doc_count} documents')
+        if previous:
+            previous.unlink(missing_ok=True)
 
-        buffer: list[dict[str, Any]] = []
-        try:
-            for hit in elasticsearch.helpers.scan(
-                client=self.es,
-                index=index,
-                query={'query': {'match_all': {}}, '_source': fields},
-            ):
-                buffer.append(hit['_source'])
-                if len(buffer) >= BUFFER_SIZE:
-                    logger.trace('flushing buffer')
-                    self._write_docs(buffer, destination)
-                    buffer.clear()
-
-                    # we can use this moment to check for abort signals and bail out
-                    if abort and abort.is_set():
-                        raise TaskAbortedError
-        except ScanError as e:
-            logger.warning(f'error scanning index {index}: {e}')
-            raise ElasticsearchError(f'error scanning index {index}: {e}')
-
-        self._write_docs(buffer, destination)
+        elapsed = max(time.perf_counter() - start, 1e-6)
         logger.debug(f'wrote {self.doc_written}/{self.doc_count} documents to {destination}')
-        self.resource = Resource(source=f'{url}/{index}', destination=str(self.definition.destination))
-        self._close_es()
+        logger.info(f'exported index {index} in {elapsed:.1f}s at {self.doc_written / elapsed:.0f} docs/s')
+        logger.info(f'exported {self.doc_written} documents with checksum {self.doc_checksum:08x}')
+        self.resource = Resource(
+            source=f'{url}/{index}',
+            destination=str(self.definition.destination),
+            checksum=f'crc32sum:{self.doc_checksum:08x}',
+            watermark=self.watermark,
+        )
         return self
 
     @report
     def validate(self, *, abort: Event) -> Self:
-        v(
-            counts,
-            self.definition.url,
-            self.definition.index,
-            self.definition.destination,
-        )
+        v(counts, self.definition.index, self.doc_count, self.doc_written)
+        if self.samples:
+            v(sampled_docs, self.definition.url, self.samples, self.definition.fields)
 
         return self
@@ -1,8 +1,7 @@
 """Pretask — explode tasks based on a list of dictionaries."""
 
-import json
 import sys
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator
 from dataclasses import dataclass
 from threading import Event
 from typing import Any, Self, cast
@@ -10,7 +9,8 @@ from typing import Any, Self, cast
 import jq
 from loguru import logger
 
-from pis.config import scratchpad, task_definitions
+from pis.config import scratchpad
+from pis.config.scratchpad import Scratchpad
 from pis.helpers.download import download
 from pis.tasks import Pretask, PretaskDefinition, TaskDefinition, report
 from pis.util.misc import list_str
@@ -27,7 +27,7 @@ class ExplodeDefinition(PretaskDefinition):
             over. Each item in the list will be used to replace the variables in the
             tasks in the do list.
         - foreach_function (str | None): If set, this function will be called to get
-            the foreach list. The function must return a list of dictionaries.
+            the foreach list. The function must return an iterable of dictionaries.
         - foreach_function_args (dict[str, Any] | None): Arguments to pass to the
             foreach function.
     """
@@ -46,7 +46,13 @@ class Explode(Pretask):
     will be used to replace the variables in the tasks in the `do` list.
 
     If the `foreach` list is not set, the `foreach_function` will be called to get the
-    list of dictionaries. The function must return a list of dictionaries.
+    list of dictionaries. The function must return an iterable of dictionaries, which
+    can be a generator that yields them as it goes.
+
+    The tasks are generated lazily, and each one is emitted as soon as it is exploded,
+    so the step can start running it while the rest are still being generated. The
+    step holds back the explode while the workers catch up, so only a bounded number
+    of tasks is in memory at any time, however big the `foreach` list is.
     """
 
     def __init__(self, definition: TaskDefinition):
@@ -74,40 +80,48 @@ class Explode(Pretask):
                 logger.critical(f'function {foreach_function} not found')
                 sys.exit(1)
 
-            func = cast(Callable[..., list[dict[str, str]]], func_obj)
+            func = cast(Callable[..., Iterable[dict[str, str]]], func_obj)
             args_str = list_str(foreach_function_args, dict_values=True)
             logger.debug(f'calling function {foreach_function} with args {args_str}')
             foreach = func(**foreach_function_args)
 
-        foreach = foreach or []
-        logger.debug(f'exploding {len(do)} tasks by {len(foreach)} iterations')
+        logger.debug(f'exploding {len(do)} tasks')
         new_tasks = 0
 
-        for d in foreach:
-            for k1, v1 in d.items():
-                scratchpad().store(k1, v1)
-
-            for task in do:
-                task_definition = {k2: scratchpad().replace(v2) for k2, v2 in task.items()}
-                t = TaskDefinition.model_validate(task_definition)
-                task_definitions().append(t)
-                new_tasks += 1
+        for t in self._explode(do, foreach or []):
+            if abort.is_set():
+                logger.warning(f'explode aborted after {new_tasks} new tasks')
+                break
+            self.emit(t)
+            new_tasks += 1
 
         logger.info(f'exploded into {new_tasks} new tasks')
         return self
 
+    def _explode(self, do: list[dict], foreach: Iterable[dict[str, str]]) -> Iterator[TaskDefinition]:
+        for d in foreach:
+            # each iteration gets its own scratchpad, as other pretasks may be exploding too
+            iteration = Scratchpad({**scratchpad().sentinel_dict, **d})
+
+            for task in do:
+                task_definition = {k2: iteration.replace(v2) for k2, v2 in task.items()}
+                yield TaskDefinition.model_validate(task_definition)
+
 
 def urls_from_json(
     source: str,
     destination: str,
     json_path: str,
     prefix: str | None,
-) -> list[dict[str, str]]:
-    """Get a list of URLs from a JSON file.
+) -> Iterator[dict[str, str]]:
+    """Get the URLs in a JSON file.
 
-    This function will download a JSON file from a URL, extract a list of URLs from it
-    using a JQ query, and return a list of dictionaries with the source and destination
-    URLs.
+    This function will download a JSON file from a URL, extract the URLs in it using a
+    JQ query, and yield a dictionary with the source and destination of each one.
+
+    The file is handed to jq as text, without loading it into Python objects first, and
+    the URLs are yielded as jq finds them, so the explode can start emitting tasks
+    before the query is done with the whole document.
 
     :param source: The URL of the JSON file to download.
     :type source: str
@@ -119,17 +133,12 @@ def urls_from_json(
         the destination file names.
     :type prefix: str | None
 
-    :return: A list of dictionaries with the source and destination URLs.
-    :rtype: list[dict[str, str]]
+    :return: An iterator of dictionaries with the source and destination URLs.
+    :rtype: Iterator[dict[str, str]]
     """
     destination_file = download(source, destination)
-    file_content = destination_file.read_text()
-    json_data = json.loads(file_content)
-    srcs = jq.compile(json_path).input_value(json_data).all()
-
-    if prefix:
-        dsts = [source.replace(prefix, '') for source in srcs]
-    else:
-        dsts = [source.split('/')[-1] for source in srcs]
+    urls = jq.compile(json_path).input_text(destination_file.read_text())
 
-    return [{'source': s, 'destination': d} for s, d in zip(srcs, dsts, strict=True)]
+    for url in urls:
+        dst = url.replace(prefix, '') if prefix else url.split('/')[-1]
+        yield {'source': url, 'destination': dst}
@@ -0,0 +1,68 @@
+"""Compression utilities."""
+
+import gzip
+import io
+from pathlib import Path
+from typing import IO, Literal
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSIONS = Literal['gzip', 'zstd']
+"""Compression formats that files can be written and read in."""
+
+# compression format for each file suffix
+SUFFIXES: dict[str, COMPRESSIONS] = {
+    '.gz': 'gzip',
+    '.gzip': 'gzip',
+    '.zst': 'zstd',
+    '.zstd': 'zstd',
+}
+# size of the buffer used for uncompressed files
+BUFFER_SIZE = 1024 * 1024
+# gzip level 6 is much faster than the default 9, and barely bigger
+GZIP_LEVEL = 6
+
+
+def compression(path: Path) -> COMPRESSIONS | None:
+    """Get the compression format of a file from its suffix.
+
+    :param path: The path of the file.
+    :type path: Path
+    :return: The compression format, or `None` if the file is not compressed.
+    :rtype: COMPRESSIONS | None
+    """
+    return SUFFIXES.get(path.suffix.lower())
+
+
+def open_compressed(path: Path, mode: Literal['rb', 'wb'], kind: COMPRESSIONS | None = None) -> IO[bytes]:
+    """Open a binary file, compressing or decompressing it as a stream.
+
+    The compression format is inferred from the suffix of the file, unless it is
+    given. zstd needs the optional `zstandard` package.
+
+    :param path: The path of the file.
+    :type path: Path
+    :param mode: The mode to open the file in, `rb` or `wb`.
+    :type mode: Literal['rb', 'wb']
+    :param kind: Optional. The compression format, see :func:`compression`.
+    :type kind: COMPRESSIONS | None
+    :return: A buffered binary stream.
+    :rtype: IO[bytes]
+    :raises ValueError: If the file is zstd compressed and `zstandard` is missing.
+    """
+    kind = kind or compression(path)
+
+    if kind == 'gzip':
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)  # type: ignore[return-value]
+    if kind == 'zstd':
+        if zstandard is None:
+            raise ValueError(f'zstandard must be installed to open {path}, install pis with the zstd extra')
+        f = open(path, mode)  # noqa: SIM115
+        if mode == 'wb':
+            return zstandard.ZstdCompressor().stream_writer(f, closefd=True)  # type: ignore[return-value]
+        # the zstd reader cannot be iterated over lines on its own
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f, closefd=True))  # type: ignore[arg-type]
+    return open(path, mode, buffering=BUFFER_SIZE)  # noqa: SIM115
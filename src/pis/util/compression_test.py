@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pytest
+
+from pis.util.compression import compression, open_compressed
+
+
+@pytest.mark.parametrize(
+    ('name', 'result'),
+    [
+        ('file.jsonl', None),
+        ('file.jsonl.gz', 'gzip'),
+        ('file.JSONL.GZ', 'gzip'),
+        ('file.jsonl.zst', 'zstd'),
+        ('file.gz.part000', None),
+    ],
+)
+def test_compression(name, result):
+    assert compression(Path(name)) == result
+
+
+@pytest.mark.parametrize('name', ['file.jsonl', 'file.jsonl.gz'])
+def test_open_compressed_roundtrip(tmp_path, name):
+    path = tmp_path / name
+
+    with open_compressed(path, 'wb') as f:
+        f.write(b'{"a":1}\n{"a":2}\n')
+
+    with open_compressed(path, 'rb') as f:
+        assert f.read() == b'{"a":1}\n{"a":2}\n'
+
+
+def test_open_compressed_explicit_kind(tmp_path):
+    path = tmp_path / 'file.jsonl.gz.part000'
+
+    with open_compressed(path, 'wb', 'gzip') as f:
+        f.write(b'{"a":1}\n')
+
+    assert path.read_bytes().startswith(b'\x1f\x8b')
+
+
+def test_open_compressed_concatenated_gzip(tmp_path):
+    parts = [tmp_path / 'part0.gz', tmp_path / 'part1.gz']
+    for part in parts:
+        with open_compressed(part, 'wb') as f:
+            f.write(b'{"a":1}\n{"a":2}\n')
+    path = tmp_path / 'file.jsonl.gz'
+    path.write_bytes(b''.join(p.read_bytes() for p in parts))
+
+    with open_compressed(path, 'rb') as f:
+        assert f.read() == b'{"a":1}\n{"a":2}\n' * 2
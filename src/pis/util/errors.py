@@ -81,3 +81,25 @@ class ValidationError(PISError):
 
 class PreconditionFailedError(PISError):
     """Raise when a precondition fails."""
+
+
+class ThrottledError(PISError):
+    """Raise when a source asks to slow down, with a 429 or 503 status code.
+
+    The task is not failed, it is queued again by the step to be retried later. See
+    :mod:`pis.step.scheduler`.
+    """
+
+    def __init__(self, src: str, retry_after: float | None = None):
+        self.retry_after = retry_after
+        msg = f'{src} is throttling requests'
+        if retry_after is not None:
+            msg += f', retry after {retry_after:.1f}s'
+        super().__init__(msg)
+
+
+class DependencyError(PISError):
+    """Raise when the dependencies between the tasks of a step cannot be resolved."""
+
+    def __init__(self, msg: str):
+        super().__init__(msg)
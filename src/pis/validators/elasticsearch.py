@@ -1,42 +1,61 @@
 """Validators for Elasticsearch."""
 
-import subprocess
-from pathlib import Path
+from typing import Any
 
 from elasticsearch import Elasticsearch as Es
+from elasticsearch.exceptions import ElasticsearchException
 from loguru import logger
 
-from pis.util.fs import absolute_path
 
+def counts(index: str, doc_count: int, doc_written: int) -> bool:
+    """Check if the document counts in the index and in the export match.
 
-# fastest way to count lines is calling wc -l
-def _wccount(filename):
-    out = subprocess.Popen(
-        ['/usr/bin/wc', '-l', filename],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    ).communicate()[0]
-    return int(out.partition(b' ')[0])
+    Both counts are the ones kept by the task: the count of the index it fetched when
+    the export started, and the documents it wrote. So neither the index nor the output
+    need to be queried again.
 
-
-def counts(url: str, index: str, local_path: Path) -> bool:
-    """Check if the document counts at the remote and local locations match.
-
-    :param url: The URL of the ElasticSearch instance.
-    :type url: str
-    :param index: The index to scan.
+    :param index: The index that was exported.
     :type index: str
-    :param local_path: The path where the documents are stored locally.
-    :type local_path: Path
+    :param doc_count: The number of documents in the index.
+    :type doc_count: int
+    :param doc_written: The number of documents written locally.
+    :type doc_written: int
 
     :return: True if the document counts match, False otherwise.
     :rtype: bool
     """
-    logger.debug(f'checking if document counts at {url}/{index} and {local_path} match')
+    logger.debug(f'checking if document counts in {index} and the export match: {doc_count} == {doc_written}')
+    return doc_count == doc_written
+
+
+def sampled_docs(url: str, docs: list[dict[str, Any]], fields: list[str]) -> bool:
+    """Check if a sample of exported documents matches the documents in the index.
 
-    es = Es(url)
-    remote_doc_count = es.count(index=index)['count']
-    local_doc_count = _wccount(absolute_path(local_path))
+    The documents are fetched again in a single request, and their selected fields
+    compared with those that were written.
 
-    logger.debug(f'checking if {remote_doc_count} == {local_doc_count}')
-    return remote_doc_count == local_doc_count
+    :param url: The URL of the ElasticSearch instance.
+    :type url: str
+    :param docs: The exported documents, with their `_index`, `_id` and `_source`.
+    :type docs: list[dict[str, Any]]
+    :param fields: The fields that were exported.
+    :type fields: list[str]
+
+    :return: True if all the documents match, False otherwise.
+    :rtype: bool
+    """
+    logger.debug(f'checking {len(docs)} sampled documents against {url}')
+
+    body = {'docs': [{'_index': d['_index'], '_id': d['_id'], '_source': fields} for d in docs]}
+    try:
+        with Es(url) as es:
+            remote_docs = es.mget(body=body)['docs']
+    except ElasticsearchException as e:
+        logger.error(f'error fetching sampled documents: {e}')
+        return False
+
+    mismatches = [d['_id'] for d, r in zip(docs, remote_docs, strict=True) if r.get('_source') != d['_source']]
+    if mismatches:
+        logger.error(f'{len(mismatches)} sampled documents do not match, e.g. {mismatches[0]}')
+        return False
+    return True
@@ -0,0 +1,64 @@
+"""Validators for files in remote storage."""
+
+from loguru import logger
+
+from pis.helpers import get_remote_storage
+from pis.util.errors import NotFoundError
+
+
+def remote_file_size(uri: str, size: int | None) -> bool:
+    """Check if a file in remote storage exists and has the expected size.
+
+    :param uri: The URI of the remote file.
+    :type uri: str
+    :param size: The expected size of the file, if known.
+    :type size: int | None
+
+    :return: True if the file exists and its size matches, False otherwise.
+    :rtype: bool
+    """
+    logger.debug(f'checking if {uri} exists and is {size} bytes')
+
+    try:
+        remote_size = get_remote_storage(uri).stat(uri)['size']
+    except NotFoundError:
+        logger.error(f'{uri} not found')
+        return False
+
+    if size is None:
+        logger.warning('no expected size, cannot validate file size')
+        return True
+
+    logger.debug(f'checking if {remote_size} == {size}')
+    return remote_size == size
+
+
+def remote_file_checksum(src: str, uri: str) -> bool:
+    """Check if a file in remote storage is identical to another one.
+
+    The checksums reported by the storage are compared. If any of them is missing,
+    the sizes are compared instead.
+
+    :param src: The URI of the original file.
+    :type src: str
+    :param uri: The URI of the file to check.
+    :type uri: str
+
+    :return: True if both files exist and are identical, False otherwise.
+    :rtype: bool
+    """
+    logger.debug(f'checking if {uri} is identical to {src}')
+
+    try:
+        src_stat = get_remote_storage(src).stat(src)
+        stat = get_remote_storage(uri).stat(uri)
+    except NotFoundError as e:
+        logger.error(f'{e} not found')
+        return False
+
+    if src_stat.get('checksum') is None or stat.get('checksum') is None:
+        logger.warning('no checksum, comparing file sizes')
+        return src_stat['size'] == stat['size']
+
+    logger.debug(f'checking if {stat['checksum']} == {src_stat['checksum']}')
+    return stat['checksum'] == src_stat['checksum']